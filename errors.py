@@ -87,6 +87,13 @@ def clear_errors():
     _num_errors = 0
 
 
+def clear_subscribers():
+    '''
+    Remove all subscribers, such as those a forked process inherits.
+    '''
+    del _subscribers[:]
+
+
 @contextmanager
 def subscribe_errors(handler):
     '''
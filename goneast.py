@@ -130,7 +130,11 @@ class ReturnStatement(AST):
 
 
 class FunctionDefinition(AST):
+    '''
+    [INLINE] func_prototype LBRACE block RBRACE
+    '''
     _fields = ['prototype', 'block']
+    inline = False
 
 
 class FunctionPrototype(AST):
@@ -0,0 +1,358 @@
+# gonebin.py
+'''
+Binary files of Gone code.
+
+A program is compiled once into a .gir file holding the functions of
+its GenerateCode object in the encoding of goneir, and the engines and
+gonellvm run the file without importing PLY or going through the front
+end again:
+
+    bash % python3 gonebin.py -O2 tests/functions/mandel.g -o mandel.gir
+    bash % python3 goneinterp.py mandel.gir
+    bash % python3 gonebin.py mandel.gir
+
+Given a .gir file, gonebin.py prints the code it holds.
+
+The file is little endian and made of:
+
+    header      magic b'GONEIR', format version (u16), then the number
+                of opcodes, constants, temporary counters, inline hints
+                and functions (u32 each)
+    opcodes     the names of the opcodes numbered in the file
+    constants   the pool of constants: a tag (s string, i int, f float,
+                b bool, n None) and the value
+    counters    GenerateCode.versions, name and value
+    hints       names of the functions declared inline
+    functions   name, return type and argument types (indexes into the
+                constants), register names, the kind, test and links of
+                every block, then the opcodes, offsets and operands
+                columns of every block
+
+Strings are a u32 length followed by UTF-8.  Columns are a u32 length
+followed by the raw array, so the loader copies each of them out of the
+memory mapped file in one go.  Files of another format version are
+refused rather than misread; bump version when the layout changes.
+'''
+
+import sys
+import mmap
+import struct
+from array import array
+
+import goneir
+from goneir import IRBlock, IRFunction, Program
+
+magic = b'GONEIR'
+version = 1
+
+header = struct.Struct('<6sHIIIII')
+u32 = struct.Struct('<I')
+constant_formats = {
+    'i': struct.Struct('<q'),
+    'f': struct.Struct('<d'),
+    'b': struct.Struct('<?'),
+}
+
+
+class FormatError(ValueError):
+    '''
+    Raised when a file is not Gone code this version can read.
+    '''
+    pass
+
+
+def constant_tag(value):
+    if isinstance(value, str):
+        return 's'
+    if isinstance(value, bool):
+        return 'b'
+    if isinstance(value, int):
+        return 'i'
+    if isinstance(value, float):
+        return 'f'
+    if value is None:
+        return 'n'
+    raise TypeError("cannot store constant {!r}".format(value))
+
+
+class Writer(object):
+    def __init__(self):
+        self.parts = []
+
+    def u32(self, value):
+        self.parts.append(u32.pack(value))
+
+    def string(self, value):
+        data = value.encode('utf-8')
+        self.u32(len(data))
+        self.parts.append(data)
+
+    def column(self, values):
+        self.u32(len(values))
+        if sys.byteorder == 'big' and values.itemsize > 1:
+            values = array(values.typecode, values)
+            values.byteswap()
+        self.parts.append(values.tobytes())
+
+    def constant(self, value):
+        tag = constant_tag(value)
+        self.parts.append(tag.encode('ascii'))
+        if tag == 's':
+            self.string(value)
+        elif tag != 'n':
+            self.parts.append(constant_formats[tag].pack(value))
+
+    def getvalue(self):
+        return b''.join(self.parts)
+
+
+def dumps(program):
+    '''
+    Return the bytes of a goneir Program.
+    '''
+    out = Writer()
+    functions = program.functions
+    # Signatures refer to the pool, which is written first
+    signatures = [[-1 - program.constant(value)
+                   for value in [function.name, function.ret_type] + list(function.arg_types)]
+                  for function in functions]
+    out.parts.append(header.pack(magic, version, len(goneir.opcode_names),
+                                 len(program.constants), len(program.versions),
+                                 len(program.inline_hints), len(functions)))
+    for name in goneir.opcode_names:
+        out.string(name)
+    for value in program.constants:
+        out.constant(value)
+    for name, count in sorted(program.versions.items()):
+        out.string(name)
+        out.u32(count)
+    for name in sorted(program.inline_hints):
+        out.string(name)
+
+    for function, signature in zip(functions, signatures):
+        out.column(array('I', signature))
+        out.u32(len(function.registers))
+        for register in function.registers:
+            out.string(register)
+        out.column(function.kinds)
+        out.column(function.tests)
+        out.column(function.links)
+        for block in function.blocks:
+            out.column(block.opcodes)
+            out.column(block.offsets)
+            out.column(block.operands)
+    return out.getvalue()
+
+
+class Reader(object):
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def take(self, size):
+        if self.pos + size > len(self.data):
+            raise FormatError("truncated file")
+        start = self.pos
+        self.pos += size
+        return self.data[start:self.pos]
+
+    def unpack(self, fmt):
+        return fmt.unpack(self.take(fmt.size))
+
+    def u32(self):
+        return self.unpack(u32)[0]
+
+    def string(self):
+        return bytes(self.take(self.u32())).decode('utf-8')
+
+    def column(self, typecode):
+        values = array(typecode)
+        values.frombytes(self.take(self.u32() * values.itemsize))
+        if sys.byteorder == 'big' and values.itemsize > 1:
+            values.byteswap()
+        return values
+
+    def constant(self):
+        tag = bytes(self.take(1)).decode('ascii')
+        if tag == 's':
+            return self.string()
+        if tag == 'n':
+            return None
+        if tag not in constant_formats:
+            raise FormatError("bad constant tag {!r}".format(tag))
+        return self.unpack(constant_formats[tag])[0]
+
+
+def loads(data):
+    '''
+    Read a goneir Program from bytes or any buffer, such as a memory map.
+    '''
+    read = Reader(data)
+    if len(data) < header.size or bytes(data[:len(magic)]) != magic:
+        raise FormatError("not a Gone code file")
+    (_, file_version, nopcodes, nconstants, nversions,
+     nhints, nfunctions) = read.unpack(header)
+    if file_version != version:
+        raise FormatError("format version {} is not supported (expected {})".format(
+            file_version, version))
+
+    # Opcodes are numbered again in case the table of goneir changed
+    remap = [goneir.intern_opcode(read.string()) for n in range(nopcodes)]
+    renumber = remap != list(range(nopcodes))
+
+    program = Program()
+    for n in range(nconstants):
+        program.constant(read.constant())
+    constants = program.constants
+    for n in range(nversions):
+        name = read.string()
+        program.versions[name] = read.u32()
+    for n in range(nhints):
+        program.inline_hints.add(read.string())
+
+    for n in range(nfunctions):
+        signature = [constants[index] for index in read.column('I')]
+        if len(signature) < 2:
+            raise FormatError("bad function signature")
+        function = IRFunction(signature[0], signature[1], signature[2:])
+        function.registers = [read.string() for r in range(read.u32())]
+        function.kinds = read.column('B')
+        function.tests = read.column('i')
+        function.links = read.column('i')
+        for b in range(len(function.kinds)):
+            block = IRBlock()
+            block.opcodes = read.column('H')
+            if renumber:
+                block.opcodes = array('H', [remap[opcode] for opcode in block.opcodes])
+            block.offsets = read.column('I')
+            block.operands = read.column('i')
+            function.blocks.append(block)
+        program.functions.append(function)
+    return program
+
+
+def dump(program, path):
+    with open(path, 'wb') as f:
+        f.write(dumps(program))
+
+
+def load(path):
+    '''
+    Read a goneir Program from a file, through a memory map.
+    '''
+    with open(path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise FormatError("not a Gone code file")
+        with mapped, memoryview(mapped) as view:
+            return loads(view)
+
+
+def is_code_file(path):
+    '''
+    True if path is a file written by gonebin.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(magic)) == magic
+    except OSError:
+        return False
+
+
+def save_code(gen, path):
+    '''
+    Write the functions of a GenerateCode object to a file.
+    '''
+    dump(goneir.encode(gen), path)
+
+
+def load_code(path):
+    '''
+    Read a file written by save_code into a GenerateCode object.
+    '''
+    return goneir.decode(load(path))
+
+
+parsers = ('lalr', 'pratt')
+
+
+def add_arguments(parser):
+    '''
+    Add the options of the front end to the argparse parser of a driver.
+    '''
+    parser.add_argument('--parser', choices=parsers, default='lalr',
+                        help="lalr: the PLY parser of goneparse (default); "
+                             "pratt: the recursive descent parser of gonepratt")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="lex and parse the source in this many processes with "
+                             "goneparallel (0: one per core, default 1)")
+
+
+def compile_file(path, parser='lalr', jobs=1):
+    '''
+    Return the GenerateCode object of a Gone source file or of a file
+    written by save_code, or None if the source has errors.  The front
+    end is only imported for source files, and PLY's parser only with
+    the lalr parser or when the source has syntax errors.  With jobs
+    other than 1, the source is parsed in processes by goneparallel.
+    '''
+    if is_code_file(path):
+        return load_code(path)
+    import gonescan
+    import gonecheck
+    import gonecode
+    from errors import errors_reported
+    if jobs != 1:
+        import goneparallel
+        program = goneparallel.parse_file(path, parser, jobs)
+    else:
+        if parser == 'pratt':
+            import gonepratt
+            lexer = gonescan.Scanner()
+            parser = gonepratt.make_parser()
+        else:
+            import goneparse
+            lexer = gonescan.make_lexer()
+            parser = goneparse.make_parser()
+        lexer.input_file(path)
+        program = parser.parse(lexer=lexer)
+    gonecheck.check_program(program)
+    if not errors_reported():
+        return gonecode.generate_code(program)
+
+
+def main():
+    import os
+    import argparse
+    import gonepass
+    from goneblock import EmitBlocksVisitor
+    from errors import subscribe_errors
+
+    parser = argparse.ArgumentParser("Compile a Gone program into a .gir file, or print one")
+    parser.add_argument('file', type=str, default='', nargs=1,
+                        help="the file containing Gone source, or a .gir file to print")
+    parser.add_argument('-o', dest='output', metavar='OUTPUT',
+                        help="the file to write (default: the source file with .gir)")
+    parser.add_argument('--ssa', action="store_true",
+                        help="promote variables to SSA temporaries with gonessa first")
+    parser.add_argument('--tail', action="store_true",
+                        help="turn self tail calls into loops with gonetail first")
+    add_arguments(parser)
+    gonepass.add_arguments(parser)
+    args = parser.parse_args()
+    path = args.file[0]
+
+    if is_code_file(path):
+        EmitBlocksVisitor().loop(load_code(path).functions)
+        return
+
+    with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
+        code = compile_file(path, args.parser, args.jobs)
+        if code is not None:
+            gonepass.run_passes(code, args)
+            save_code(code, args.output or os.path.splitext(path)[0] + '.gir')
+
+
+if __name__ == '__main__':
+    main()
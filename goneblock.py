@@ -62,6 +62,34 @@ class EmitBlocksVisitor(BlockVisitor):
         self.visit(block.loop_branch)
 
 
+def walk_blocks(block):
+    '''
+    Generate every block reachable from block through next_block and the
+    branches, in program order.
+    '''
+    while block is not None:
+        yield block
+        for branch in ('true_branch', 'false_branch', 'loop_branch'):
+            yield from walk_blocks(getattr(block, branch, None))
+        block = block.next_block
+
+
+def returns(block):
+    return any(inst[0].startswith('return_') for inst in block.instructions)
+
+
+def phis(block):
+    '''
+    Return the phi instructions at the start of a block.
+    '''
+    result = []
+    for inst in block.instructions:
+        if not inst[0].startswith('phi_'):
+            break
+        result.append(inst)
+    return result
+
+
 class Block(object):
     def __init__(self):
         self.instructions = []   # Instructions in the block
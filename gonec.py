@@ -0,0 +1,383 @@
+# gonec.py
+'''
+Generate C source from Gone SSA instructions.
+
+This backend walks the block graph and instructions produced by gonecode
+and writes portable C, which is then compiled by the system C compiler and
+linked with the Gone runtime in gonert.c.  It produces fast native
+executables without needing llvm or its Python bindings.
+
+Gone names are prefixed to keep them apart from C keywords and the C
+library: variables become v_name, temporaries t__type_N and user functions
+f_name.  Externs keep their name so that they link against the C library.
+The toplevel code becomes __gone_start(), which is called by the main()
+function of gonert.c compiled with GONE_STANDALONE.
+'''
+
+import sys
+
+from errors import error
+from goneblock import phis
+
+ctypes = {
+    'int': 'int',
+    'float': 'double',
+    'bool': 'int',
+    'void': 'void'
+}
+
+binary_operators = {
+    'add': '+',
+    'sub': '-',
+    'mul': '*',
+    'div': '/',
+    'lt': '<',
+    'gt': '>',
+    'lte': '<=',
+    'gte': '>=',
+    'eq': '==',
+    'neq': '!=',
+    'and': '&',
+    'or': '|',
+}
+
+comparisons = {'lt', 'gt', 'lte', 'gte', 'eq', 'neq'}
+
+unary_operators = {
+    'uadd': '+',
+    'usub': '-',
+    'not': '!',
+}
+
+
+class GenerateC(object):
+    '''
+    Generates a C translation unit from the functions in
+    GenerateCode.functions.
+    '''
+    def __init__(self):
+        self.lines = []
+        self.indent = 0
+        self.function_types = {}
+        self.user_functions = set()
+        self.globals = {}
+        self.externs = []
+        self.const_values = {}
+        self.unsupported = set()
+        self.function = None
+
+    def generate(self, toplevel_blocks):
+        '''
+        Return C source for the (name, start_block, ret_type, arg_types)
+        tuples found in GenerateCode.functions.
+        '''
+        for name, start_block, ret_type, arg_types in toplevel_blocks:
+            self.function = name
+            self.user_functions.add(name)
+            self.function_types[name] = ret_type
+            self.find_declarations(start_block)
+
+        body = []
+        for name, start_block, ret_type, arg_types in toplevel_blocks:
+            self.function = name
+            self.lines = []
+            self.generate_function(name, start_block, ret_type, arg_types)
+            body.extend(self.lines)
+
+        self.lines = ["/* Generated by gonec.py */", ""]
+        self.lines.extend("extern void _print_{}({});".format(t, ctypes[t]) for t in ('int', 'float', 'bool'))
+        self.lines.extend(self.externs)
+        self.lines.append("")
+        for name, typename in sorted(self.globals.items()):
+            if name in self.const_values:
+                self.lines.append("static const {} {} = {};".format(
+                    self.ctype(typename), self.variable(name),
+                    self.literal(typename, self.const_values[name])))
+            else:
+                self.lines.append("static {} {};".format(self.ctype(typename), self.variable(name)))
+        self.lines.append("")
+        for name, start_block, ret_type, arg_types in toplevel_blocks:
+            self.function = name
+            self.lines.append(self.signature(name, start_block, ret_type, arg_types) + ";")
+        self.lines.append("")
+        return "\n".join(self.lines + body) + "\n"
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def ctype(self, typename):
+        if typename not in ctypes:
+            # Reported once, the generated source is of no use anyway
+            if typename not in self.unsupported:
+                self.unsupported.add(typename)
+                error(self.function, "the C backend does not support {} values".format(typename))
+            return ctypes['int']
+        return ctypes[typename]
+
+    # Names
+    def variable(self, name):
+        return "v_" + name
+
+    def temp(self, name):
+        return "t" + name
+
+    def function_name(self, name):
+        if name == '@main':
+            return "__gone_start"
+        if name in self.user_functions:
+            return "f_" + name
+        return name
+
+    def find_declarations(self, block):
+        '''
+        Collect globals and extern prototypes from all instructions.
+        '''
+        while block is not None:
+            for inst in block.instructions:
+                opname, typename = inst[0].split('_', 1)
+                if opname in ('global', 'const'):
+                    self.globals[inst[1]] = typename
+                    if len(inst) > 2:
+                        # Constants folded by gonefold carry their value
+                        self.const_values[inst[1]] = inst[2]
+                elif opname == 'extern':
+                    name, ret_type, arg_types = inst[1], inst[2], inst[3:]
+                    self.function_types[name] = ret_type
+                    self.externs.append("extern {} {}({});".format(
+                        self.ctype(ret_type), name,
+                        ", ".join(self.ctype(t) for t in arg_types) or "void"))
+            for branch in ('true_branch', 'false_branch', 'loop_branch'):
+                self.find_declarations(getattr(block, branch, None))
+            block = block.next_block
+
+    def signature(self, name, start_block, ret_type, arg_types):
+        params = []
+        for inst in start_block.instructions:
+            if inst[0].startswith('parm_'):
+                params.append("{} {}".format(self.ctype(arg_types[inst[2]]), self.variable(inst[1])))
+        return "{} {}({})".format(self.ctype(ret_type), self.function_name(name),
+                                  ", ".join(params) or "void")
+
+    def find_locals(self, block, decls):
+        '''
+        Find the type of every local variable and temporary of a function.
+        '''
+        while block is not None:
+            for inst in block.instructions:
+                opname, typename = inst[0].split('_', 1)
+                if opname == 'alloc':
+                    decls[self.variable(inst[1])] = typename
+                elif opname in ('literal', 'load'):
+                    decls[self.temp(inst[2])] = typename
+                elif opname == 'phi':
+                    decls[self.temp(inst[3])] = typename
+                elif opname in binary_operators:
+                    decls[self.temp(inst[3])] = 'bool' if opname in comparisons else typename
+                elif opname in unary_operators:
+                    decls[self.temp(inst[2])] = typename
+                elif opname == 'call':
+                    decls[self.temp(inst[2])] = self.function_types[inst[1]]
+            for branch in ('true_branch', 'false_branch', 'loop_branch'):
+                self.find_locals(getattr(block, branch, None), decls)
+            block = block.next_block
+
+    def generate_function(self, name, start_block, ret_type, arg_types):
+        self.emit(self.signature(name, start_block, ret_type, arg_types))
+        self.emit("{")
+        self.indent = 1
+        decls = {}
+        self.find_locals(start_block, decls)
+        for cname, typename in sorted(decls.items()):
+            if typename != 'void':
+                self.emit("{} {};".format(self.ctype(typename), cname))
+        self.generate_blocks(start_block)
+        if ret_type != 'void':
+            # Only reached by functions falling off their end
+            self.emit("return 0;")
+        self.indent = 0
+        self.emit("}")
+        self.emit("")
+
+    # Block graph
+    def generate_blocks(self, block):
+        while block is not None:
+            getattr(self, 'generate_' + type(block).__name__)(block)
+            block = block.next_block
+
+    def generate_body(self, block, phis=(), edge=0):
+        self.indent += 1
+        self.generate_blocks(block)
+        self.move_phis(phis, edge)
+        self.indent -= 1
+
+    def move_phis(self, phis, edge):
+        '''
+        Assign the phi targets for control arriving along the given edge
+        (0 or 1, see gonessa).  All phis of a block take their values at
+        once, so when a target is also a source the values are first copied
+        into variables of their own.
+        '''
+        moves = [(inst[0].split('_', 1)[1], inst[3], inst[1 + edge])
+                 for inst in phis if inst[3] != inst[1 + edge]]
+        targets = {target for typename, target, source in moves}
+        if any(source in targets for typename, target, source in moves):
+            self.emit("{")
+            self.indent += 1
+            for n, (typename, target, source) in enumerate(moves):
+                self.emit("{} m{} = {};".format(self.ctype(typename), n, self.temp(source)))
+            for n, (typename, target, source) in enumerate(moves):
+                self.emit("{} = m{};".format(self.temp(target), n))
+            self.indent -= 1
+            self.emit("}")
+        else:
+            for typename, target, source in moves:
+                self.emit("{} = {};".format(self.temp(target), self.temp(source)))
+
+    def generate_BasicBlock(self, block):
+        self.generate_instructions(block.instructions)
+
+    def generate_ConditionalBlock(self, block):
+        merge = phis(block.next_block) if block.next_block is not None else []
+        self.generate_instructions(block.instructions)
+        self.emit("if ({}) {{".format(self.temp(block.testvar)))
+        self.generate_body(block.true_branch, merge, 0)
+        if block.false_branch is not None or merge:
+            self.emit("} else {")
+            self.generate_body(block.false_branch, merge, 1)
+        self.emit("}")
+
+    def generate_WhileBlock(self, block):
+        header = phis(block)
+        self.move_phis(header, 0)
+        self.emit("for (;;) {")
+        self.indent += 1
+        self.generate_instructions(block.instructions)
+        self.emit("if (!{}) break;".format(self.temp(block.testvar)))
+        self.indent -= 1
+        self.generate_body(block.loop_branch, header, 1)
+        self.emit("}")
+
+    # Instructions
+    def generate_instructions(self, instructions):
+        for inst in instructions:
+            opname, typename = inst[0].split('_', 1)
+            if opname in binary_operators:
+                left, right, target = inst[1:]
+                self.emit("{} = {} {} {};".format(self.temp(target), self.temp(left),
+                                                  binary_operators[opname], self.temp(right)))
+            elif opname in unary_operators:
+                source, target = inst[1:]
+                self.emit("{} = {}{};".format(self.temp(target), unary_operators[opname],
+                                              self.temp(source)))
+            else:
+                getattr(self, 'generate_' + opname)(typename, *inst[1:])
+
+    def generate_global(self, typename, name):
+        pass
+
+    def generate_const(self, typename, name, value=None):
+        pass
+
+    def generate_alloc(self, typename, name):
+        pass
+
+    def generate_parm(self, typename, name, argn):
+        pass
+
+    def generate_extern(self, typename, name, ret_type, *arg_types):
+        pass
+
+    def generate_phi(self, typename, src_a, src_b, target):
+        # Assigned at the end of the predecessors, see move_phis()
+        pass
+
+    def literal(self, typename, value):
+        if typename == 'bool':
+            return 1 if value is True or value == 'true' else 0
+        elif typename == 'float':
+            return repr(float(value))
+        self.ctype(typename)
+        return value
+
+    def generate_literal(self, typename, value, target):
+        self.emit("{} = {};".format(self.temp(target), self.literal(typename, value)))
+
+    def generate_load(self, typename, name, target):
+        self.emit("{} = {};".format(self.temp(target), self.variable(name)))
+
+    def generate_store(self, typename, source, name):
+        self.emit("{} = {};".format(self.variable(name), self.temp(source)))
+
+    def generate_print(self, typename, source):
+        self.ctype(typename)
+        self.emit("_print_{}({});".format(typename, self.temp(source)))
+
+    def generate_return(self, typename, source):
+        self.emit("return {};".format(self.temp(source)))
+
+    def generate_call(self, typename, name, target, *func_args):
+        call = "{}({})".format(self.function_name(name),
+                               ", ".join(self.temp(arg) for arg in func_args))
+        if self.function_types[name] == 'void':
+            self.emit(call + ";")
+        else:
+            self.emit("{} = {};".format(self.temp(target), call))
+
+
+def build_executable(source, output, flags=('-O2',)):
+    '''
+    Compile C source produced by GenerateC into a standalone executable.
+    '''
+    import os
+    import tempfile
+    import gonenative
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cfile = os.path.join(tmpdir, 'program.c')
+        with open(cfile, 'w') as f:
+            f.write(source)
+        # -fwrapv gives integer overflow the same wrap around behaviour as llvm
+        gonenative.link([cfile], output, list(flags) + ['-fwrapv', '-DGONE_STANDALONE'])
+
+
+def main():
+    import gonebin
+    import gonepass
+    import os
+    import argparse
+    import subprocess
+    from errors import subscribe_errors, errors_reported
+
+    parser = argparse.ArgumentParser("Compile a Gone program from a .g or .gir file to C")
+    parser.add_argument('file', type=str, default='', nargs=1,
+                        help="the file containing Gone source or code written by gonebin")
+    parser.add_argument('--output', '-o',
+                        help="name of the executable (default: the source name without .g)")
+    parser.add_argument('--emit-c', action="store_true",
+                        help="print the generated C source instead of compiling it")
+    parser.add_argument('--run', '-r', action="store_true",
+                        help="run the executable after compiling it")
+    parser.add_argument('--ssa', action="store_true",
+                        help="promote variables to SSA temporaries with gonessa first")
+    gonebin.add_arguments(parser)
+    gonepass.add_arguments(parser)
+    args = parser.parse_args()
+
+    with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
+        code = gonebin.compile_file(args.file[0], args.parser, args.jobs)
+        if code is not None:
+            gonepass.run_passes(code, args)
+            source = GenerateC().generate(code.functions)
+            if errors_reported():
+                raise SystemExit(1)
+            if args.emit_c:
+                print(source)
+                return
+            output = args.output or os.path.splitext(args.file[0])[0]
+            build_executable(source, output)
+            if args.run:
+                subprocess.call([os.path.abspath(output)])
+
+
+if __name__ == '__main__':
+    main()
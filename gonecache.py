@@ -0,0 +1,125 @@
+# gonecache.py
+'''
+On-disk cache of compiled Gone programs.
+
+Compiled programs are stored as shared libraries named after a key made
+from the program source, the compiler flags and a hash of the compiler
+itself, so changing any of them causes a recompile.  A cached program is
+run by loading the library with ctypes and calling __gone_start().
+
+The cache lives in $GONE_CACHE_DIR (default ~/.cache/gone).  Its total
+size is bounded by $GONE_CACHE_SIZE bytes (default 64MB): after every
+store, the least recently used libraries are removed until it fits.  Every
+lookup, store and eviction holds an exclusive lock on the cache directory,
+so concurrent runs never see a half written or half deleted library.
+Compilation itself happens outside of the lock.
+'''
+
+import os
+import glob
+import fcntl
+import ctypes
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+default_directory = os.path.join(os.path.expanduser('~'), '.cache', 'gone')
+default_max_size = 64 * 1024 * 1024
+
+_compiler_version = None
+
+
+def compiler_version():
+    '''
+    Return a hash of the compiler and runtime sources.
+    '''
+    global _compiler_version
+    if _compiler_version is None:
+        here = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for path in sorted(glob.glob(os.path.join(here, 'gone*.py')) + [os.path.join(here, 'gonert.c')]):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        _compiler_version = digest.hexdigest()
+    return _compiler_version
+
+
+class NativeCache(object):
+    suffix = '.so'
+
+    def __init__(self, directory=None, max_size=None):
+        self.directory = directory or os.environ.get('GONE_CACHE_DIR', default_directory)
+        if max_size is None:
+            max_size = int(os.environ.get('GONE_CACHE_SIZE', default_max_size))
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, source, flags=()):
+        digest = hashlib.sha256()
+        for part in [compiler_version()] + list(flags):
+            digest.update(part.encode('utf-8') + b'\0')
+        digest.update(source.encode('utf-8'))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    @contextmanager
+    def locked(self):
+        with open(os.path.join(self.directory, 'lock'), 'w') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def load(self, key):
+        '''
+        Load the library cached under key, or return None on a miss.
+        '''
+        path = self.path(key)
+        with self.locked():
+            if not os.path.exists(path):
+                return None
+            # Mark as recently used
+            os.utime(path)
+            return ctypes.CDLL(path)
+
+    def store(self, key, build):
+        '''
+        Add a library to the cache and return it loaded.  build is called
+        with the name of a temporary file to write the library to.
+        '''
+        fd, tmppath = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        os.close(fd)
+        try:
+            build(tmppath)
+            path = self.path(key)
+            with self.locked():
+                os.replace(tmppath, path)
+                # The new entry is the most recently used one, whatever
+                # was looked up while it was being built
+                os.utime(path)
+                self._evict()
+                return ctypes.CDLL(path)
+        finally:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+
+    def evict(self):
+        with self.locked():
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, '*' + self.suffix)):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        # Never evict the most recently used entry, even if it is too big
+        for mtime, size, path in entries[:-1]:
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            total -= size
@@ -1,7 +1,7 @@
 import goneast
 from goneblock import BasicBlock, ConditionalBlock, WhileBlock, EmitBlocksVisitor
 from collections import defaultdict
-from gonetype import int_type
+from gonetype import int_type, bool_type
 
 binary_ops = {
     '+': 'add',
@@ -24,6 +24,48 @@ unary_ops = {
     '!': 'not'
 }
 
+binary_opnames = set(binary_ops.values())
+unary_opnames = set(unary_ops.values())
+
+# Operators whose right operand is only evaluated when the left one does
+# not decide the result
+short_circuit_ops = {'&&', '||'}
+
+
+def short_circuits(node):
+    '''
+    Return True if an expression uses && or ||.
+    '''
+    return any(isinstance(n, goneast.ComparisonBinOp) and n.operator in short_circuit_ops
+               for depth, n in goneast.flatten(node))
+
+
+def instruction_reads(inst):
+    '''
+    Return the operands of an instruction that are read as values.
+    '''
+    opname = inst[0].split('_', 1)[0]
+    if opname in binary_opnames or opname == 'phi':
+        return inst[1:3]
+    if opname in unary_opnames or opname in ('store', 'print', 'return'):
+        return inst[1:2]
+    if opname == 'call':
+        return inst[3:]
+    return ()
+
+
+def instruction_target(inst):
+    '''
+    Return the temporary an instruction defines, or None.
+    '''
+    opname = inst[0].split('_', 1)[0]
+    if opname == 'call':
+        return inst[2]
+    if opname in binary_opnames or opname in unary_opnames or \
+            opname in ('literal', 'load', 'phi'):
+        return inst[-1]
+    return None
+
 
 class GenerateCode(goneast.NodeVisitor):
     '''
@@ -36,6 +78,7 @@ class GenerateCode(goneast.NodeVisitor):
         self.start_block = self.current_block
         self.externs = []
         self.functions = [('@main', self.start_block, 'void', [])]
+        self.inline_hints = set()
 
     def visit(self, node):
         '''
@@ -64,8 +107,9 @@ class GenerateCode(goneast.NodeVisitor):
         for statement in node.statements:
             self.visit(statement)
 
-    def _declaration_helper(self, node):
-        alloc_base = "global" if node.scope == "global" else "alloc"
+    def _declaration_helper(self, node, alloc_base=None):
+        if alloc_base is None:
+            alloc_base = "global" if node.scope == "global" else "alloc"
         inst = (alloc_base + '_' + node.type_obj.name, node.name)
         self.current_block.append(inst)
 
@@ -90,7 +134,9 @@ class GenerateCode(goneast.NodeVisitor):
         self._declaration_helper(node)
 
     def visit_ConstDeclaration(self, node):
-        self._declaration_helper(node)
+        # Global constants are declared with const_* so that passes and
+        # backends can treat them as compile time constants (see gonefold)
+        self._declaration_helper(node, "const" if node.scope == "global" else "alloc")
 
     def visit_VarDeclaration(self, node):
         self._declaration_helper(node)
@@ -174,7 +220,41 @@ class GenerateCode(goneast.NodeVisitor):
         self._visit_BinOp_helper(node)
 
     def visit_ComparisonBinOp(self, node):
-        self._visit_BinOp_helper(node)
+        if node.operator in short_circuit_ops:
+            self._visit_ShortCircuit_helper(node)
+        else:
+            self._visit_BinOp_helper(node)
+
+    def _visit_ShortCircuit_helper(self, node):
+        # a && b only evaluates b if a is true, a || b only if a is false.
+        # The test branches to the block evaluating the right operand and
+        # a phi in the block following it picks the result (see gonessa).
+        self.visit(node.left)
+
+        cond_block = ConditionalBlock(node.left.gen_location)
+        self.current_block.next_block = cond_block
+
+        self.current_block = BasicBlock()
+        if node.operator == '&&':
+            cond_block.true_branch = self.current_block
+        else:
+            cond_block.true_branch = BasicBlock()
+            cond_block.false_branch = self.current_block
+
+        self.visit(node.right)
+
+        self.current_block = BasicBlock()
+        cond_block.next_block = self.current_block
+
+        target = self.new_temp(node.type_obj)
+        if node.operator == '&&':
+            sources = (node.right.gen_location, node.left.gen_location)
+        else:
+            sources = (node.left.gen_location, node.right.gen_location)
+        inst = ('phi_' + node.type_obj.name,) + sources + (target,)
+        self.current_block.append(inst)
+
+        node.gen_location = target
 
     def visit_NamedExpressionList(self, node):
         self.visit(node.exprlist)
@@ -204,10 +284,15 @@ class GenerateCode(goneast.NodeVisitor):
 
     def visit_ConditionalStatement(self, node):
         cond_block = ConditionalBlock()
-        self.current_block.next_block = cond_block
-        self.current_block = cond_block
-
-        self.visit(node.expr)
+        if short_circuits(node.expr):
+            # The test has blocks of its own and is evaluated before the header
+            self.visit(node.expr)
+            self.current_block.next_block = cond_block
+            self.current_block = cond_block
+        else:
+            self.current_block.next_block = cond_block
+            self.current_block = cond_block
+            self.visit(node.expr)
         cond_block.testvar = node.expr.gen_location
 
         self.current_block = BasicBlock()
@@ -225,6 +310,10 @@ class GenerateCode(goneast.NodeVisitor):
         cond_block.next_block = self.current_block
 
     def visit_WhileStatement(self, node):
+        if short_circuits(node.expr):
+            self._visit_WhileStatement_rotated(node)
+            return
+
         cond_block = WhileBlock()
         self.current_block.next_block = cond_block
         self.current_block = cond_block
@@ -240,6 +329,36 @@ class GenerateCode(goneast.NodeVisitor):
         self.current_block = BasicBlock()
         cond_block.next_block = self.current_block
 
+    def _visit_WhileStatement_rotated(self, node):
+        # A test using && or || has blocks of its own, which the header of
+        # a WhileBlock cannot hold.  It is evaluated before the loop and
+        # again at the end of the body, and a phi in the header picks the
+        # value for the edge control arrives from.
+        self.visit(node.expr)
+        entry = node.expr.gen_location
+
+        cond_block = WhileBlock()
+        self.current_block.next_block = cond_block
+
+        self.current_block = BasicBlock()
+        cond_block.loop_branch = self.current_block
+
+        self.visit(node.statements)
+
+        if any(inst[0].startswith('return_') for inst in self.current_block.instructions):
+            # Control never gets back to the test
+            latch = entry
+        else:
+            self.visit(node.expr)
+            latch = node.expr.gen_location
+
+        target = self.new_temp(bool_type)
+        cond_block.append(('phi_bool', entry, latch, target))
+        cond_block.testvar = target
+
+        self.current_block = BasicBlock()
+        cond_block.next_block = self.current_block
+
     def visit_FunctionDefinition(self, node):
         prev_block = self.current_block
 
@@ -255,6 +374,8 @@ class GenerateCode(goneast.NodeVisitor):
         ret_type = node.prototype.typename
         arg_types = [a.typename for a in node.prototype.params.parameters]
         self.functions.append((node.prototype.name, func_block, ret_type, arg_types))
+        if node.inline:
+            self.inline_hints.add(node.prototype.name)
 
         self.current_block = prev_block
 
@@ -0,0 +1,302 @@
+# gonedce.py
+'''
+Dead code elimination and simplification of the block graph produced
+by gonecode.
+
+GenerateCode starts a new block for every if and while statement and
+for the code following them, so programs are full of empty blocks and
+of chains of basic blocks control simply falls through.  This pass
+
+    * removes the instructions following a return, and the blocks
+      following a block that returns,
+
+    * replaces an if statement whose test is a literal with the branch
+      taken, and a while loop whose test is literally false with its
+      header,
+
+    * merges chains of basic blocks into one and drops empty blocks,
+
+    * removes stores of function locals that no load reads afterwards,
+      using the liveness analysis of goneflow,
+
+    * removes instructions computing temporaries nobody reads.
+
+The block following a ConditionalBlock is kept when it holds phis, so
+that code in SSA form (see gonessa) stays in the shape the backends
+expect.  A phi whose branch is removed is replaced by the value coming
+from the branch kept.
+'''
+
+from collections import Counter, defaultdict
+
+from goneblock import BasicBlock, ConditionalBlock, WhileBlock, walk_blocks, returns, phis
+from gonecode import instruction_reads, binary_opnames, unary_opnames
+from goneflow import FlowGraph, LiveVariables
+
+# Instructions without side effects, removed when their result is unused.
+# Divisions are only removed when the divisor is a nonzero literal.
+removable = binary_opnames | unary_opnames | {'literal', 'load', 'phi'}
+
+
+class DeadCodeEliminator(object):
+    '''
+    Simplifies the block graph of a single function.
+    '''
+    def __init__(self, start_block, is_main=False):
+        self.start_block = start_block
+        self.is_main = is_main
+        self.replace = {}
+        self.removed = 0
+
+    def resolve(self, name):
+        while name in self.replace:
+            name = self.replace[name]
+        return name
+
+    def run(self):
+        changed = True
+        while changed:
+            self.literals = {}
+            for block in walk_blocks(self.start_block):
+                for inst in block.instructions:
+                    if inst[0].startswith('literal_'):
+                        self.literals[inst[2]] = inst[1]
+            # Phis replaced by a literal may make further tests constant
+            replaced = len(self.replace)
+            self.start_block = self.simplify_chain(self.start_block)
+            self.rename()
+            changed = len(self.replace) > replaced
+        self.remove_dead_stores()
+        self.remove_unused()
+        return self.start_block
+
+    def rename(self):
+        if not self.replace:
+            return
+        for block in walk_blocks(self.start_block):
+            instructions = []
+            for inst in block.instructions:
+                reads = instruction_reads(inst)
+                if any(name in self.replace for name in reads):
+                    inst = list(inst)
+                    if inst[0] == 'call_func':
+                        inst[3:] = [self.resolve(name) for name in inst[3:]]
+                    else:
+                        for n in range(1, len(reads) + 1):
+                            inst[n] = self.resolve(inst[n])
+                    inst = tuple(inst)
+                instructions.append(inst)
+            block.instructions = instructions
+            if getattr(block, 'testvar', None) is not None:
+                block.testvar = self.resolve(block.testvar)
+
+    def constant_test(self, block):
+        '''
+        Return True or False if the test of a block is a literal, else None.
+        '''
+        if block.testvar not in self.literals:
+            return None
+        value = self.literals[block.testvar]
+        return value is True or value == 'true'
+
+    def simplify_chain(self, block):
+        '''
+        Simplify a chain of blocks linked by next_block.  Returns the new
+        first block, which is None if nothing is left.
+        '''
+        chain = []
+        while block is not None:
+            following = block.next_block
+            if isinstance(block, ConditionalBlock):
+                chain.extend(self.simplify_conditional(block))
+            elif isinstance(block, WhileBlock):
+                chain.extend(self.simplify_while(block))
+            else:
+                chain.append(block)
+            if isinstance(chain[-1], BasicBlock) and returns(chain[-1]):
+                self.truncate(chain[-1])
+                if following is not None:
+                    self.removed += sum(len(b.instructions) for b in walk_blocks(following))
+                break
+            block = following
+        return self.link(chain)
+
+    def truncate(self, block):
+        # Nothing after a return runs
+        for n, inst in enumerate(block.instructions):
+            if inst[0].startswith('return_'):
+                self.removed += len(block.instructions) - n - 1
+                del block.instructions[n + 1:]
+                break
+
+    def flatten(self, block):
+        chain = []
+        while block is not None:
+            chain.append(block)
+            block = block.next_block
+        return chain
+
+    def simplify_conditional(self, block):
+        block.true_branch = self.simplify_chain(block.true_branch) or BasicBlock()
+        block.false_branch = self.simplify_chain(block.false_branch)
+        merge = block.next_block
+        taken = self.constant_test(block)
+        if taken is None:
+            return [block]
+
+        # Replace the test by the branch taken
+        header = BasicBlock()
+        header.instructions = block.instructions
+        branch = block.true_branch if taken else block.false_branch
+        if merge is not None:
+            for inst in phis(merge):
+                self.replace[inst[3]] = inst[1] if taken else inst[2]
+            del merge.instructions[:len(phis(merge))]
+        dropped = block.false_branch if taken else block.true_branch
+        self.removed += sum(len(b.instructions) for b in walk_blocks(dropped))
+        return [header] + self.flatten(branch)
+
+    def simplify_while(self, block):
+        block.loop_branch = self.simplify_chain(block.loop_branch) or BasicBlock()
+        if self.constant_test(block) is not False:
+            return [block]
+
+        # The loop body never runs: only the test is evaluated, once
+        header = BasicBlock()
+        for inst in phis(block):
+            self.replace[inst[3]] = inst[1]
+        header.instructions = block.instructions[len(phis(block)):]
+        self.removed += sum(len(b.instructions) for b in walk_blocks(block.loop_branch))
+        return [header]
+
+    def link(self, chain):
+        '''
+        Merge the basic blocks of a chain and link the rest together.
+        '''
+        result = []
+        for block in chain:
+            previous = result[-1] if result else None
+            if isinstance(block, BasicBlock) and isinstance(previous, BasicBlock):
+                # Phis only follow a ConditionalBlock, so block has none
+                previous.instructions.extend(block.instructions)
+                continue
+            if isinstance(previous, BasicBlock) and not previous.instructions:
+                result.pop()
+            result.append(block)
+        for block, following in zip(result, result[1:] + [None]):
+            block.next_block = following
+        if not result or len(result) == 1 and isinstance(result[0], BasicBlock) \
+                and not result[0].instructions:
+            return None
+        return result[0]
+
+    def remove_dead_stores(self):
+        '''
+        Remove stores of locals no load can read afterwards, as found by
+        liveness analysis (see goneflow).  Globals may be read by any
+        function called later.
+        '''
+        if self.is_main:
+            return
+        local_variables = {inst[1] for block in walk_blocks(self.start_block)
+                           for inst in block.instructions
+                           if inst[0].split('_', 1)[0] in ('alloc', 'parm')}
+        if not local_variables:
+            return
+        graph = FlowGraph(self.start_block)
+        liveness = LiveVariables(graph)
+        for block in graph.order:
+            live = liveness.live_at_end(block)
+            kept = []
+            for inst in reversed(block.instructions):
+                opname = inst[0].split('_', 1)[0]
+                if opname == 'store':
+                    if inst[2] in local_variables and inst[2] not in live:
+                        self.removed += 1
+                        continue
+                    live.discard(inst[2])
+                elif opname == 'load':
+                    live.add(inst[1])
+                kept.append(inst)
+            block.instructions = kept[::-1]
+
+    def remove_unused(self):
+        '''
+        Remove instructions computing values nobody reads.  Uses are counted
+        once, and removing an instruction takes the uses of its operands
+        away, so chains of unused values are removed in a single pass.
+        '''
+        uses = Counter()
+        definitions = defaultdict(list)
+        for block in walk_blocks(self.start_block):
+            for inst in block.instructions:
+                uses.update(instruction_reads(inst))
+                if inst[0].split('_', 1)[0] in removable:
+                    definitions[inst[-1]].append(inst)
+            if getattr(block, 'testvar', None) is not None:
+                uses[block.testvar] += 1
+
+        work = [inst for insts in definitions.values() for inst in insts
+                if self.unused(inst, uses)]
+        dead = set()
+        while work:
+            inst = work.pop()
+            if id(inst) in dead:
+                continue
+            dead.add(id(inst))
+            for name in instruction_reads(inst):
+                uses[name] -= 1
+                if not uses[name]:
+                    work.extend(source for source in definitions.get(name, ())
+                                if self.unused(source, uses))
+
+        if dead:
+            for block in walk_blocks(self.start_block):
+                kept = [inst for inst in block.instructions if id(inst) not in dead]
+                self.removed += len(block.instructions) - len(kept)
+                block.instructions = kept
+
+    def unused(self, inst, uses):
+        opname = inst[0].split('_', 1)[0]
+        if opname not in removable or uses[inst[-1]]:
+            return False
+        if opname == 'div':
+            return bool(self.literals.get(inst[2]))
+        return True
+
+
+def eliminate_dead_code(gen):
+    '''
+    Simplify every function of a GenerateCode object.  Returns the number
+    of instructions removed.
+    '''
+    removed = 0
+    for n, (name, start_block, ret_type, arg_types) in enumerate(gen.functions):
+        eliminator = DeadCodeEliminator(start_block, name == '@main')
+        start_block = eliminator.run() or BasicBlock()
+        gen.functions[n] = (name, start_block, ret_type, arg_types)
+        removed += eliminator.removed
+    return removed
+
+
+def main():
+    import gonelex
+    import goneparse
+    import gonecheck
+    import gonecode
+    import sys
+    from goneblock import EmitBlocksVisitor
+    from errors import subscribe_errors, errors_reported
+    lexer = gonelex.make_lexer()
+    parser = goneparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        gonecheck.check_program(program)
+        if not errors_reported():
+            code = gonecode.generate_code(program)
+            eliminate_dead_code(code)
+            EmitBlocksVisitor().loop(code.functions)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+# goneflow.py
+'''
+Control flow graph and dataflow analysis of the code produced by gonecode.
+
+The block graph of goneblock is a tree of chains: blocks are linked by
+next_block and hold their branches in true_branch, false_branch and
+loop_branch.  FlowGraph turns the blocks of one function into an
+explicit graph with predecessor and successor edges, numbers them in
+reverse postorder and computes the dominator tree and dominance
+frontiers, once, for every pass to use.
+
+On top of it, solve() is a worklist solver for bit-vector dataflow
+problems.  Sets of facts are Python ints, fact n being bit n (see
+Facts), so meets and transfer functions are a few integer operations
+per block.  Blocks are visited in reverse postorder (postorder for
+backward problems) and only revisited when the facts flowing into them
+change, so problems without loops need a single visit per block.  Three
+problems are solved with it:
+
+    * Liveness: the temporaries live on entry to and exit from every block,
+    * LiveVariables: the same for variables, read by load_* and
+      written by store_*,
+    * ReachingDefinitions: the stores of variables reaching every block.
+
+Phis read their operands on the edge control arrives from (see
+gonessa), so they make their operands live at the end of the
+corresponding predecessor rather than at the start of their block.
+'''
+
+from collections import defaultdict, deque
+
+from goneblock import ConditionalBlock, WhileBlock, returns, phis
+from gonecode import instruction_reads, instruction_target
+
+
+class FlowGraph(object):
+    '''
+    Control flow graph of one function.  Nodes are the blocks of the
+    block graph.  A block ending in a return has no successors.
+    '''
+    def __init__(self, start_block):
+        self.entry = start_block
+        self.blocks = []
+        self.succs = defaultdict(list)
+        self.preds = defaultdict(list)
+        self._build(start_block, None)
+        self._order()
+        self._dominators()
+        self._frontiers()
+
+    def _edge(self, src, dst):
+        if dst is not None:
+            self.succs[src].append(dst)
+            self.preds[dst].append(src)
+
+    def _build(self, block, follow):
+        # follow is where control goes after the last block of the chain
+        while block is not None:
+            self.blocks.append(block)
+            after = block.next_block if block.next_block is not None else follow
+            if isinstance(block, ConditionalBlock):
+                self._branch(block, block.true_branch, after)
+                self._branch(block, block.false_branch, after)
+            elif isinstance(block, WhileBlock):
+                self._branch(block, block.loop_branch, block)
+                self._edge(block, after)
+            elif not returns(block):
+                self._edge(block, after)
+            block = block.next_block
+
+    def _branch(self, src, chain, follow):
+        if chain is None:
+            self._edge(src, follow)
+        else:
+            self._edge(src, chain)
+            self._build(chain, follow)
+
+    def _order(self):
+        # Reverse postorder of the blocks reachable from the entry
+        order, seen = [], {self.entry}
+        stack = [(self.entry, iter(self.succs[self.entry]))]
+        while stack:
+            block, succs = stack[-1]
+            for succ in succs:
+                if succ not in seen:
+                    seen.add(succ)
+                    stack.append((succ, iter(self.succs[succ])))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+        order.reverse()
+        self.order = order
+        self.index = {block: n for n, block in enumerate(order)}
+
+    def reachable(self, block):
+        return block in self.index
+
+    def _dominators(self):
+        # Cooper, Harvey and Kennedy, "A Simple, Fast Dominance Algorithm"
+        idom = {self.entry: self.entry}
+        changed = True
+        while changed:
+            changed = False
+            for block in self.order[1:]:
+                new = None
+                for pred in self.preds[block]:
+                    if pred in idom:
+                        new = pred if new is None else self._intersect(idom, pred, new)
+                if idom.get(block) is not new:
+                    idom[block] = new
+                    changed = True
+        self.idom = idom
+        self.children = defaultdict(list)
+        for block in self.order[1:]:
+            self.children[idom[block]].append(block)
+
+    def _intersect(self, idom, a, b):
+        index = self.index
+        while a is not b:
+            while index[a] > index[b]:
+                a = idom[a]
+            while index[b] > index[a]:
+                b = idom[b]
+        return a
+
+    def _frontiers(self):
+        frontier = defaultdict(set)
+        for block in self.order:
+            preds = [p for p in self.preds[block] if self.reachable(p)]
+            if len(preds) < 2:
+                continue
+            for pred in preds:
+                runner = pred
+                while runner is not self.idom[block]:
+                    frontier[runner].add(block)
+                    runner = self.idom[runner]
+        self.frontier = frontier
+
+    def dominates(self, a, b):
+        '''
+        True if every path from the entry to block b goes through block a.
+        '''
+        while b is not a:
+            if b is self.entry or b not in self.idom:
+                return False
+            b = self.idom[b]
+        return True
+
+
+class Facts(object):
+    '''
+    Numbers the facts of a dataflow problem.  A set of facts is an int
+    with bit n set for fact n.
+    '''
+    def __init__(self):
+        self.items = []
+        self.bits = {}
+
+    def bit(self, item):
+        if item not in self.bits:
+            self.bits[item] = 1 << len(self.items)
+            self.items.append(item)
+        return self.bits[item]
+
+    def encode(self, items):
+        bits = 0
+        for item in items:
+            bits |= self.bit(item)
+        return bits
+
+    def decode(self, bits):
+        items = []
+        while bits:
+            low = bits & -bits
+            items.append(self.items[low.bit_length() - 1])
+            bits ^= low
+        return items
+
+
+def solve(graph, gen, kill, forward=True, union=True, boundary=0, universe=0, extra=None):
+    '''
+    Solve a bit-vector dataflow problem over the reachable blocks of a
+    FlowGraph.  gen and kill map blocks to sets of facts: the facts
+    leaving a block are gen | (facts entering & ~kill).  The facts
+    entering a block are the union (or intersection) of those leaving
+    its predecessors, for a forward problem, or its successors, for a
+    backward one.  Blocks without any get boundary.  extra maps blocks
+    to facts added to those entering them.
+
+    Returns two dicts, the facts at the start and at the end of every
+    block in program order.
+    '''
+    order = graph.order if forward else graph.order[::-1]
+    sources = graph.preds if forward else graph.succs
+    targets = graph.succs if forward else graph.preds
+    extra = extra or {}
+    before = {}
+    after = {block: 0 if union else universe for block in order}
+
+    work = deque(order)
+    queued = set(order)
+    while work:
+        block = work.popleft()
+        queued.discard(block)
+        incoming = [after[src] for src in sources[block] if src in after]
+        if not incoming:
+            facts = boundary
+        elif union:
+            facts = 0
+            for value in incoming:
+                facts |= value
+        else:
+            facts = universe
+            for value in incoming:
+                facts &= value
+        facts |= extra.get(block, 0)
+        before[block] = facts
+        leaving = gen.get(block, 0) | (facts & ~kill.get(block, 0))
+        if leaving != after[block]:
+            after[block] = leaving
+            for target in targets[block]:
+                if target in after and target not in queued:
+                    queued.add(target)
+                    work.append(target)
+
+    if forward:
+        return before, after
+    return after, before
+
+
+class Liveness(object):
+    '''
+    Temporaries live on entry to and exit from every block of a FlowGraph.
+    A temporary is live where its value may still be read.
+    '''
+    def __init__(self, graph):
+        self.graph = graph
+        self.facts = Facts()
+        gen, kill, extra = {}, {}, defaultdict(int)
+        for block in graph.order:
+            uses = defs = 0
+            for inst in block.instructions:
+                if inst[0].startswith('phi_'):
+                    self.phi_uses(block, inst, extra)
+                else:
+                    uses |= self.reads(inst) & ~defs
+                defs |= self.writes(inst)
+            uses |= self.tested(block) & ~defs
+            gen[block], kill[block] = uses, defs
+        self.live_in, self.live_out = solve(graph, gen, kill, forward=False, extra=extra)
+
+    def phi_uses(self, block, inst, extra):
+        preds = [pred for pred in self.graph.preds[block] if self.graph.reachable(pred)]
+        for n, pred in enumerate(preds):
+            if len(preds) == 2:
+                extra[pred] |= self.facts.bit(inst[1 + n])
+            else:
+                # A branch returned: the operand of the other edge is not known
+                extra[pred] |= self.facts.encode(inst[1:3])
+
+    def reads(self, inst):
+        return self.facts.encode(instruction_reads(inst))
+
+    def writes(self, inst):
+        target = instruction_target(inst)
+        return self.facts.bit(target) if target is not None else 0
+
+    def tested(self, block):
+        if getattr(block, 'testvar', None) is not None:
+            return self.facts.bit(block.testvar)
+        return 0
+
+    def live_at_start(self, block):
+        return set(self.facts.decode(self.live_in.get(block, 0)))
+
+    def live_at_end(self, block):
+        return set(self.facts.decode(self.live_out.get(block, 0)))
+
+
+class LiveVariables(Liveness):
+    '''
+    Variables live on entry to and exit from every block of a FlowGraph.
+    A variable is live where a load may read its current value.  Calls
+    are not taken into account: functions may read any global.
+    '''
+    def reads(self, inst):
+        if inst[0].startswith('load_'):
+            return self.facts.bit(inst[1])
+        return 0
+
+    def writes(self, inst):
+        if inst[0].startswith('store_'):
+            return self.facts.bit(inst[2])
+        return 0
+
+    def tested(self, block):
+        return 0
+
+    def phi_uses(self, block, inst, extra):
+        pass
+
+
+class ReachingDefinitions(object):
+    '''
+    Stores of variables reaching the start of every block of a FlowGraph,
+    that is followed by a path to the block with no other store of the
+    same variable.  Definitions are (block, index) pairs locating the
+    store_* (or parm_*) instruction.
+    '''
+    def __init__(self, graph):
+        self.graph = graph
+        self.facts = Facts()
+        stores = defaultdict(int)
+        block_stores = {}
+        for block in graph.order:
+            last = {}
+            for n, inst in enumerate(block.instructions):
+                variable = self.defines(inst)
+                if variable is not None:
+                    stores[variable] |= self.facts.bit((block, n))
+                    last[variable] = (block, n)
+            block_stores[block] = last
+
+        gen, kill = {}, {}
+        for block, last in block_stores.items():
+            gen[block] = self.facts.encode(last.values())
+            kill[block] = 0
+            for variable in last:
+                kill[block] |= stores[variable]
+        self.reach_in, self.reach_out = solve(graph, gen, kill)
+
+    def defines(self, inst):
+        opname = inst[0].split('_', 1)[0]
+        if opname == 'store':
+            return inst[2]
+        if opname == 'parm':
+            return inst[1]
+        return None
+
+    def reaching(self, block, variable=None):
+        '''
+        Return the definitions reaching the start of a block, of one
+        variable or of all of them.
+        '''
+        definitions = self.facts.decode(self.reach_in.get(block, 0))
+        if variable is not None:
+            definitions = [(b, n) for b, n in definitions
+                           if self.defines(b.instructions[n]) == variable]
+        return definitions
@@ -0,0 +1,199 @@
+# gonefold.py
+'''
+Constant folding and constant propagation for the code produced by
+gonecode.
+
+Instructions whose operands are all literals are evaluated at compile
+time and replaced by a literal_* instruction of the result:
+
+    literal_float 1.0 -> t1; literal_float 2.0 -> t2; sub_float t1, t2 -> t3
+
+becomes
+
+    literal_float 1.0 -> t1; literal_float 2.0 -> t2; literal_float -1.0 -> t3
+
+Global constants are declared with const_* by gonecode.  When the value
+stored into a constant folds to a literal, the store is dropped, every
+load of the constant in any function becomes a literal and the
+declaration records the value as ('const_float', name, value).  The
+backends then create the constant with its value from the start.
+
+Literals left unused are removed by later passes.  Folding follows the
+semantics of the interpreters: integer division truncates and nothing
+that would divide by zero, overflow a 32 bit integer or produce an
+infinite float is folded.
+'''
+
+import math
+import operator
+
+from goneblock import walk_blocks
+from goneinterp import _idiv
+
+binary_functions = {
+    'add': operator.add,
+    'sub': operator.sub,
+    'mul': operator.mul,
+    'lt': operator.lt,
+    'gt': operator.gt,
+    'lte': operator.le,
+    'gte': operator.ge,
+    'eq': operator.eq,
+    'neq': operator.ne,
+    'and': operator.and_,
+    'or': operator.or_,
+}
+
+comparisons = {'lt', 'gt', 'lte', 'gte', 'eq', 'neq'}
+
+unary_functions = {
+    'uadd': operator.pos,
+    'usub': operator.neg,
+    'not': operator.not_,
+}
+
+int_min, int_max = -2 ** 31, 2 ** 31 - 1
+
+
+def normalize(typename, value):
+    if typename == 'bool':
+        return value is True or value == 'true'
+    return value
+
+
+def evaluate(opname, typename, operands):
+    '''
+    Return the value of an operation on literals, or None if it has to be
+    left for run time.
+    '''
+    if opname == 'div':
+        left, right = operands
+        if right == 0:
+            return None
+        value = _idiv(left, right) if typename == 'int' else left / right
+    elif opname in binary_functions:
+        value = binary_functions[opname](*operands)
+    else:
+        value = unary_functions[opname](*operands)
+    if opname in comparisons or opname == 'not':
+        return bool(value)
+    if typename == 'int' and not int_min <= value <= int_max:
+        return None
+    if typename == 'float' and not math.isfinite(value):
+        return None
+    return value
+
+
+class ConstantFolder(object):
+    '''
+    Folds the functions in GenerateCode.functions.  The toplevel code is
+    folded first, so that the values of constants are known when the
+    other functions are folded.
+    '''
+    def __init__(self, gen):
+        self.gen = gen
+        self.constants = set()
+        self.const_values = {}
+        self.folded = 0
+
+    def fold(self):
+        for name, start_block, ret_type, arg_types in self.gen.functions:
+            if name == '@main':
+                for block in walk_blocks(start_block):
+                    self.constants.update(inst[1] for inst in block.instructions
+                                          if inst[0].startswith('const_'))
+        for name, start_block, ret_type, arg_types in self.gen.functions:
+            self.fold_function(start_block)
+        for name, start_block, ret_type, arg_types in self.gen.functions:
+            if name == '@main':
+                self.record_constants(start_block)
+        return self.gen
+
+    def fold_function(self, start_block):
+        # Temporaries are assigned once, so a literal value holds everywhere
+        # in the function.  Phis may read values defined further down, hence
+        # the repetition until nothing changes.
+        self.values = {}
+        changed = True
+        while changed:
+            changed = False
+            for block in walk_blocks(start_block):
+                instructions = []
+                for inst in block.instructions:
+                    new = self.fold_instruction(inst)
+                    if new is not inst:
+                        changed = True
+                    if new is not None:
+                        instructions.append(new)
+                block.instructions = instructions
+
+    def fold_instruction(self, inst):
+        '''
+        Return the folded instruction, inst itself if it stays or None if
+        it is removed.
+        '''
+        opname, typename = inst[0].split('_', 1)
+        if opname == 'literal':
+            self.values[inst[2]] = normalize(typename, inst[1])
+            return inst
+        if opname == 'load' and inst[1] in self.const_values:
+            return self.literal(typename, self.const_values[inst[1]], inst[2])
+        if opname == 'store' and inst[2] in self.constants and inst[1] in self.values:
+            self.const_values[inst[2]] = self.values[inst[1]]
+            return None
+        if opname == 'phi':
+            src_a, src_b, target = inst[1:]
+            if src_a in self.values and src_b in self.values and \
+                    self.values[src_a] == self.values[src_b]:
+                return self.literal(typename, self.values[src_a], target)
+            return inst
+        if opname in binary_functions or opname == 'div' or opname in unary_functions:
+            operands, target = inst[1:-1], inst[-1]
+            if all(name in self.values for name in operands):
+                value = evaluate(opname, typename, [self.values[name] for name in operands])
+                if value is not None:
+                    result_type = 'bool' if opname in comparisons else typename
+                    return self.literal(result_type, value, target)
+        return inst
+
+    def literal(self, typename, value, target):
+        self.folded += 1
+        self.values[target] = value
+        return ('literal_' + typename, value, target)
+
+    def record_constants(self, start_block):
+        for block in walk_blocks(start_block):
+            block.instructions = [
+                inst + (self.const_values[inst[1]],)
+                if inst[0].startswith('const_') and len(inst) == 2 and inst[1] in self.const_values
+                else inst
+                for inst in block.instructions]
+
+
+def fold_constants(gen):
+    '''
+    Fold and propagate constants in every function of a GenerateCode object.
+    '''
+    return ConstantFolder(gen).fold()
+
+
+def main():
+    import gonelex
+    import goneparse
+    import gonecheck
+    import gonecode
+    import sys
+    from goneblock import EmitBlocksVisitor
+    from errors import subscribe_errors, errors_reported
+    lexer = gonelex.make_lexer()
+    parser = goneparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        gonecheck.check_program(program)
+        if not errors_reported():
+            code = fold_constants(gonecode.generate_code(program))
+            EmitBlocksVisitor().loop(code.functions)
+
+
+if __name__ == '__main__':
+    main()
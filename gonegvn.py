@@ -0,0 +1,173 @@
+# gonegvn.py
+'''
+Value numbering for the code produced by gonecode.
+
+Instructions computing a value already computed by an earlier
+instruction are removed and their uses renamed to the earlier result:
+
+    mul_float t1, t2 -> t3; ...; mul_float t1, t2 -> t7
+
+drops the second multiply and uses t3 in place of t7.  Pure
+instructions (literals, unary and binary operators) are reused from any
+block dominating the one they are in, by walking the dominator tree with
+a scoped table of the values available.  The operands of commutative
+operators are ordered, so that a*b and b*a are the same value.
+
+Loads are only reused within a basic block, and only until a store to
+the same variable or, for globals, a call.  A load following a store
+reads the stored temporary directly.  Once the code is in SSA form (see
+gonessa) variables are temporaries and every value is subject to the
+dominator based numbering.
+'''
+
+from goneblock import walk_blocks
+from gonecode import instruction_reads
+from goneflow import FlowGraph
+
+commutative = {'add', 'mul', 'eq', 'neq', 'and', 'or'}
+
+pure = {'add', 'sub', 'mul', 'div', 'lt', 'gt', 'lte', 'gte', 'eq', 'neq', 'and', 'or',
+        'uadd', 'usub', 'not', 'literal'}
+
+
+class ValueNumbering(object):
+    '''
+    Value numbering of a single function.
+    '''
+    def __init__(self, start_block, is_main):
+        self.start_block = start_block
+        self.is_main = is_main
+        self.graph = FlowGraph(start_block)
+        self.values = {}        # expression key -> temporary holding it
+        self.replace = {}       # removed temporary -> temporary replacing it
+        self.locals = set()
+        self.removed = 0
+
+    def resolve(self, name):
+        while name in self.replace:
+            name = self.replace[name]
+        return name
+
+    def run(self):
+        for block in walk_blocks(self.start_block):
+            for inst in block.instructions:
+                if inst[0].split('_', 1)[0] in ('alloc', 'parm'):
+                    self.locals.add(inst[1])
+
+        # Walk the dominator tree.  Values are added to the table on entry
+        # to a block and taken out again when leaving it.
+        work = [(self.start_block, None)]
+        while work:
+            block, added = work.pop()
+            if added is not None:
+                for key in added:
+                    del self.values[key]
+                continue
+            added = self.number_block(block)
+            work.append((block, added))
+            work.extend((child, None) for child in reversed(self.graph.children[block]))
+
+        # Uses not dominated by the definition they read (phis reading the
+        # end of a loop body) and blocks never reached still need renaming
+        for block in walk_blocks(self.start_block):
+            block.instructions = [self.rename(inst) for inst in block.instructions]
+            if getattr(block, 'testvar', None) is not None:
+                block.testvar = self.resolve(block.testvar)
+
+    def rename(self, inst):
+        reads = instruction_reads(inst)
+        if not any(name in self.replace for name in reads):
+            return inst
+        inst = list(inst)
+        if inst[0] == 'call_func':
+            inst[3:] = [self.resolve(name) for name in inst[3:]]
+        else:
+            for n in range(1, len(reads) + 1):
+                inst[n] = self.resolve(inst[n])
+        return tuple(inst)
+
+    def key(self, inst):
+        opname, typename = inst[0].split('_', 1)
+        if opname == 'literal':
+            value = inst[1]
+            if typename == 'bool':
+                value = value is True or value == 'true'
+            # repr keeps 0.0 and -0.0 apart
+            return (inst[0], repr(value))
+        operands = tuple(self.resolve(name) for name in inst[1:-1])
+        if opname in commutative:
+            operands = tuple(sorted(operands))
+        return (inst[0],) + operands
+
+    def number_block(self, block):
+        '''
+        Number the instructions of a block.  Returns the keys of the pure
+        values it added to the table.
+        '''
+        added = []
+        # Values of variables known within this block: name -> temporary
+        memory = {}
+        instructions = []
+        for inst in block.instructions:
+            inst = self.rename(inst)
+            opname = inst[0].split('_', 1)[0]
+            if opname in pure:
+                key = self.key(inst)
+                if key in self.values:
+                    self.replace[inst[-1]] = self.values[key]
+                    self.removed += 1
+                    continue
+                self.values[key] = inst[-1]
+                added.append(key)
+            elif opname == 'load':
+                if inst[1] in memory:
+                    self.replace[inst[2]] = memory[inst[1]]
+                    self.removed += 1
+                    continue
+                memory[inst[1]] = inst[2]
+            elif opname == 'store':
+                memory[inst[2]] = inst[1]
+            elif opname == 'call':
+                # The callee may change any global
+                for name in list(memory):
+                    if self.is_main or name not in self.locals:
+                        del memory[name]
+            instructions.append(inst)
+        block.instructions = instructions
+        return added
+
+
+def number_values(gen):
+    '''
+    Remove redundant computations from every function of a GenerateCode
+    object.  Returns the number of instructions removed.
+    '''
+    removed = 0
+    for name, start_block, ret_type, arg_types in gen.functions:
+        numbering = ValueNumbering(start_block, name == '@main')
+        numbering.run()
+        removed += numbering.removed
+    return removed
+
+
+def main():
+    import gonelex
+    import goneparse
+    import gonecheck
+    import gonecode
+    import sys
+    from goneblock import EmitBlocksVisitor
+    from errors import subscribe_errors, errors_reported
+    lexer = gonelex.make_lexer()
+    parser = goneparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        gonecheck.check_program(program)
+        if not errors_reported():
+            code = gonecode.generate_code(program)
+            number_values(code)
+            EmitBlocksVisitor().loop(code.functions)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,379 @@
+# goneinline.py
+'''
+Function inlining for the code produced by gonecode.
+
+A call_func in a basic block is replaced by a copy of the blocks of the
+function called, when that function is small (at most max_inline_size
+instructions) or declared with the inline keyword:
+
+    inline func square(x float) float {
+        return x * x;
+    }
+
+The block holding the call is split in two around the copy.  The
+temporaries of the copy are renamed to new ones, and its variables and
+parameters to variables of the caller, declared at the start of the
+caller.  Parameters are stored on entry to the copy, and locals set to
+the default value of their type so that every call starts afresh.
+
+A return stores its value into a result variable that the code after
+the copy loads into the target of the call.  The block graph has no
+jumps, so a return before the end of the function clears a flag set
+on entry instead.  The code following it runs under an if testing the
+flag, and loops containing it stop when the flag is clear.
+
+Testing the flag on every iteration of a loop costs more than a call,
+so functions returning from inside a loop are only inlined when
+declared inline.  The test of an if is moved into a basic block of its
+own before calls in it are inlined.  Calls in the test of a while are
+left alone, as are recursive functions, functions whose loops both
+return and call a function in their test, and functions in SSA form
+(see gonessa) returning from code that does not end them.
+
+Functions are processed after the functions they call, so the copy of
+a function includes the calls inlined into it.
+'''
+
+from goneblock import BasicBlock, ConditionalBlock, WhileBlock, walk_blocks, returns
+from gonecode import instruction_reads
+from gonessa import defaults, types
+
+max_inline_size = 64
+
+
+def copy_chain(block, rewrite, testvar):
+    '''
+    Copy a chain of blocks.  rewrite maps an instruction to the list of
+    instructions replacing it, testvar renames the test of a block.
+    '''
+    head = previous = None
+    while block is not None:
+        new = type(block)()
+        for inst in block.instructions:
+            new.instructions.extend(rewrite(inst))
+        if isinstance(block, (ConditionalBlock, WhileBlock)):
+            new.testvar = testvar(block.testvar)
+        if isinstance(block, ConditionalBlock):
+            new.true_branch = copy_chain(block.true_branch, rewrite, testvar)
+            new.false_branch = copy_chain(block.false_branch, rewrite, testvar)
+        elif isinstance(block, WhileBlock):
+            new.loop_branch = copy_chain(block.loop_branch, rewrite, testvar)
+        if previous is None:
+            head = new
+        else:
+            previous.next_block = new
+        previous = new
+        block = block.next_block
+    return head
+
+
+def chain_blocks(block):
+    while block is not None:
+        yield block
+        block = block.next_block
+
+
+def ends_with_return(start_block):
+    '''
+    True if the only return of a function is its last instruction.
+    '''
+    last = list(chain_blocks(start_block))[-1]
+    count = sum(inst[0].startswith('return_')
+                for block in walk_blocks(start_block) for inst in block.instructions)
+    return count == 1 and isinstance(last, BasicBlock) and \
+        last.instructions and last.instructions[-1][0].startswith('return_')
+
+
+class Inliner(object):
+    '''
+    Inlines calls in every function of a GenerateCode object.
+    '''
+    def __init__(self, gen, max_size=max_inline_size):
+        self.gen = gen
+        self.max_size = max_size
+        self.inlined = 0
+        self.copies = 0
+
+    def run(self):
+        functions = {name: n for n, (name, start_block, ret_type, arg_types)
+                     in enumerate(self.gen.functions)}
+        self.callees = {}
+        for name in self.call_order():
+            n = functions[name]
+            name, start_block, ret_type, arg_types = self.gen.functions[n]
+            self.caller = name
+            self.declarations = []
+            start_block = self.inline_chain(start_block)
+            start_block.instructions[0:0] = self.declarations
+            self.gen.functions[n] = (name, start_block, ret_type, arg_types)
+            if name != '@main' and self.inlinable(name, start_block):
+                # Later callers get a copy including the calls inlined here
+                self.callees[name] = (copy_chain(start_block, lambda inst: [inst], str),
+                                      ret_type)
+        return self.gen
+
+    def call_order(self):
+        '''
+        Return the names of the functions, every function after the ones
+        it calls except where calls are recursive.
+        '''
+        calls = {name: [inst[1] for block in walk_blocks(start_block)
+                        for inst in block.instructions if inst[0] == 'call_func']
+                 for name, start_block, ret_type, arg_types in self.gen.functions}
+        order, seen = [], set()
+
+        def visit(name):
+            seen.add(name)
+            for callee in calls[name]:
+                if callee in calls and callee not in seen:
+                    visit(callee)
+            order.append(name)
+
+        for name in calls:
+            if name not in seen:
+                visit(name)
+        return order
+
+    def inlinable(self, name, start_block):
+        instructions = [inst for block in walk_blocks(start_block) for inst in block.instructions]
+        if any(inst[0] == 'call_func' and inst[1] == name for inst in instructions):
+            return False
+        if len(instructions) > self.max_size and name not in self.gen.inline_hints:
+            return False
+        if ends_with_return(start_block):
+            return True
+        if any(inst[0].startswith('phi_') for inst in instructions):
+            return False
+        for block in walk_blocks(start_block):
+            if isinstance(block, WhileBlock) and \
+                    any(returns(b) for b in walk_blocks(block.loop_branch)):
+                # Testing the flag on every iteration costs more than the
+                # call unless the loop is short, which the hint tells.  The
+                # test of the loop is evaluated once more after the return.
+                if name not in self.gen.inline_hints or \
+                        any(inst[0] == 'call_func' for inst in block.instructions):
+                    return False
+        return True
+
+    def inlines(self, name):
+        '''
+        True if calls to function name are inlined in the current caller.
+        Variables of the toplevel code are globals, slower to access than
+        locals, so functions with loops are not inlined there.
+        '''
+        if name not in self.callees:
+            return False
+        body, ret_type = self.callees[name]
+        return self.caller != '@main' or \
+            not any(isinstance(block, WhileBlock) for block in walk_blocks(body))
+
+    def inline_chain(self, block):
+        '''
+        Inline the calls of a chain of blocks.  Returns its first block.
+        '''
+        chain = []
+        while block is not None:
+            following = block.next_block
+            if isinstance(block, ConditionalBlock):
+                if any(inst[0] == 'call_func' and self.inlines(inst[1])
+                       for inst in block.instructions):
+                    # The test runs once, so computing it in a basic block
+                    # before the ConditionalBlock changes nothing
+                    header = BasicBlock()
+                    header.instructions, block.instructions = block.instructions, []
+                    chain.extend(self.inline_block(header))
+                block.true_branch = self.inline_chain(block.true_branch)
+                block.false_branch = self.inline_chain(block.false_branch)
+                chain.append(block)
+            elif isinstance(block, WhileBlock):
+                block.loop_branch = self.inline_chain(block.loop_branch)
+                chain.append(block)
+            else:
+                chain.extend(self.inline_block(block))
+            block = following
+        for block, following in zip(chain, chain[1:] + [None]):
+            block.next_block = following
+        return chain[0] if chain else None
+
+    def inline_block(self, block):
+        '''
+        Inline the calls of a basic block.  Returns the blocks replacing it,
+        the first of which is block itself, keeping any phis at its start.
+        '''
+        result = [block]
+        instructions, block.instructions = block.instructions, []
+        for inst in instructions:
+            if inst[0] == 'call_func' and self.inlines(inst[1]):
+                expansion, after = self.expand(*inst[1:])
+                result.extend(expansion)
+                result.append(after)
+            else:
+                result[-1].instructions.append(inst)
+        return result
+
+    def expand(self, name, target, *args):
+        '''
+        Return the blocks of a copy of function name called with args,
+        and the block following them, where target is set.
+        '''
+        body, ret_type = self.callees[name]
+        self.copies += 1
+        suffix = '__inline{}'.format(self.copies)
+        declaration = 'global' if self.caller == '@main' else 'alloc'
+
+        variables, temps = {}, {}
+        for block in walk_blocks(body):
+            for inst in block.instructions:
+                opname, typename = inst[0].split('_', 1)
+                if opname in ('alloc', 'parm'):
+                    variables[inst[1]] = inst[1] + suffix
+                    self.declarations.append((declaration + '_' + typename, variables[inst[1]]))
+
+        result = name + '__return' + suffix
+        self.declarations.append((declaration + '_' + ret_type, result))
+        self.flag = None
+        if not ends_with_return(body):
+            self.flag = name + '__running' + suffix
+            self.declarations.append((declaration + '_bool', self.flag))
+
+        def temp(name):
+            if name not in temps:
+                temps[name] = self.gen.new_temp(types[name.split('_')[2]])
+            return temps[name]
+
+        def literal(typename, value):
+            # Set a variable to a value, with a temporary of its own
+            value_temp = self.gen.new_temp(types[typename])
+            return [('literal_' + typename, value, value_temp)], value_temp
+
+        def rewrite(inst):
+            opname, typename = inst[0].split('_', 1)
+            if opname == 'parm':
+                return [('store_' + typename, args[inst[2]], variables[inst[1]])]
+            if opname == 'alloc':
+                code, value = literal(typename, defaults[typename])
+                return code + [('store_' + typename, value, variables[inst[1]])]
+            if opname == 'literal':
+                return [(inst[0], inst[1], temp(inst[2]))]
+            if opname == 'load':
+                return [(inst[0], variables.get(inst[1], inst[1]), temp(inst[2]))]
+            if opname == 'store':
+                return [(inst[0], temp(inst[1]), variables.get(inst[2], inst[2]))]
+            if opname == 'return':
+                code = [('store_' + typename, temp(inst[1]), result)]
+                if self.flag is not None:
+                    done, value = literal('bool', False)
+                    code += done + [('store_bool', value, self.flag)]
+                return code
+            if opname == 'call':
+                return [inst[:2] + (temp(inst[2]),) + tuple(temp(arg) for arg in inst[3:])]
+            reads = instruction_reads(inst)
+            renamed = (inst[0],) + tuple(temp(name) for name in reads)
+            if len(inst) > len(reads) + 1:
+                renamed += (temp(inst[-1]),)
+            return [renamed]
+
+        entry = BasicBlock()
+        if self.flag is not None:
+            # The function may end without a return
+            code, value = literal('bool', True)
+            entry.instructions += code + [('store_bool', value, self.flag)]
+            code, value = literal(ret_type, defaults[ret_type])
+            entry.instructions += code + [('store_' + ret_type, value, result)]
+        copy = copy_chain(body, rewrite, temp)
+        if self.flag is not None:
+            copy = guard(self.gen, copy, self.flag)[0]
+        entry.next_block = copy
+
+        after = BasicBlock()
+        after.instructions.append(('load_' + ret_type, result, target))
+        self.inlined += 1
+        return list(chain_blocks(entry)), after
+
+
+def test_flag(gen, flag):
+    '''
+    Return instructions loading a flag and the temporary holding it.
+    '''
+    loaded = gen.new_temp(types['bool'])
+    return [('load_bool', flag, loaded)], loaded
+
+
+def guard(gen, block, flag):
+    '''
+    Make the code following a block clearing a flag (see returns_to_flag)
+    in a chain of blocks run only while the flag is set.  Returns the
+    first block of the chain and whether the chain may clear the flag.
+    '''
+    head = block
+    while block is not None:
+        if isinstance(block, BasicBlock) and returns_to_flag(block, flag):
+            # Nothing after the return runs
+            block.next_block = None
+            return head, True
+        may_return = False
+        if isinstance(block, ConditionalBlock):
+            block.true_branch, true_returns = guard(gen, block.true_branch, flag)
+            block.false_branch, false_returns = guard(gen, block.false_branch, flag)
+            may_return = true_returns or false_returns
+        elif isinstance(block, WhileBlock):
+            block.loop_branch, may_return = guard(gen, block.loop_branch, flag)
+            if may_return:
+                code, clear = test_flag(gen, flag)
+                test = gen.new_temp(types['bool'])
+                block.instructions += code + [('and_bool', block.testvar, clear, test)]
+                block.testvar = test
+        if may_return and block.next_block is not None:
+            check = ConditionalBlock()
+            check.instructions, check.testvar = test_flag(gen, flag)
+            check.true_branch = guard(gen, block.next_block, flag)[0]
+            check.next_block = BasicBlock()
+            block.next_block = check
+            return head, True
+        block = block.next_block
+    return head, False
+
+
+def returns_to_flag(block, flag):
+    '''
+    True if a block clears the flag, as the returns of the function
+    copied do.  The instructions following the return are removed.
+    '''
+    for n, inst in enumerate(block.instructions):
+        if inst[0] == 'store_bool' and inst[2] == flag:
+            del block.instructions[n + 1:]
+            return True
+    return False
+
+
+def inline_functions(gen, max_size=max_inline_size):
+    '''
+    Inline calls in every function of a GenerateCode object.  Returns the
+    number of calls inlined.
+    '''
+    inliner = Inliner(gen, max_size)
+    inliner.run()
+    return inliner.inlined
+
+
+def main():
+    import gonelex
+    import goneparse
+    import gonecheck
+    import gonecode
+    import sys
+    from goneblock import EmitBlocksVisitor
+    from errors import subscribe_errors, errors_reported
+    lexer = gonelex.make_lexer()
+    parser = goneparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        gonecheck.check_program(program)
+        if not errors_reported():
+            code = gonecode.generate_code(program)
+            inline_functions(code)
+            EmitBlocksVisitor().loop(code.functions)
+
+
+if __name__ == '__main__':
+    main()
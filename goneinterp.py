@@ -1,3 +1,8 @@
+import sys
+
+from goneblock import phis
+
+
 class Interpreter(object):
     def __init__(self, name="module"):
         # Dictionary of currently defined variables
@@ -32,6 +37,9 @@ class Interpreter(object):
     def gen_alloc_int_float_string_bool(self, name):
         self.vars[name] = None
 
+    def gen_const_int_float_string_bool(self, name, value=None):
+        self.vars[name] = value
+
     def gen_store_int_float_string_bool(self, target, name):
         self.vars[name] = self.vars[target]
 
@@ -105,29 +113,497 @@ class Interpreter(object):
         self.vars[target] = self.vars[name](*[self.vars[a] for a in func_args])
 
 
+def _idiv(left, right):
+    '''
+    Integer division truncating toward zero, as done by the native backend.
+    '''
+    quotient = abs(left) // abs(right)
+    return quotient if (left < 0) == (right < 0) else -quotient
+
+
+def _putchar(c):
+    sys.stdout.write(chr(c))
+    return c
+
+
+# Functions made available to extern declarations in addition to the
+# contents of the external libraries.
+builtin_externs = {
+    'putchar': _putchar
+}
+
+# Python modules searched for extern declarations
+external_libs = ['math', 'os']
+
+
+def lookup_extern(name):
+    '''
+    Find the Python callable implementing an extern function.
+    '''
+    if name in builtin_externs:
+        return builtin_externs[name]
+    for lib in external_libs:
+        module = __import__(lib)
+        if name in module.__dict__:
+            return module.__dict__[name]
+    raise RuntimeError("Error: extern '{}' not found".format(name))
+
+
+class _Return(Exception):
+    '''
+    Raised by a compiled return_* instruction to unwind to the caller.
+    '''
+    def __init__(self, value):
+        self.value = value
+
+
+class CompiledFunction(object):
+    '''
+    A Gone function whose instructions have been translated into a list of
+    closures.  Calling it allocates a fresh list of slots for its locals
+    and temporaries.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.nslots = 0
+        self.params = []
+        self.ops = []
+
+    def __call__(self, *args):
+        regs = [None] * self.nslots
+        for slot, value in zip(self.params, args):
+            regs[slot] = value
+        try:
+            for op in self.ops:
+                op(regs)
+        except _Return as ret:
+            return ret.value
+
+
+class CompiledInterpreter(object):
+    '''
+    Interpreter that decodes the block graph produced by gonecode once,
+    turning every instruction into a prebound closure whose operands are
+    already resolved to integer slots.  Running a program is then just a
+    loop over the closure lists.
+
+    Temporaries and locals of a function live in a per-call list of slots.
+    Globals live in a single list shared by all functions, which is also
+    the slot list used by the toplevel @main code.
+    '''
+    def __init__(self):
+        self.globals = []
+        self.global_slots = {}
+        self.const_values = {}
+        self.functions = {}
+        self.externs = {}
+
+    def compile(self, toplevel_blocks):
+        '''
+        Compile the (name, start_block, ret_type, arg_types) tuples found
+        in GenerateCode.functions.
+        '''
+        for name, start_block, ret_type, arg_types in toplevel_blocks:
+            self.functions[name] = CompiledFunction(name)
+            self._find_externs(start_block)
+
+        for name, start_block, ret_type, arg_types in toplevel_blocks:
+            func = self.functions[name]
+            self.func = func
+            self.local_slots = None if name == '@main' else {}
+            func.ops = self.compile_blocks(start_block)
+            if self.local_slots is not None:
+                func.nslots = len(self.local_slots)
+
+        self.globals.extend([None] * (len(self.global_slots) - len(self.globals)))
+        for slot, value in self.const_values.items():
+            self.globals[slot] = value
+
+    def run(self):
+        '''
+        Run the compiled toplevel code.
+        '''
+        regs = self.globals
+        try:
+            for op in self.functions['@main'].ops:
+                op(regs)
+        except _Return:
+            pass
+
+    def _find_externs(self, block):
+        for inst in self._walk_instructions(block):
+            if inst[0] == 'extern_func':
+                self.externs[inst[1]] = lookup_extern(inst[1])
+
+    def _walk_instructions(self, block):
+        while block is not None:
+            yield from block.instructions
+            for branch in ('true_branch', 'false_branch', 'loop_branch'):
+                yield from self._walk_instructions(getattr(block, branch, None))
+            block = block.next_block
+
+    # Slot resolution.  Inside @main every name is a global.  Inside any
+    # other function, names declared or defined there are locals and all
+    # remaining names refer to globals.
+    def global_slot(self, name):
+        if name not in self.global_slots:
+            self.global_slots[name] = len(self.global_slots)
+        return self.global_slots[name]
+
+    def target(self, name):
+        if self.local_slots is None:
+            return self.global_slot(name)
+        if name not in self.local_slots:
+            self.local_slots[name] = len(self.local_slots)
+        return self.local_slots[name]
+
+    def source(self, name):
+        if self.local_slots is None:
+            return self.global_slot(name)
+        return self.local_slots[name]
+
+    def is_global(self, name):
+        return self.local_slots is not None and name not in self.local_slots
+
+    # Block graph translation
+    def compile_blocks(self, block):
+        ops = []
+        while block is not None:
+            method = getattr(self, 'compile_' + type(block).__name__)
+            ops.extend(method(block))
+            block = block.next_block
+        return ops
+
+    def compile_instructions(self, instructions):
+        ops = []
+        for inst in instructions:
+            opname, typename = inst[0].split('_', 1)
+            op = getattr(self, 'compile_' + opname)(typename, *inst[1:])
+            if op is not None:
+                ops.append(op)
+        return ops
+
+    def compile_BasicBlock(self, block):
+        return self.compile_instructions(block.instructions)
+
+    def compile_ConditionalBlock(self, block):
+        ops = self.compile_instructions(block.instructions)
+        test = self.source(block.testvar)
+        merge = phis(block.next_block) if block.next_block is not None else []
+        true_ops = self.compile_blocks(block.true_branch) + self.compile_moves(merge, 0)
+        false_ops = self.compile_blocks(block.false_branch) + self.compile_moves(merge, 1)
+
+        def conditional(regs):
+            for op in (true_ops if regs[test] else false_ops):
+                op(regs)
+        ops.append(conditional)
+        return ops
+
+    def compile_WhileBlock(self, block):
+        header = phis(block)
+        entry_ops = self.compile_moves(header, 0)
+        test_ops = self.compile_instructions(block.instructions)
+        test = self.source(block.testvar)
+        loop_ops = self.compile_blocks(block.loop_branch) + self.compile_moves(header, 1)
+
+        def loop(regs):
+            while True:
+                for op in test_ops:
+                    op(regs)
+                if not regs[test]:
+                    break
+                for op in loop_ops:
+                    op(regs)
+        return entry_ops + [loop]
+
+    def compile_moves(self, phis, edge):
+        '''
+        Compile the copies made by phis when control arrives along the
+        given edge (0 or 1, see gonessa).  All phis of a block take their
+        values at once, so every source is read before any target is set.
+        '''
+        if not phis:
+            return []
+        sources = [self.source(inst[1 + edge]) for inst in phis]
+        targets = [self.target(inst[3]) for inst in phis]
+        if len(phis) == 1:
+            s, t = sources[0], targets[0]
+
+            def move(regs):
+                regs[t] = regs[s]
+            return [move]
+
+        def moves(regs):
+            values = [regs[s] for s in sources]
+            for t, value in zip(targets, values):
+                regs[t] = value
+        return [moves]
+
+    # Instruction translation.  Each compile_opname() method receives the
+    # type name followed by the instruction operands and returns a closure
+    # taking the slot list, or None if nothing needs to happen at run time.
+    def compile_global(self, typename, name):
+        self.global_slot(name)
+
+    def compile_const(self, typename, name, value=None):
+        # Constants folded by gonefold carry their value
+        slot = self.global_slot(name)
+        if value is not None:
+            self.const_values[slot] = value
+
+    def compile_alloc(self, typename, name):
+        self.target(name)
+
+    def compile_parm(self, typename, name, argn):
+        slot = self.target(name)
+        self.func.params.extend([None] * (argn + 1 - len(self.func.params)))
+        self.func.params[argn] = slot
+
+    def compile_phi(self, typename, src_a, src_b, target):
+        # The copies are made at the end of the predecessors, see compile_moves()
+        self.target(target)
+
+    def compile_literal(self, typename, value, target):
+        if typename == 'bool' and isinstance(value, str):
+            value = value == 'true'
+        t = self.target(target)
+
+        def literal(regs):
+            regs[t] = value
+        return literal
+
+    def compile_load(self, typename, name, target):
+        t = self.target(target)
+        if self.is_global(name):
+            g, G = self.global_slot(name), self.globals
+
+            def load_global(regs):
+                regs[t] = G[g]
+            return load_global
+        s = self.source(name)
+
+        def load(regs):
+            regs[t] = regs[s]
+        return load
+
+    def compile_store(self, typename, source, name):
+        s = self.source(source)
+        if self.is_global(name):
+            g, G = self.global_slot(name), self.globals
+
+            def store_global(regs):
+                G[g] = regs[s]
+            return store_global
+        t = self.source(name)
+
+        def store(regs):
+            regs[t] = regs[s]
+        return store
+
+    def compile_add(self, typename, left, right, target):
+        l, r, t = self.source(left), self.source(right), self.target(target)
+
+        def add(regs):
+            regs[t] = regs[l] + regs[r]
+        return add
+
+    def compile_sub(self, typename, left, right, target):
+        l, r, t = self.source(left), self.source(right), self.target(target)
+
+        def sub(regs):
+            regs[t] = regs[l] - regs[r]
+        return sub
+
+    def compile_mul(self, typename, left, right, target):
+        l, r, t = self.source(left), self.source(right), self.target(target)
+
+        def mul(regs):
+            regs[t] = regs[l] * regs[r]
+        return mul
+
+    def compile_div(self, typename, left, right, target):
+        l, r, t = self.source(left), self.source(right), self.target(target)
+        if typename == 'int':
+            def idiv(regs):
+                regs[t] = _idiv(regs[l], regs[r])
+            return idiv
+
+        def div(regs):
+            regs[t] = regs[l] / regs[r]
+        return div
+
+    def compile_lt(self, typename, left, right, target):
+        l, r, t = self.source(left), self.source(right), self.target(target)
+
+        def lt(regs):
+            regs[t] = regs[l] < regs[r]
+        return lt
+
+    def compile_gt(self, typename, left, right, target):
+        l, r, t = self.source(left), self.source(right), self.target(target)
+
+        def gt(regs):
+            regs[t] = regs[l] > regs[r]
+        return gt
+
+    def compile_lte(self, typename, left, right, target):
+        l, r, t = self.source(left), self.source(right), self.target(target)
+
+        def lte(regs):
+            regs[t] = regs[l] <= regs[r]
+        return lte
+
+    def compile_gte(self, typename, left, right, target):
+        l, r, t = self.source(left), self.source(right), self.target(target)
+
+        def gte(regs):
+            regs[t] = regs[l] >= regs[r]
+        return gte
+
+    def compile_eq(self, typename, left, right, target):
+        l, r, t = self.source(left), self.source(right), self.target(target)
+
+        def eq(regs):
+            regs[t] = regs[l] == regs[r]
+        return eq
+
+    def compile_neq(self, typename, left, right, target):
+        l, r, t = self.source(left), self.source(right), self.target(target)
+
+        def neq(regs):
+            regs[t] = regs[l] != regs[r]
+        return neq
+
+    def compile_and(self, typename, left, right, target):
+        l, r, t = self.source(left), self.source(right), self.target(target)
+
+        def and_(regs):
+            regs[t] = regs[l] and regs[r]
+        return and_
+
+    def compile_or(self, typename, left, right, target):
+        l, r, t = self.source(left), self.source(right), self.target(target)
+
+        def or_(regs):
+            regs[t] = regs[l] or regs[r]
+        return or_
+
+    def compile_uadd(self, typename, source, target):
+        s, t = self.source(source), self.target(target)
+
+        def uadd(regs):
+            regs[t] = regs[s]
+        return uadd
+
+    def compile_usub(self, typename, source, target):
+        s, t = self.source(source), self.target(target)
+
+        def usub(regs):
+            regs[t] = -regs[s]
+        return usub
+
+    def compile_not(self, typename, source, target):
+        s, t = self.source(source), self.target(target)
+
+        def not_(regs):
+            regs[t] = not regs[s]
+        return not_
+
+    def compile_print(self, typename, source):
+        s = self.source(source)
+        if typename == 'bool':
+            def print_bool(regs):
+                print(str(regs[s]).lower())
+            return print_bool
+
+        def print_(regs):
+            print(regs[s])
+        return print_
+
+    def compile_return(self, typename, source):
+        s = self.source(source)
+
+        def return_(regs):
+            raise _Return(regs[s])
+        return return_
+
+    def compile_extern(self, typename, name, ret_type, *arg_types):
+        pass
+
+    def compile_call(self, typename, name, target, *func_args):
+        func = self.functions.get(name) or self.externs[name]
+        t = self.target(target)
+        a = [self.source(arg) for arg in func_args]
+        if not a:
+            def call0(regs):
+                regs[t] = func()
+            return call0
+        if len(a) == 1:
+            a0, = a
+
+            def call1(regs):
+                regs[t] = func(regs[a0])
+            return call1
+
+        def call(regs):
+            regs[t] = func(*[regs[s] for s in a])
+        return call
+
+
 def main():
-    import gonelex
-    import goneparse
-    import gonecheck
-    import gonecode
-    import sys
+    import gonebin
+    import gonepass
     import time
-    from errors import subscribe_errors, errors_reported
+    import argparse
+    from goneblock import BasicBlock
+    from errors import subscribe_errors
+
+    parser = argparse.ArgumentParser("Interpret a Gone program from a .g or .gir file")
+    parser.add_argument('file', type=str, default='', nargs=1,
+                        help="the file containing Gone source or code written by gonebin")
+    parser.add_argument('--engine', '-e', choices=['closure', 'vm', 'python', 'dispatch'],
+                        default='closure',
+                        help="closure: precompile instructions into closures (default); "
+                             "vm: lower to the register VM in gonevm; "
+                             "python: translate to Python source with gonepy; "
+                             "dispatch: look up a handler for every instruction executed")
+    parser.add_argument('--ssa', action="store_true",
+                        help="promote variables to SSA temporaries with gonessa first")
+    parser.add_argument('--tail', action="store_true",
+                        help="turn self tail calls into loops with gonetail first")
+    gonebin.add_arguments(parser)
+    gonepass.add_arguments(parser)
+    args = parser.parse_args()
 
-    lexer = gonelex.make_lexer()
-    parser = goneparse.make_parser()
     with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
-        program = parser.parse(open(sys.argv[1]).read())
-        # Check the program
-        gonecheck.check_program(program)
-        # If no errors occurred, generate code
-        if not errors_reported():
-            code = gonecode.generate_code(program)
-            interpreter = Interpreter()
-            start = time.clock()
-            interpreter.run(code.code)
+        # Parse and check the program, and if no errors occurred, generate code
+        code = gonebin.compile_file(args.file[0], args.parser, args.jobs)
+        if code is not None:
+            gonepass.run_passes(code, args)
+            start = time.perf_counter()
+            if args.engine == 'dispatch':
+                if len(code.functions) > 1 or not isinstance(code.start_block, BasicBlock) \
+                        or code.start_block.next_block is not None:
+                    sys.stderr.write("The dispatch engine only runs straight-line code, "
+                                     "use --engine closure\n")
+                    raise SystemExit(1)
+                interpreter = Interpreter()
+                interpreter.run(code.start_block.instructions)
+            elif args.engine == 'vm':
+                import gonevm
+                vm = gonevm.VirtualMachine()
+                vm.load(code.functions)
+                vm.run()
+            elif args.engine == 'python':
+                import gonepy
+                source, run = gonepy.compile_program(code.functions)
+                run()
+            else:
+                interpreter = CompiledInterpreter()
+                interpreter.compile(code.functions)
+                interpreter.run()
             print(":::: FINISHED ::::")
-            print("execution time: {0:.15f}s".format(time.clock() - start))
+            print("execution time: {0:.15f}s".format(time.perf_counter() - start))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,319 @@
+# goneir.py
+'''
+A compact encoding of the code produced by gonecode.
+
+gonecode emits instructions as tuples of strings, such as
+
+    ('add_int', '__int_3', '__int_4', '__int_5')
+
+so every pass and engine hashes opcode and temporary names, and splits
+opcodes on '_' to find the operation and its type.  This module packs
+the same code into integers:
+
+    * opcodes are interned in a table shared by every program, so that
+      'add_int' is always the same small integer.  bases and typenames
+      give the operation and the type of an opcode without any string
+      handling,
+    * temporaries become virtual registers, numbered from 0 in every
+      function,
+    * every other operand (variables, function names, literal values,
+      types of externs) is interned in a pool of constants of the
+      program.  Operands referring to it are negative: constant k is
+      stored as -1 - k.
+
+The instructions of a block are kept in three array columns: opcodes
+holds one opcode per instruction, operands the operands of every
+instruction one after the other, and offsets where the operands of
+instruction n start (operands of instruction n are operands[offsets[n]:
+offsets[n + 1]]).  The shape of the block graph is kept in array
+columns of the function: the kind, test register and links of every
+block.
+
+encode() converts a GenerateCode object into a Program and decode()
+converts it back, giving the same instructions and blocks:
+
+    bash % python3 goneir.py tests/functions/mandel.g
+'''
+
+import sys
+from array import array
+
+from goneblock import BasicBlock, ConditionalBlock, WhileBlock, walk_blocks
+from gonecode import GenerateCode, binary_opnames, unary_opnames, instruction_target
+
+# Kinds of blocks
+BASIC, CONDITIONAL, WHILE = range(3)
+
+block_classes = [BasicBlock, ConditionalBlock, WhileBlock]
+
+# Link columns of a block, indexes into IRFunction.links
+NEXT, TRUE, FALSE, LOOP = range(4)
+link_names = ['next_block', 'true_branch', 'false_branch', 'loop_branch']
+
+NO_BLOCK = -1
+
+typenames = []
+bases = []
+opcode_names = []
+opcodes = {}
+
+
+def intern_opcode(name):
+    '''
+    Return the number of an opcode, adding it to the table if needed.
+    '''
+    if name not in opcodes:
+        base, _, typename = name.partition('_')
+        opcodes[name] = len(opcode_names)
+        opcode_names.append(name)
+        bases.append(base)
+        typenames.append(typename)
+    return opcodes[name]
+
+
+# The opcodes gonecode emits get fixed numbers
+for _typename in ('int', 'float', 'bool', 'string'):
+    for _base in sorted(binary_opnames) + sorted(unary_opnames) + \
+            ['literal', 'load', 'store', 'alloc', 'global', 'const', 'parm', 'phi',
+             'print', 'return']:
+        intern_opcode(_base + '_' + _typename)
+intern_opcode('call_func')
+intern_opcode('extern_func')
+
+
+class IRBlock(object):
+    '''
+    The instructions of one block, in array columns.
+    '''
+    __slots__ = ('opcodes', 'offsets', 'operands')
+
+    def __init__(self):
+        self.opcodes = array('H')
+        self.offsets = array('I', [0])
+        self.operands = array('i')
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def append(self, opcode, operands):
+        self.opcodes.append(opcode)
+        self.operands.extend(operands)
+        self.offsets.append(len(self.operands))
+
+    def instruction(self, n):
+        '''
+        Return the opcode and encoded operands of instruction n.
+        '''
+        return self.opcodes[n], self.operands[self.offsets[n]:self.offsets[n + 1]]
+
+    def __iter__(self):
+        operands, offsets = self.operands, self.offsets
+        for n, opcode in enumerate(self.opcodes):
+            yield opcode, operands[offsets[n]:offsets[n + 1]]
+
+    def nbytes(self):
+        return sum(column.itemsize * len(column)
+                   for column in (self.opcodes, self.offsets, self.operands))
+
+
+class IRFunction(object):
+    '''
+    One function: its blocks in program order, block 0 being the start
+    block, the names of its registers and the shape of its block graph.
+    '''
+    def __init__(self, name, ret_type, arg_types):
+        self.name = name
+        self.ret_type = ret_type
+        self.arg_types = arg_types
+        self.blocks = []
+        self.kinds = array('B')
+        self.tests = array('i')
+        self.links = array('i')
+        self.registers = []
+
+    def successor(self, index, link):
+        return self.links[4 * index + link]
+
+    def nbytes(self):
+        return sum(block.nbytes() for block in self.blocks) + \
+            sum(column.itemsize * len(column) for column in (self.kinds, self.tests, self.links))
+
+
+class Program(object):
+    '''
+    The functions of a program and the pool of constants they share.
+    '''
+    def __init__(self):
+        self.functions = []
+        self.constants = []
+        self.constant_numbers = {}
+        self.versions = {}
+        self.inline_hints = set()
+
+    def constant(self, value):
+        '''
+        Return the encoded operand of a constant.
+        '''
+        # True and 1, or 0.0 and -0.0, are equal as dict keys but must stay apart
+        key = (type(value), repr(value) if isinstance(value, float) else value)
+        if key not in self.constant_numbers:
+            self.constant_numbers[key] = len(self.constants)
+            self.constants.append(value)
+        return -1 - self.constant_numbers[key]
+
+    def nbytes(self):
+        return sum(function.nbytes() for function in self.functions)
+
+
+class Encoder(object):
+    '''
+    Encodes the blocks of one function.
+    '''
+    def __init__(self, program, function, start_block):
+        self.program = program
+        self.function = function
+        blocks = list(walk_blocks(start_block))
+        self.index = {block: n for n, block in enumerate(blocks)}
+        self.registers = {}
+        for block in blocks:
+            for inst in block.instructions:
+                target = instruction_target(inst)
+                if target is not None and target not in self.registers:
+                    self.registers[target] = len(self.registers)
+        function.registers = list(self.registers)
+
+        for block in blocks:
+            function.blocks.append(self.encode_block(block))
+            function.kinds.append(block_classes.index(type(block)))
+            function.tests.append(self.operand(getattr(block, 'testvar', None)))
+            for name in link_names:
+                link = getattr(block, name, None)
+                function.links.append(NO_BLOCK if link is None else self.index[link])
+
+    def operand(self, value):
+        if isinstance(value, str) and value in self.registers:
+            return self.registers[value]
+        return self.program.constant(value)
+
+    def encode_block(self, block):
+        irblock = IRBlock()
+        for inst in block.instructions:
+            irblock.append(intern_opcode(inst[0]), [self.operand(value) for value in inst[1:]])
+        return irblock
+
+
+def encode(gen):
+    '''
+    Encode the functions of a GenerateCode object into a Program.
+    '''
+    program = Program()
+    program.versions = dict(gen.versions)
+    program.inline_hints = set(getattr(gen, 'inline_hints', ()))
+    for name, start_block, ret_type, arg_types in gen.functions:
+        function = IRFunction(name, ret_type, arg_types)
+        Encoder(program, function, start_block)
+        program.functions.append(function)
+    return program
+
+
+def decode_operand(function, constants, operand):
+    if operand < 0:
+        return constants[-1 - operand]
+    return function.registers[operand]
+
+
+def decode_function(function, constants):
+    '''
+    Rebuild the blocks of an IRFunction.  Returns the start block.
+    '''
+    registers = function.registers
+    blocks = []
+    for n, irblock in enumerate(function.blocks):
+        block = block_classes[function.kinds[n]]()
+        for opcode, operands in irblock:
+            block.instructions.append((opcode_names[opcode],) + tuple(
+                constants[-1 - operand] if operand < 0 else registers[operand]
+                for operand in operands))
+        if function.kinds[n] != BASIC:
+            block.testvar = decode_operand(function, constants, function.tests[n])
+        blocks.append(block)
+
+    for n, block in enumerate(blocks):
+        for link, name in enumerate(link_names):
+            successor = function.successor(n, link)
+            if successor != NO_BLOCK:
+                setattr(block, name, blocks[successor])
+    return blocks[0] if blocks else None
+
+
+def decode(program):
+    '''
+    Convert a Program back into a GenerateCode object.
+    '''
+    gen = GenerateCode()
+    gen.versions.update(program.versions)
+    gen.inline_hints = set(program.inline_hints)
+    gen.functions = [(function.name, decode_function(function, program.constants),
+                      function.ret_type, function.arg_types)
+                     for function in program.functions]
+    return gen
+
+
+def tuple_nbytes(gen):
+    '''
+    Return the memory used by the instruction tuples of a GenerateCode
+    object, counting every operand object once.
+    '''
+    seen = set()
+    total = 0
+
+    def size(obj):
+        if id(obj) in seen:
+            return 0
+        seen.add(id(obj))
+        return sys.getsizeof(obj)
+
+    for name, start_block, ret_type, arg_types in gen.functions:
+        for block in walk_blocks(start_block):
+            total += size(block.instructions)
+            for inst in block.instructions:
+                total += size(inst) + sum(size(value) for value in inst)
+    return total
+
+
+def disassemble(program, out=sys.stdout):
+    for function in program.functions:
+        out.write("FUNCTION: {}\n".format(function.name))
+        for n, irblock in enumerate(function.blocks):
+            links = ", ".join("{}={}".format(link_names[link], function.successor(n, link))
+                              for link in range(4) if function.successor(n, link) != NO_BLOCK)
+            out.write("  block {} {} {}\n".format(
+                n, block_classes[function.kinds[n]].__name__, links))
+            for opcode, operands in irblock:
+                out.write("    {:3} {:14} {}\n".format(
+                    opcode, opcode_names[opcode],
+                    " ".join("r{}".format(o) if o >= 0 else "c{}".format(-1 - o)
+                             for o in operands)))
+
+
+def main():
+    import gonelex
+    import goneparse
+    import gonecheck
+    import gonecode
+    from errors import subscribe_errors, errors_reported
+    lexer = gonelex.make_lexer()
+    parser = goneparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        gonecheck.check_program(program)
+        if not errors_reported():
+            code = gonecode.generate_code(program)
+            ir = encode(code)
+            disassemble(ir)
+            print("constants: {}".format(ir.constants))
+            print("tuples: {} bytes, arrays: {} bytes".format(tuple_nbytes(code), ir.nbytes()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,9 @@
+import sys
+
 from errors import error
-from ply.lex import lex
 
 tokens = [
-    'ID', 'CONST', 'VAR', 'PRINT', 'FUNC', 'EXTERN', 'RETURN',
+    'ID', 'CONST', 'VAR', 'PRINT', 'FUNC', 'EXTERN', 'RETURN', 'INLINE',
 
     'PLUS', 'MINUS', 'TIMES', 'DIVIDE',
     'ASSIGN', 'SEMI', 'LPAREN', 'RPAREN',
@@ -83,6 +84,7 @@ def t_ID(t):
         'func': 'FUNC',
         'return': 'RETURN',
         'extern': 'EXTERN',
+        'inline': 'INLINE',
         'true': 'BOOL',
         'false': 'BOOL',
         'if': 'IF',
@@ -135,9 +137,11 @@ def t_STRING_UNTERM(t):
 
 def make_lexer():
     '''
-    Utility function for making the lexer object
+    Utility function for making the lexer object, from the prebuilt tables
+    of gonetables when they are up to date
     '''
-    return lex()
+    import gonetables
+    return gonetables.make_lexer(sys.modules[__name__])
 
 
 def main():
@@ -1,28 +1,46 @@
 from collections import ChainMap
 
-from llvm.core import Module, Builder, Function, Type, Constant, GlobalVariable
-from llvm.core import (
-    FCMP_UEQ, FCMP_UGE, FCMP_UGT, FCMP_ULE, FCMP_ULT, FCMP_UNE,
-    ICMP_EQ, ICMP_NE, ICMP_SGE, ICMP_SGT, ICMP_SLE, ICMP_SLT
-)
-
 from goneblock import BaseLLVMBlockVisitor
 
-int_type = Type.int()
-float_type = Type.double()
-string_type = None
-bool_type = Type.int(1)
-void_type = Type.void()
+# llvmpy is imported by load_llvm(), once a program got through the front
+# end, so that checking a program or reporting its errors never needs it
+Module = Builder = Function = Type = Constant = GlobalVariable = None
+FCMP_UEQ = FCMP_UGE = FCMP_UGT = FCMP_ULE = FCMP_ULT = FCMP_UNE = None
+ICMP_EQ = ICMP_NE = ICMP_SGE = ICMP_SGT = ICMP_SLE = ICMP_SLT = None
+
+int_type = float_type = string_type = bool_type = void_type = None
 
 args = None
 
-typemap = {
-    'int': int_type,
-    'float': float_type,
-    'string': string_type,
-    'bool': bool_type,
-    'void': void_type
-}
+typemap = {}
+
+
+def load_llvm():
+    global Module, Builder, Function, Type, Constant, GlobalVariable
+    global FCMP_UEQ, FCMP_UGE, FCMP_UGT, FCMP_ULE, FCMP_ULT, FCMP_UNE
+    global ICMP_EQ, ICMP_NE, ICMP_SGE, ICMP_SGT, ICMP_SLE, ICMP_SLT
+    global int_type, float_type, bool_type, void_type
+    if Module is not None:
+        return
+
+    from llvm.core import Module, Builder, Function, Type, Constant, GlobalVariable
+    from llvm.core import (
+        FCMP_UEQ, FCMP_UGE, FCMP_UGT, FCMP_ULE, FCMP_ULT, FCMP_UNE,
+        ICMP_EQ, ICMP_NE, ICMP_SGE, ICMP_SGT, ICMP_SLE, ICMP_SLT
+    )
+
+    int_type = Type.int()
+    float_type = Type.double()
+    bool_type = Type.int(1)
+    void_type = Type.void()
+
+    typemap.update({
+        'int': int_type,
+        'float': float_type,
+        'string': string_type,
+        'bool': bool_type,
+        'void': void_type
+    })
 
 
 class GenerateLLVMBlockVisitor(BaseLLVMBlockVisitor):
@@ -48,27 +66,43 @@ class GenerateLLVMBlockVisitor(BaseLLVMBlockVisitor):
         self.visit_BasicBlock(block)
 
         then_block = self.generator.add_block("then")
-        else_block = self.generator.add_block("else")
+        if block.false_branch is not None:
+            else_block = self.generator.add_block("else")
         merge_block = self.generator.add_block("merge")
 
-        self.generator.cbranch(block.testvar, then_block, else_block)
+        # Without an else branch the test jumps straight to the merge block
+        test_end = self.generator.block
+        self.generator.cbranch(block.testvar, then_block,
+                               else_block if block.false_branch is not None else merge_block)
 
         self.generator.set_block(then_block)
         self.visit(block.true_branch)
+        true_end = self.generator.block
         self.generator.branch(merge_block)
 
-        self.generator.set_block(else_block)
-        self.visit(block.false_branch)
-        self.generator.branch(merge_block)
+        if block.false_branch is not None:
+            self.generator.set_block(else_block)
+            self.visit(block.false_branch)
+            false_end = self.generator.block
+            self.generator.branch(merge_block)
+        else:
+            false_end = test_end
 
         self.generator.set_block(merge_block)
+        # Phis at the start of the next block merge the values of both branches
+        self.generator.incoming = (true_end, false_end)
 
     def visit_WhileBlock(self, block):
         test_block = self.generator.add_block("whiletest")
 
+        entry_block = self.generator.block
         self.generator.branch(test_block)
         self.generator.set_block(test_block)
 
+        # The incoming values of phis in the loop header from the end of
+        # the loop body are added once the body has been generated
+        self.generator.incoming = (entry_block, None)
+        self.generator.loop_phis = header_phis = []
         self.generator.generate_code(block)
 
         loop_block = self.generator.add_block("loop")
@@ -78,6 +112,8 @@ class GenerateLLVMBlockVisitor(BaseLLVMBlockVisitor):
 
         self.generator.set_block(loop_block)
         self.visit(block.loop_branch)
+        for phi, source in header_phis:
+            phi.add_incoming(self.generator.temps[source], self.generator.block)
         self.generator.branch(test_block)
 
         self.generator.set_block(after_loop)
@@ -85,6 +121,7 @@ class GenerateLLVMBlockVisitor(BaseLLVMBlockVisitor):
 
 class GenerateLLVM(object):
     def __init__(self):
+        load_llvm()
         self.module = Module.new("module")
         self.builder = None
         self.exit_block = None
@@ -93,6 +130,9 @@ class GenerateLLVM(object):
         self.last_branch = None
         self.block = None
         self.temps = {}
+        self.incoming = None
+        self.loop_phis = []
+        self.previous = None
         self.locals = {}
         self.globals = {}
         self.vars = ChainMap(self.locals, self.globals)
@@ -164,12 +204,14 @@ class GenerateLLVM(object):
         self.last_branch = self.block
 
     def generate_code(self, block):
+        self.previous = None
         for op in block.instructions:
             opcode = op[0]
             if hasattr(self, "emit_" + opcode):
                 getattr(self, "emit_" + opcode)(*op[1:])
             elif args.verbose:
                 print("Warning: No emit_" + opcode + "() method")
+            self.previous = op
 
     # Creation of literal values.  Simply define as LLVM constants.
     def emit_literal_int(self, value, target):
@@ -198,6 +240,26 @@ class GenerateLLVM(object):
         var.initializer = Constant.int(bool_type, 0)
         self.globals[name] = var
 
+    # Constants.  Once gonefold has found their value, they become llvm
+    # constant globals, which later loads are folded into.
+    def emit_const_int(self, name, value=None):
+        self.emit_global_int(name)
+        if value is not None:
+            self.globals[name].initializer = Constant.int(int_type, value)
+            self.globals[name].global_constant = True
+
+    def emit_const_float(self, name, value=None):
+        self.emit_global_float(name)
+        if value is not None:
+            self.globals[name].initializer = Constant.real(float_type, value)
+            self.globals[name].global_constant = True
+
+    def emit_const_bool(self, name, value=None):
+        self.emit_global_bool(name)
+        if value is not None:
+            self.globals[name].initializer = Constant.int(bool_type, 1 if value else 0)
+            self.globals[name].global_constant = True
+
     def emit_alloc_int(self, name):
         var = self.builder.alloca(int_type, name=name)
         self.locals[name] = var
@@ -243,17 +305,46 @@ class GenerateLLVM(object):
     def emit_store_bool(self, source, target):
         self.builder.store(self.temps[source], self.vars[target])
 
-    def emit_return_int(self, source):
+    # A call whose result is returned right away is marked as a tail call,
+    # which llvm can compile to a jump (see gonetail for calls of a
+    # function to itself)
+    def emit_return(self, source):
+        if self.previous is not None and self.previous[0] == 'call_func' \
+                and self.previous[2] == source:
+            self.temps[source].tail_call = True
         self.builder.store(self.temps[source], self.locals['return'])
         self.branch(self.exit_block)
 
+    def emit_return_int(self, source):
+        self.emit_return(source)
+
     def emit_return_float(self, source):
-        self.builder.store(self.temps[source], self.locals['return'])
-        self.branch(self.exit_block)
+        self.emit_return(source)
 
     def emit_return_bool(self, source):
-        self.builder.store(self.temps[source], self.locals['return'])
-        self.branch(self.exit_block)
+        self.emit_return(source)
+
+    # Phi functions of SSA form (see gonessa).  incoming holds the llvm
+    # blocks control arrives from, the end of the loop body being None
+    # while it has not been generated yet.
+    def emit_phi(self, typ, src_a, src_b, target):
+        phi = self.builder.phi(typ, target)
+        first, second = self.incoming
+        phi.add_incoming(self.temps[src_a], first)
+        if second is None:
+            self.loop_phis.append((phi, src_b))
+        else:
+            phi.add_incoming(self.temps[src_b], second)
+        self.temps[target] = phi
+
+    def emit_phi_int(self, src_a, src_b, target):
+        self.emit_phi(int_type, src_a, src_b, target)
+
+    def emit_phi_float(self, src_a, src_b, target):
+        self.emit_phi(float_type, src_a, src_b, target)
+
+    def emit_phi_bool(self, src_a, src_b, target):
+        self.emit_phi(bool_type, src_a, src_b, target)
 
     # Binary + operator
     def emit_add_int(self, left, right, target):
@@ -328,29 +419,24 @@ class GenerateLLVM(object):
     def emit_not_bool(self, source, target):
         self.temps[target] = self.builder.not_(self.temps[source])
 
-    # Unary + operator
+    # Unary + operator: the value itself
     def emit_uadd_int(self, source, target):
-        self.temps[target] = self.builder.add(
-            Constant.int(int_type, 0),
-            self.temps[source],
-            target)
+        self.temps[target] = self.temps[source]
 
     def emit_uadd_float(self, source, target):
-        self.temps[target] = self.builder.fadd(
-            Constant.real(float_type, 0.0),
-            self.temps[source],
-            target)
+        self.temps[target] = self.temps[source]
 
-    # Unary - operator
+    # Unary - operator: a subtraction from zero, which llvm recognizes as
+    # a negation.  For floats the zero is -0.0, so that -(0.0) is -0.0.
     def emit_usub_int(self, source, target):
-        self.temps[target] = self.builder.mul(
-            Constant.int(int_type, -1),
+        self.temps[target] = self.builder.sub(
+            Constant.int(int_type, 0),
             self.temps[source],
             target)
 
     def emit_usub_float(self, source, target):
-        self.temps[target] = self.builder.fmul(
-            Constant.real(float_type, -1.0),
+        self.temps[target] = self.builder.fsub(
+            Constant.real(float_type, -0.0),
             self.temps[source],
             target)
 
@@ -379,56 +465,243 @@ class GenerateLLVM(object):
         self.temps[target] = self.builder.call(self.vars[funcname], resolved_args)
 
 
+# LLVM passes run at each optimization level (-O0 .. -O3).  Function passes
+# run over every function on its own, module passes over the whole module
+# afterwards.  The cleanup passes at -O3 simplify the code exposed by inlining.
+# tailcallelim turns the calls marked as tail calls by emit_return into loops.
+function_passes = [
+    [],
+    ['mem2reg', 'instcombine', 'simplifycfg'],
+    ['mem2reg', 'instcombine', 'gvn', 'licm', 'simplifycfg', 'tailcallelim'],
+    ['mem2reg', 'instcombine', 'gvn', 'licm', 'simplifycfg', 'tailcallelim'],
+]
+
+module_passes = [
+    [],
+    [],
+    ['inline'],
+    ['inline', 'instcombine', 'gvn', 'licm', 'simplifycfg'],
+]
+
+
+def optimize(module, level):
+    '''
+    Run the passes of the given optimization level over an llvm module.
+    '''
+    from llvm.passes import FunctionPassManager, PassManager
+
+    if function_passes[level]:
+        fpm = FunctionPassManager.new(module)
+        for name in function_passes[level]:
+            fpm.add(name)
+        fpm.initialize()
+        for func in module.functions:
+            if not func.is_declaration:
+                fpm.run(func)
+        fpm.finalize()
+
+    if module_passes[level]:
+        pm = PassManager.new()
+        for name in module_passes[level]:
+            pm.add(name)
+        pm.run(module)
+
+
+def build_module(code, level):
+    '''
+    Generate and optimize an llvm module from the code produced by gonecode.
+    Returns the generator and a dictionary with the time spent on each step.
+    '''
+    import time
+
+    times = {}
+    start = time.time()
+    g = GenerateLLVMBlockVisitor()
+    g.visit_functions(code.functions)
+    times['codegen'] = time.time() - start
+
+    start = time.time()
+    optimize(g.generator.module, level)
+    times['optimize'] = time.time() - start
+
+    if args.verbose:
+        print("---- NATIVE ASSEMBLY ----")
+        print(g.generator.module.to_native_assembly())
+        print("---- END NATIVE ASSEMBLY ----")
+    return g.generator, times
+
+
+def compile_and_run(code, level):
+    '''
+    Generate, optimize, JIT compile and run the code produced by gonecode.
+    Returns a dictionary with the time spent in each of those steps.
+    '''
+    import time
+    from llvm.ee import EngineBuilder
+
+    generator, times = build_module(code, level)
+
+    start = time.time()
+    llvm_executor = EngineBuilder.new(generator.module).opt(level).create()
+    llvm_executor.get_pointer_to_function(generator.main_func)
+    times['jit'] = time.time() - start
+
+    times['run'] = run_timed(lambda: llvm_executor.run_function(generator.main_func, []))
+    return times
+
+
+def run_timed(run):
+    import time
+
+    if args.verbose:
+        print(":::: RUNNING ::::")
+    start = time.time()
+    run()
+    elapsed = time.time() - start
+    if args.verbose:
+        print(":::: FINISHED ::::")
+        print("execution time: {0:.15f}s".format(elapsed))
+    return elapsed
+
+
+def compile_cached(source, parse, level):
+    '''
+    Run a program from the native code cache, compiling it into the cache
+    first on a miss.  parse is called to run the front end and returns the
+    code produced by gonecode, or None if there were errors.
+    '''
+    import time
+    import gonecache
+    import gonenative
+
+    cache = gonecache.NativeCache()
+    flags = ['--ssa'] if args.ssa else []
+    flags += ['--tail'] if args.tail else []
+    key = cache.key(source, ['-O{}'.format(level)] + flags)
+    times = dict.fromkeys(['frontend', 'codegen', 'optimize', 'jit'], 0.0)
+
+    start = time.time()
+    library = cache.load(key)
+    if library is None:
+        code = parse()
+        if code is None:
+            return None
+        times['frontend'] = time.time() - start
+        generator, build_times = build_module(code, level)
+        times.update(build_times)
+        start = time.time()
+        library = cache.store(key, lambda path: gonenative.build_shared_library(generator.module, path, level))
+    times['jit'] = time.time() - start
+
+    times['run'] = run_timed(library[gonenative.entry_points['@main']])
+    return times
+
+
+def report_times(level, times, out):
+    compile_time = times['frontend'] + times['codegen'] + times['optimize'] + times['jit']
+    out.write("-O{}: compile {:.4f}s (front end {:.4f}s, codegen {:.4f}s, optimize {:.4f}s, "
+              "jit {:.4f}s), run {:.4f}s, total {:.4f}s\n"
+              .format(level, compile_time, times['frontend'], times['codegen'],
+                      times['optimize'], times['jit'], times['run'],
+                      compile_time + times['run']))
+
+
 def main():
-    import gonelex
-    import goneparse
-    import gonecheck
-    import gonecode
+    import gonebin
+    import gonepass
     import sys
     import ctypes
     import time
     import argparse
-    from errors import subscribe_errors, errors_reported
-    from llvm.ee import ExecutionEngine
+    from errors import subscribe_errors
 
     global args
-    parser = argparse.ArgumentParser("Compile and run a Gone program from a .g file")
+    parser = argparse.ArgumentParser("Compile and run a Gone program from a .g or .gir file")
     parser.add_argument('file', type=str, default='', nargs=1,
-                        help="the file containing Gone source")
+                        help="the file containing Gone source or code written by gonebin")
     parser.add_argument('--verbose', '-v', action="store_true",
                         help="print verbose output")
     parser.add_argument('--validate', '-c', action="store_true",
                         help="perform llvm bitcode validation prior to program execution")
+    parser.add_argument('-O', dest='opt_level', type=int, choices=range(len(function_passes)),
+                        default=0, help="optimization level (-O0 to -O3, default -O0) of the llvm "
+                                         "passes and of the passes of gonepass")
+    parser.add_argument('--time', '-t', action="store_true",
+                        help="report compile and run time to stderr")
+    parser.add_argument('--compare-levels', action="store_true",
+                        help="compile and run the program at every optimization level "
+                             "and report compile time against run time for each")
+    parser.add_argument('--emit-exe', metavar='OUTPUT',
+                        help="compile to a standalone executable linked with gonert.c "
+                             "instead of running the program")
+    parser.add_argument('--emit-asm', metavar='OUTPUT',
+                        help="write native assembly instead of running the program")
+    parser.add_argument('--ssa', action="store_true",
+                        help="promote variables to SSA temporaries with gonessa "
+                             "before generating llvm code")
+    parser.add_argument('--tail', action="store_true",
+                        help="turn self tail calls into loops with gonetail "
+                             "before generating llvm code")
+    parser.add_argument('--cache', action="store_true",
+                        help="compile to a native library kept in $GONE_CACHE_DIR "
+                             "(default ~/.cache/gone) and reuse it while the source is unchanged")
+    gonebin.add_arguments(parser)
+    gonepass.add_arguments(parser, level=False)
     args = parser.parse_args()
 
-    # Load the Gone runtime library (see Makefile)
-    ctypes._dlopen('./gonert.so', ctypes.RTLD_GLOBAL)
+    start = time.time()
+    path = args.file[0]
+    if gonebin.is_code_file(path):
+        # The cache only needs a string identifying the program
+        with open(path, 'rb') as f:
+            source = f.read().hex()
+    else:
+        source = open(path).read()
+
+    def parse():
+        code = gonebin.compile_file(path, args.parser, args.jobs)
+        if code is not None:
+            gonepass.run_passes(code, args)
+            return code
 
-    lexer = gonelex.make_lexer()
-    parser = goneparse.make_parser()
     with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
-        program = parser.parse(open(args.file[0]).read())
-        gonecheck.check_program(program)
-        if not errors_reported():
-            code = gonecode.generate_code(program)
-            g = GenerateLLVMBlockVisitor()
-            g.visit_functions(code.functions)
-
-            if args.verbose:
-                print("---- NATIVE ASSEMBLY ----")
-                print(g.generator.module.to_native_assembly())
-                print("---- END NATIVE ASSEMBLY ----")
-
-            if args.verbose:
-                print(":::: RUNNING ::::")
-            start = time.time()
-
-            llvm_executor = ExecutionEngine.new(g.generator.module)
-            llvm_executor.run_function(g.generator.main_func, [])
-
-            if args.verbose:
-                print(":::: FINISHED ::::")
-                print("execution time: {0:.15f}s".format(time.time() - start))
+        if args.emit_exe or args.emit_asm:
+            import gonenative
+            code = parse()
+            if code is not None:
+                generator, times = build_module(code, args.opt_level)
+                if args.emit_asm:
+                    with open(args.emit_asm, 'w') as f:
+                        f.write(gonenative.emit_assembly(generator.module, args.opt_level))
+                if args.emit_exe:
+                    gonenative.build_executable(generator.module, args.emit_exe, args.opt_level)
+            return
+
+        # Load the Gone runtime library (see Makefile), once there is a
+        # program to run
+        def load_runtime():
+            ctypes._dlopen('./gonert.so', ctypes.RTLD_GLOBAL)
+
+        results = []
+        if args.cache:
+            load_runtime()
+            times = compile_cached(source, parse, args.opt_level)
+            if times is not None:
+                results.append((args.opt_level, times))
+        else:
+            code = parse()
+            if code is not None:
+                load_runtime()
+                frontend_time = time.time() - start
+                levels = range(len(function_passes)) if args.compare_levels else [args.opt_level]
+                for level in levels:
+                    times = compile_and_run(code, level)
+                    times['frontend'] = frontend_time
+                    results.append((level, times))
+
+        if args.time or args.compare_levels:
+            for level, times in results:
+                report_times(level, times, sys.stderr)
 
 if __name__ == '__main__':
     main()
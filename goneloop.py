@@ -0,0 +1,401 @@
+# goneloop.py
+'''
+Loop optimizations for the WhileBlocks produced by gonecode.
+
+    * Loop invariant code motion.  Instructions whose value does not
+      change while a loop runs are moved out of the loop, the test of
+      the WhileBlock included, into a preheader block placed before it.
+      Only instructions that cannot fail are moved, as the loop may not
+      run at all: divisions only move when the divisor is a nonzero
+      literal.  A load moves when the loop stores nothing into its
+      variable and, for globals, calls no function.
+
+    * Strength reduction of induction variables.  In SSA form (see
+      gonessa) a loop counter is a phi of the loop header stepped by a
+      literal or invariant amount:
+
+          phi_int i0, i1 -> i; ...; add_int i, c -> i1
+
+      A product i * k with k invariant becomes a new induction variable
+      starting at i0 * k and stepped by c * k, replacing a multiply in
+      the loop by an add.
+
+    * Unrolling.  Optionally, loops in SSA form counting from a literal
+      to a literal in few iterations, with a body of a single block, are
+      replaced by copies of their body.
+
+Inner loops are optimized first, so that code hoisted out of them can
+leave the loops enclosing them as well.  Running gonedce afterwards
+merges the preheaders with the blocks before them.
+'''
+
+from goneblock import BasicBlock, ConditionalBlock, WhileBlock, walk_blocks, returns, phis
+from gonecode import instruction_reads, instruction_target, binary_opnames, unary_opnames
+from gonefold import evaluate
+from gonessa import types
+
+# Instructions moved out of loops when invariant
+movable = binary_opnames | unary_opnames | {'literal', 'load'}
+
+# Unrolling limits: iterations and instructions of the unrolled loop
+max_unroll_iterations = 8
+max_unroll_size = 64
+
+
+def temp_type(name):
+    # Temporaries are named __type_n, see GenerateCode.new_temp()
+    return name.split('_')[2]
+
+
+class LoopOptimizer(object):
+    '''
+    Optimizes the loops of a single function.
+    '''
+    def __init__(self, gen, start_block, is_main, unroll=False):
+        self.gen = gen
+        self.start_block = start_block
+        self.is_main = is_main
+        self.unroll = unroll
+        self.replace = {}
+        self.hoisted = 0
+        self.reduced = 0
+        self.unrolled = 0
+
+    def resolve(self, name):
+        while name in self.replace:
+            name = self.replace[name]
+        return name
+
+    def run(self):
+        self.definitions = {}
+        self.locals = set()
+        for block in walk_blocks(self.start_block):
+            for inst in block.instructions:
+                if instruction_target(inst) is not None:
+                    self.definitions[instruction_target(inst)] = inst
+                if inst[0].split('_', 1)[0] in ('alloc', 'parm'):
+                    self.locals.add(inst[1])
+        self.start_block = self.optimize_chain(self.start_block)
+        self.rename()
+        return self.start_block
+
+    def rename(self):
+        if not self.replace:
+            return
+        for block in walk_blocks(self.start_block):
+            block.instructions = [self.rename_instruction(inst, self.resolve)
+                                  for inst in block.instructions]
+            if getattr(block, 'testvar', None) is not None:
+                block.testvar = self.resolve(block.testvar)
+
+    @staticmethod
+    def rename_instruction(inst, rename):
+        reads = instruction_reads(inst)
+        inst = list(inst)
+        if inst[0] == 'call_func':
+            inst[3:] = [rename(name) for name in inst[3:]]
+        else:
+            for n in range(1, len(reads) + 1):
+                inst[n] = rename(inst[n])
+        return tuple(inst)
+
+    def optimize_chain(self, block):
+        '''
+        Optimize the loops of a chain of blocks.  Returns the new first
+        block of the chain.
+        '''
+        chain = []
+        while block is not None:
+            following = block.next_block
+            if isinstance(block, ConditionalBlock):
+                block.true_branch = self.optimize_chain(block.true_branch)
+                block.false_branch = self.optimize_chain(block.false_branch)
+                chain.append(block)
+            elif isinstance(block, WhileBlock):
+                block.loop_branch = self.optimize_chain(block.loop_branch)
+                chain.extend(self.optimize_loop(block))
+            else:
+                chain.append(block)
+            block = following
+        for block, following in zip(chain, chain[1:] + [None]):
+            block.next_block = following
+        return chain[0] if chain else None
+
+    def optimize_loop(self, loop):
+        '''
+        Optimize a single loop.  Returns the blocks replacing it.
+        '''
+        blocks = [loop] + list(walk_blocks(loop.loop_branch))
+        preheader = BasicBlock()
+        self.hoist(loop, blocks, preheader)
+        replacement = self.unroll_loop(loop) if self.unroll else None
+        if replacement is None:
+            self.reduce_strength(loop, blocks, preheader)
+            replacement = loop
+        return [preheader, replacement] if preheader.instructions else [replacement]
+
+    def loop_definitions(self, blocks):
+        return {instruction_target(inst) for block in blocks for inst in block.instructions} - {None}
+
+    def hoist(self, loop, blocks, preheader):
+        defined = self.loop_definitions(blocks)
+        stored = {inst[2] for block in blocks for inst in block.instructions
+                  if inst[0].startswith('store_')}
+        calls = any(inst[0] == 'call_func' for block in blocks for inst in block.instructions)
+
+        # Find the invariant instructions, in the order they are computed
+        invariant = {}
+        changed = True
+        while changed:
+            changed = False
+            for block in blocks:
+                for inst in block.instructions:
+                    target = instruction_target(inst)
+                    if target not in invariant and self.is_invariant(inst, defined, invariant,
+                                                                     stored, calls):
+                        invariant[target] = inst
+                        changed = True
+        if not invariant:
+            return
+
+        # Literals only move along with instructions reading them
+        needed = set()
+        for target, inst in invariant.items():
+            if not inst[0].startswith('literal_'):
+                needed.add(target)
+                needed.update(instruction_reads(inst))
+        for block in blocks:
+            kept = []
+            for inst in block.instructions:
+                if instruction_target(inst) in needed and instruction_target(inst) in invariant:
+                    preheader.instructions.append(inst)
+                    self.hoisted += 1
+                else:
+                    kept.append(inst)
+            block.instructions = kept
+        # Instructions were collected in program order, which need not be
+        # the order of their dependences once several blocks contribute
+        preheader.instructions = self.schedule(preheader.instructions)
+
+    def is_invariant(self, inst, defined, invariant, stored, calls):
+        opname = inst[0].split('_', 1)[0]
+        if opname not in movable:
+            return False
+        if opname == 'load':
+            name = inst[1]
+            if name in stored:
+                return False
+            return not calls or (not self.is_main and name in self.locals)
+        if opname == 'div':
+            divisor = self.definitions.get(inst[2])
+            if divisor is None or not divisor[0].startswith('literal_') or not divisor[1]:
+                return False
+        return all(name not in defined or name in invariant for name in instruction_reads(inst))
+
+    def schedule(self, instructions):
+        ordered, done = [], set()
+        pending = list(instructions)
+        targets = {instruction_target(inst) for inst in instructions}
+        while pending:
+            for inst in pending:
+                if all(name not in targets or name in done for name in instruction_reads(inst)):
+                    ordered.append(inst)
+                    done.add(instruction_target(inst))
+                    pending.remove(inst)
+                    break
+        return ordered
+
+    def induction_variables(self, loop, defined):
+        '''
+        Return the basic induction variables of a loop as a dict mapping
+        the phi target to (start, step, opname) with opname add or sub.
+        The step is invariant or a literal.
+        '''
+        result = {}
+        for inst in phis(loop):
+            if inst[0] != 'phi_int':
+                continue
+            start, latch, target = inst[1:]
+            step = self.definitions.get(latch)
+            if step is None or latch not in defined or step[0] not in ('add_int', 'sub_int'):
+                continue
+            left, right = step[1:3]
+            if step[0] == 'add_int' and right == target:
+                left, right = right, left
+            if left == target and self.is_constant(right, defined):
+                result[target] = (start, right, step[0].split('_')[0])
+        return result
+
+    def is_constant(self, name, defined):
+        return name not in defined or self.definitions[name][0].startswith('literal_')
+
+    def outside(self, name, defined, preheader):
+        '''
+        Return a name for the value of an invariant or literal usable in
+        the preheader.  Literals inside the loop are copied there.
+        '''
+        if name not in defined:
+            return name
+        inst = self.definitions[name]
+        target = self.gen.new_temp(types[temp_type(name)])
+        self.add(preheader, inst[:-1] + (target,))
+        return target
+
+    def add(self, block, inst, position=None):
+        self.definitions[instruction_target(inst)] = inst
+        if position is None:
+            block.instructions.append(inst)
+        else:
+            block.instructions.insert(position, inst)
+
+    def reduce_strength(self, loop, blocks, preheader):
+        # The last block of the body ends every iteration
+        latch = loop.loop_branch
+        while latch.next_block is not None:
+            latch = latch.next_block
+        if not isinstance(latch, BasicBlock) or returns(latch):
+            return
+        defined = self.loop_definitions(blocks)
+        variables = self.induction_variables(loop, defined)
+        if not variables:
+            return
+        for block in blocks:
+            kept = []
+            for inst in block.instructions:
+                if inst[0] == 'mul_int':
+                    left, right = inst[1:3]
+                    if right in variables:
+                        left, right = right, left
+                    if left in variables and self.is_constant(right, defined):
+                        start, step, opname = variables[left]
+                        self.replace[inst[3]] = self.new_variable(
+                            loop, latch, preheader, start,
+                            self.outside(step, defined, preheader),
+                            self.outside(right, defined, preheader), opname)
+                        self.reduced += 1
+                        continue
+                kept.append(inst)
+            block.instructions = kept
+
+    def new_variable(self, loop, latch, preheader, start, step, factor, opname):
+        '''
+        Create the induction variable start * factor stepped by step * factor.
+        '''
+        first, increment = self.gen.new_temp(types['int']), self.gen.new_temp(types['int'])
+        current, following = self.gen.new_temp(types['int']), self.gen.new_temp(types['int'])
+        self.add(preheader, ('mul_int', start, factor, first))
+        self.add(preheader, ('mul_int', step, factor, increment))
+        self.add(loop, ('phi_int', first, following, current), len(phis(loop)))
+        self.add(latch, (opname + '_int', current, increment, following))
+        return current
+
+    def trip_count(self, loop):
+        '''
+        Return the number of iterations of a loop counting from a literal
+        to a literal, or None.
+        '''
+        test = self.definitions.get(loop.testvar)
+        if test is None or test not in loop.instructions or \
+                test[0].split('_')[0] not in ('lt', 'lte', 'gt', 'gte', 'neq'):
+            return None
+        defined = self.loop_definitions([loop, loop.loop_branch])
+        variables = self.induction_variables(loop, defined)
+        counter, limit = test[1:3]
+        start, step, opname = variables.get(counter, (None, None, None))
+        literals = [self.definitions.get(name) for name in (start, step, limit)]
+        if None in literals or not all(inst[0] == 'literal_int' for inst in literals):
+            return None
+        value, step, limit = [inst[1] for inst in literals]
+        if opname == 'sub':
+            step = -step
+        compare = test[0].split('_')[0]
+        for count in range(max_unroll_iterations + 1):
+            if not evaluate(compare, 'int', [value, limit]):
+                return count
+            value += step
+        return None
+
+    def unroll_loop(self, loop):
+        body = loop.loop_branch
+        if not isinstance(body, BasicBlock) or body.next_block is not None or returns(body):
+            return None
+        count = self.trip_count(loop)
+        header = loop.instructions[len(phis(loop)):]
+        if count is None or (count + 1) * len(header) + count * len(body.instructions) > \
+                max_unroll_size:
+            return None
+
+        # The values of the phis in the current iteration
+        current = {inst[3]: inst[1] for inst in phis(loop)}
+        instructions = []
+        for iteration in range(count + 1):
+            names = dict(current)
+            # The header is evaluated once more when the loop ends
+            code = header if iteration == count else header + body.instructions
+            for inst in code:
+                inst = self.rename_instruction(
+                    inst, lambda name: names.get(self.resolve(name), self.resolve(name)))
+                target = instruction_target(inst)
+                if target is not None:
+                    names[target] = self.gen.new_temp(types[temp_type(target)])
+                    inst = inst[:-1] + (names[target],) if inst[0] != 'call_func' else \
+                        inst[:2] + (names[target],) + inst[3:]
+                    self.definitions[names[target]] = inst
+                instructions.append(inst)
+            current = {inst[3]: names.get(inst[2], inst[2]) for inst in phis(loop)}
+        # Code after the loop reads the values of the last evaluation
+        self.replace.update((inst[3], names[inst[3]]) for inst in phis(loop))
+        self.replace.update((inst[-1], names[inst[-1]]) for inst in header
+                            if instruction_target(inst) is not None)
+        self.unrolled += 1
+        unrolled = BasicBlock()
+        unrolled.instructions = instructions
+        return unrolled
+
+
+def optimize_loops(gen, unroll=False):
+    '''
+    Optimize the loops of every function of a GenerateCode object.
+    Returns the number of instructions hoisted, multiplies strength
+    reduced and loops unrolled.
+    '''
+    hoisted = reduced = unrolled = 0
+    for n, (name, start_block, ret_type, arg_types) in enumerate(gen.functions):
+        optimizer = LoopOptimizer(gen, start_block, name == '@main', unroll)
+        gen.functions[n] = (name, optimizer.run() or BasicBlock(), ret_type, arg_types)
+        hoisted += optimizer.hoisted
+        reduced += optimizer.reduced
+        unrolled += optimizer.unrolled
+    return hoisted, reduced, unrolled
+
+
+def main():
+    import argparse
+    import gonelex
+    import goneparse
+    import gonecheck
+    import gonecode
+    import gonessa
+    import sys
+    from goneblock import EmitBlocksVisitor
+    from errors import subscribe_errors, errors_reported
+    parser = argparse.ArgumentParser(description="Optimize the loops of a Gone program")
+    parser.add_argument('filename')
+    parser.add_argument('--ssa', action='store_true', help="convert to SSA form first")
+    parser.add_argument('--unroll', action='store_true', help="unroll small counted loops")
+    args = parser.parse_args()
+    lexer = gonelex.make_lexer()
+    gone_parser = goneparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
+        program = gone_parser.parse(open(args.filename).read())
+        gonecheck.check_program(program)
+        if not errors_reported():
+            code = gonecode.generate_code(program)
+            if args.ssa:
+                gonessa.construct_ssa(code)
+            optimize_loops(code, args.unroll)
+            EmitBlocksVisitor().loop(code.functions)
+
+
+if __name__ == '__main__':
+    main()
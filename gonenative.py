@@ -0,0 +1,81 @@
+# gonenative.py
+'''
+Native code output for Gone.
+
+Turns the llvm module built by gonellvm into native assembly or an object
+and links it with the Gone runtime (gonert.c) using the system C compiler,
+either into a shared library or into a standalone executable that needs no
+Python at run time.  The C compiler can be changed with the CC environment
+variable.
+'''
+
+import os
+import subprocess
+import tempfile
+
+runtime_source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gonert.c')
+
+# Symbols given to the toplevel code and to the Gone main() function in
+# native code.  "@main" is not a valid C identifier and "main" would clash
+# with the entry point of a C program.
+entry_points = {
+    '@main': '__gone_start',
+    'main': '__gone_main'
+}
+
+
+def rename_entry_points(module):
+    for func in module.functions:
+        if func.name in entry_points:
+            func.name = entry_points[func.name]
+
+
+def target_machine(level):
+    from llvm.ee import TargetMachine, RELOC_PIC
+
+    return TargetMachine.new(opt=level, reloc=RELOC_PIC)
+
+
+def emit_object(module, level=2):
+    '''
+    Return the contents of a position independent object file for module.
+    '''
+    rename_entry_points(module)
+    return target_machine(level).emit_object(module)
+
+
+def emit_assembly(module, level=2):
+    '''
+    Return native assembly for module, as it would be put in an object.
+    '''
+    rename_entry_points(module)
+    return target_machine(level).emit_assembly(module)
+
+
+def link(objects, output, flags):
+    compiler = os.environ.get('CC', 'gcc')
+    # Externs commonly come from the C math library
+    subprocess.check_call([compiler] + flags + objects + [runtime_source, '-o', output, '-lm'])
+
+
+def build(module, output, level, flags):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        obj = os.path.join(tmpdir, 'module.o')
+        with open(obj, 'wb') as f:
+            f.write(emit_object(module, level))
+        link([obj], output, flags)
+
+
+def build_shared_library(module, output, level=2):
+    '''
+    Compile module into a shared library exporting __gone_start().
+    '''
+    build(module, output, level, ['-shared', '-fPIC'])
+
+
+def build_executable(module, output, level=2):
+    '''
+    Compile module into a standalone executable.  The runtime supplies the
+    C main() function, which calls __gone_start().
+    '''
+    build(module, output, level, ['-DGONE_STANDALONE', '-O2'])
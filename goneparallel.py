@@ -0,0 +1,217 @@
+# goneparallel.py
+'''
+Lexing and parsing of large Gone programs in several processes.
+
+A program is a flat list of top level statements: function definitions,
+extern, const and var declarations and the like.  This module splits the
+source into chunks between top level statements, parses the chunks in
+a pool of processes and joins the statements of their programs into one
+Program, which is the Program the whole source parses to.
+
+Chunks end just after a ';' or a '}' outside of any braces (unless an
+else follows the '}').  A pre-scan finds those by looking at braces,
+semicolons, strings and comments only, the way gonelex sees them,
+without scanning the tokens.  Every chunk is parsed from the line it
+starts at, so the nodes have the line numbers they would have had.
+
+The trees of the chunks come back pickled and are unpickled in this
+process, which takes about a third of the time of a serial parse and
+bounds the speedup.  Only the lexer and parser run in parallel; checking
+and code generation come after, on the joined Program.
+
+When any chunk has errors, the source is parsed again as a whole, in
+this process, so that errors are reported as the serial front end
+reports them.
+
+    bash % python3 goneinterp.py --jobs 4 big.g
+    bash % python3 goneparallel.py --time --jobs 4 big.g
+'''
+
+import os
+import re
+import sys
+import bisect
+
+import gonescan
+from goneast import Program, Statements
+from errors import subscribe_errors, clear_subscribers
+
+# Strings, comments, braces and semicolons, as gonelex reads them: an
+# unterminated string ends at the end of its line, an unterminated
+# comment at the end of the source, and a // comment needs a newline
+boundary_pattern = re.compile(r'"[^"\n]*"?|/\*(?s:.*?)(?:\*/|\Z)|//[^\n]*\n|[{};]')
+# Whether an else follows, with comments that cannot run past their end
+# so that a failed match never backtracks over the rest of the source
+else_pattern = re.compile(r'(?:[ \t\r\n]|/\*(?:[^*]|\*+[^*/])*\*+/|//[^\n]*\n)*else(?![A-Za-z0-9_])')
+
+
+# The statements of a chunk come back pickled, and the trees are
+# unpickled in this process.  Splitting into more chunks than processes
+# lets that overlap with the parsing of the chunks still running
+chunks_per_job = 4
+
+
+def boundaries(text):
+    '''
+    Return the offsets just after every top level statement of text.
+    '''
+    ends = []
+    depth = 0
+    for match in boundary_pattern.finditer(text):
+        c = match.group()
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0 and not else_pattern.match(text, match.end()):
+                ends.append(match.end())
+        elif c == ';' and depth == 0:
+            ends.append(match.end())
+    return ends
+
+
+def split_source(text, count):
+    '''
+    Split text into at most count chunks of about the same size, ending
+    at top level statements.  Returns a list of (offset, chunk).
+    '''
+    ends = boundaries(text)
+    cuts = []
+    start = 0
+    for n in range(1, count):
+        target = len(text) * n // count
+        # The first statement end at or after the target
+        index = bisect.bisect_left(ends, max(target, start + 1))
+        if index == len(ends):
+            break
+        cuts.append(ends[index])
+        start = ends[index]
+    offsets = [0] + cuts
+    return [(offset, text[offset:end]) for offset, end in zip(offsets, cuts + [len(text)])]
+
+
+def make_parser(parser):
+    if parser == 'pratt':
+        import gonepratt
+        return gonepratt.make_parser()
+    import goneparse
+    return goneparse.make_parser()
+
+
+def parse_chunk(chunk, lineno, parser='lalr'):
+    '''
+    Parse a chunk of source starting at line lineno.  Returns the list
+    of its statements and the errors reported.
+    '''
+    errors = []
+    lexer = gonescan.Scanner()
+    lexer.lineno = lineno
+    with subscribe_errors(errors.append):
+        program = make_parser(parser).parse(chunk, lexer=lexer)
+    if errors or program is None:
+        return None, errors
+    return program.statements.statements if program.statements else [], errors
+
+
+def parse_serial(text, parser='lalr'):
+    lexer = gonescan.Scanner()
+    return make_parser(parser).parse(text, lexer=lexer)
+
+
+def parse_source(text, parser='lalr', jobs=0):
+    '''
+    Parse text with jobs processes (one per core if 0) and return its
+    Program, as the parser named parser would.
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+
+    jobs = jobs or os.cpu_count() or 1
+    if jobs < 2:
+        return parse_serial(text, parser)
+    chunks = split_source(text, jobs * chunks_per_job)
+    if len(chunks) < 2:
+        return parse_serial(text, parser)
+
+    linenos = []
+    lineno = 1
+    start = 0
+    for offset, chunk in chunks:
+        lineno += text.count('\n', start, offset)
+        start = offset
+        linenos.append(lineno)
+
+    # Workers only collect the errors of their chunk, without reporting them
+    with ProcessPoolExecutor(min(jobs, len(chunks)), initializer=clear_subscribers) as pool:
+        futures = [pool.submit(parse_chunk, chunk, lineno, parser)
+                   for (offset, chunk), lineno in zip(chunks, linenos)]
+        try:
+            results = [future.result() for future in futures]
+        except Exception:
+            # Such as the ValueError of floats gonelex cannot convert,
+            # which the serial parse raises the same way
+            results = None
+
+    if results is None or any(errors for statements, errors in results):
+        return parse_serial(text, parser)
+    statements = [statement for chunk_statements, errors in results
+                  for statement in chunk_statements]
+    # As goneparse numbers them, Statements and Program are on line 0
+    return Program(Statements(statements, lineno=0) if statements else None, lineno=0)
+
+
+def parse_file(path, parser='lalr', jobs=0):
+    return parse_source(gonescan.read_file(path), parser, jobs)
+
+
+def parse_times(text, parser='lalr', jobs=0, repeat=3):
+    '''
+    Return the best wall time taken to parse text serially and with
+    jobs processes, in seconds.
+    '''
+    import time
+    times = {}
+    for name, parse in (('serial', lambda: parse_serial(text, parser)),
+                        ('parallel', lambda: parse_source(text, parser, jobs))):
+        best = None
+        for n in range(repeat):
+            start = time.perf_counter()
+            parse()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times[name] = best
+    return times
+
+
+def main():
+    import argparse
+    from goneast import flatten
+
+    parser = argparse.ArgumentParser("Parse a Gone program in several processes")
+    parser.add_argument('file', type=str, default='', nargs=1,
+                        help="the file containing Gone source")
+    parser.add_argument('--jobs', '-j', type=int, default=0,
+                        help="number of processes (default: one per core)")
+    parser.add_argument('--parser', choices=['lalr', 'pratt'], default='lalr',
+                        help="the parser run on every chunk")
+    parser.add_argument('--time', action="store_true",
+                        help="compare the time taken with that of a serial parse")
+    args = parser.parse_args()
+    text = gonescan.read_file(args.file[0])
+
+    if args.time:
+        jobs = args.jobs or os.cpu_count() or 1
+        times = parse_times(text, args.parser, jobs)
+        print("{} chunks, {} processes".format(
+            len(split_source(text, jobs * chunks_per_job)), jobs))
+        for name in ('serial', 'parallel'):
+            print("{:8} {:8.2f}ms".format(name, times[name] * 1000))
+        return
+
+    with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
+        program = parse_source(text, args.parser, args.jobs)
+    for depth, node in flatten(program):
+        print("%s%s" % (" " * (4 * depth), node))
+
+
+if __name__ == '__main__':
+    main()
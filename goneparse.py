@@ -1,4 +1,3 @@
-from ply import yacc
 from errors import error
 from gonelex import tokens
 from goneast import *
@@ -72,6 +71,13 @@ def p_function_definition(p):
     p[0] = FunctionDefinition(p[1], p[3], lineno=p.lineno(2))
 
 
+def p_function_definition_inline(p):
+    '''
+    function_definition : INLINE func_prototype LBRACE block RBRACE
+    '''
+    p[0] = FunctionDefinition(p[2], p[4], inline=True, lineno=p.lineno(3))
+
+
 def p_return_statemnt(p):
     '''
     return_statement : RETURN expression SEMI
@@ -302,8 +308,13 @@ def p_error(p):
 
 
 def make_parser():
-    parser = yacc.yacc()
-    return parser
+    '''
+    Make the parser object, from the prebuilt tables of gonetables when
+    they are up to date
+    '''
+    import sys
+    import gonetables
+    return gonetables.make_parser(sys.modules[__name__])
 
 
 def main():
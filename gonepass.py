@@ -0,0 +1,238 @@
+# gonepass.py
+'''
+Pass manager running the optimization passes over the code produced by
+gonecode, between gonecode and the backends.
+
+Passes are registered by name in the passes table.  A pass is a
+function taking the GenerateCode object and rewriting it in place; what
+it returns (usually the number of instructions it changed) is kept in
+the report.  The passes run at each optimization level are listed in
+levels:
+
+    -O0   nothing
+    -O1   constant folding and dead code elimination
+    -O2   tail calls, inlining, value numbering, loop invariant code
+          motion, strength reduction and peephole rules on top
+    -O3   loops are unrolled as well
+
+gonessa is the pass named ssa.  When SSA form is asked for, it runs
+after the passes that only handle memory form well (tail and inline),
+and before the others.
+
+Every pass is timed, and the number of instructions, temporaries and
+blocks is counted before and after it.  The report is printed as a
+table or as JSON:
+
+    bash % python3 goneinterp.py -O2 --stats tests/functions/mandel.g
+    bash % python3 goneinterp.py -O2 --stats-json tests/functions/mandel.g
+'''
+
+import json
+import sys
+import time
+
+import gonedce
+import gonefold
+import gonegvn
+import goneinline
+import goneloop
+import gonepeep
+import gonessa
+import gonetail
+from goneblock import walk_blocks
+from gonecode import instruction_target
+
+passes = {
+    'tail': gonetail.eliminate_tail_calls,
+    'inline': goneinline.inline_functions,
+    'ssa': gonessa.construct_ssa,
+    'fold': gonefold.fold_constants,
+    'gvn': gonegvn.number_values,
+    'dce': gonedce.eliminate_dead_code,
+    'loop': goneloop.optimize_loops,
+    'unroll': lambda gen: goneloop.optimize_loops(gen, unroll=True),
+    'peep': gonepeep.optimize_peephole,
+}
+
+# Passes best run before gonessa
+memory_passes = ['tail', 'inline']
+
+levels = [
+    [],
+    ['fold', 'dce'],
+    ['tail', 'inline', 'fold', 'gvn', 'dce', 'loop', 'peep', 'dce'],
+    ['tail', 'inline', 'fold', 'gvn', 'dce', 'unroll', 'peep', 'fold', 'dce'],
+]
+
+
+def statistics(gen):
+    '''
+    Count the instructions, temporaries and blocks of a GenerateCode object.
+    '''
+    instructions = blocks = 0
+    temporaries = set()
+    for name, start_block, ret_type, arg_types in gen.functions:
+        for block in walk_blocks(start_block):
+            blocks += 1
+            instructions += len(block.instructions)
+            for inst in block.instructions:
+                target = instruction_target(inst)
+                if target is not None:
+                    temporaries.add(target)
+    return {'instructions': instructions, 'temporaries': len(temporaries), 'blocks': blocks}
+
+
+def pipeline(level, ssa=False, tail=False):
+    '''
+    Return the names of the passes run at an optimization level, with
+    gonessa and gonetail added if asked for.
+    '''
+    names = list(levels[level])
+    if tail and 'tail' not in names:
+        names.insert(0, 'tail')
+    if ssa:
+        early = [n for n, name in enumerate(names) if name in memory_passes]
+        names.insert(early[-1] + 1 if early else 0, 'ssa')
+    return names
+
+
+class PassManager(object):
+    '''
+    Runs a list of passes over a GenerateCode object.  report holds a
+    record for every pass run: its name, time in seconds, statistics
+    before and after it and the value it returned.
+    '''
+    def __init__(self, names):
+        for name in names:
+            if name not in passes:
+                raise ValueError("unknown pass '{}'".format(name))
+        self.names = names
+        self.report = []
+
+    def run(self, gen):
+        after = statistics(gen)
+        for name in self.names:
+            before = after
+            start = time.perf_counter()
+            result = passes[name](gen)
+            elapsed = time.perf_counter() - start
+            after = statistics(gen)
+            self.report.append({
+                'pass': name,
+                'time': elapsed,
+                'before': before,
+                'after': after,
+                'result': summarize(result),
+            })
+        return gen
+
+    def format_text(self):
+        lines = ["{:8} {:>10} {:>16} {:>16} {:>12}".format(
+            'pass', 'time (ms)', 'instructions', 'temporaries', 'blocks')]
+        for record in self.report:
+            columns = ["{:>5} -> {:<5}".format(record['before'][key], record['after'][key])
+                       for key in ('instructions', 'temporaries')]
+            columns.append("{:>3} -> {:<3}".format(record['before']['blocks'],
+                                                   record['after']['blocks']))
+            lines.append("{:8} {:10.3f} {:>16} {:>16} {:>12}".format(
+                record['pass'], record['time'] * 1000, *columns))
+        total = sum(record['time'] for record in self.report)
+        lines.append("{:8} {:10.3f}".format('total', total * 1000))
+        return "\n".join(lines)
+
+    def format_json(self):
+        return json.dumps(self.report, indent=2)
+
+
+def summarize(result):
+    # Keep what the passes return when it can go into JSON
+    if isinstance(result, (int, float)):
+        return result
+    if isinstance(result, tuple):
+        return list(result)
+    if isinstance(result, dict):
+        return dict(result)
+    return None
+
+
+def optimize(gen, level, ssa=False, tail=False):
+    '''
+    Run the passes of an optimization level over a GenerateCode object.
+    Returns the PassManager holding the report.
+    '''
+    manager = PassManager(pipeline(level, ssa, tail))
+    manager.run(gen)
+    return manager
+
+
+def add_arguments(parser, level=True):
+    '''
+    Add the options of the pass manager to the argparse parser of a driver.
+    Drivers with an -O option of their own (gonellvm) pass level=False.
+    '''
+    if level:
+        parser.add_argument('-O', dest='opt_level', type=int, choices=range(len(levels)),
+                            default=0, help="optimization level of the passes run over "
+                                            "the Gone code (-O0 to -O3, default -O0)")
+    parser.add_argument('--stats', action="store_true",
+                        help="report the time taken by every pass and the instructions, "
+                             "temporaries and blocks before and after it to stderr")
+    parser.add_argument('--stats-json', action="store_true",
+                        help="report the same as --stats, as JSON")
+
+
+def run_passes(gen, args):
+    '''
+    Run the passes selected by the options of a driver and report them.
+    '''
+    manager = optimize(gen, args.opt_level, getattr(args, 'ssa', False),
+                       getattr(args, 'tail', False))
+    if args.stats_json:
+        sys.stderr.write(manager.format_json() + "\n")
+    elif args.stats:
+        sys.stderr.write(manager.format_text() + "\n")
+    return manager
+
+
+def main():
+    import gonelex
+    import goneparse
+    import gonecheck
+    import gonecode
+    import argparse
+    from goneblock import EmitBlocksVisitor
+    from errors import subscribe_errors, errors_reported
+
+    parser = argparse.ArgumentParser("Optimize a Gone program and print its code")
+    parser.add_argument('file', type=str, default='', nargs=1,
+                        help="the file containing Gone source")
+    parser.add_argument('--ssa', action="store_true",
+                        help="promote variables to SSA temporaries with gonessa")
+    parser.add_argument('--passes', metavar='NAMES',
+                        help="comma separated passes to run instead of those of -O "
+                             "(" + ", ".join(passes) + ")")
+    add_arguments(parser)
+    args = parser.parse_args()
+    names = args.passes.split(',') if args.passes else pipeline(args.opt_level, args.ssa)
+    unknown = [name for name in names if name not in passes]
+    if unknown:
+        parser.error("unknown passes: " + ", ".join(unknown))
+
+    lexer = gonelex.make_lexer()
+    parser = goneparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
+        program = parser.parse(open(args.file[0]).read())
+        gonecheck.check_program(program)
+        if not errors_reported():
+            code = gonecode.generate_code(program)
+            manager = PassManager(names)
+            manager.run(code)
+            EmitBlocksVisitor().loop(code.functions)
+            if args.stats_json:
+                print(manager.format_json())
+            else:
+                print(manager.format_text())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+# gonepeep.py
+'''
+Peephole optimization of the code produced by gonecode.
+
+Every instruction is matched against a table of rules.  A rule is a
+function called with the optimizer and the instruction, returning None
+when it does not apply or what replaces the instruction: either a list
+of instructions or the name of a temporary already holding its value,
+in which case the instruction is removed and its uses renamed.  Rules
+can look at the instruction defining a temporary with definition() and
+at the value of a literal with literal().
+
+The optimizer counts the hits of every rule.  Other rules can be used
+by passing a table of their own:
+
+    PeepholeOptimizer(gen, rules + [my_rule])
+
+The default rules replace operations by cheaper ones (x * 2 by x + x, a
+float division by a power of two by a multiply), remove operations
+doing nothing (x * 1, x + 0, unary +, double negation), turn the
+negation of an integer comparison into the opposite comparison and
+reuse the temporary stored into or loaded from a variable in place of
+loading it again.
+'''
+
+import math
+from collections import Counter
+
+from goneblock import walk_blocks
+from gonecode import instruction_reads, instruction_target
+from gonessa import types
+
+inverse_comparisons = {
+    'lt': 'gte',
+    'gte': 'lt',
+    'gt': 'lte',
+    'lte': 'gt',
+    'eq': 'neq',
+    'neq': 'eq',
+}
+
+
+def split(inst):
+    return inst[0].split('_', 1)
+
+
+def operands(peep, inst):
+    '''
+    Return the operands of a binary instruction and the literal values
+    of each, None where it is not a literal.
+    '''
+    left, right = inst[1:3]
+    return left, right, peep.literal(left), peep.literal(right)
+
+
+# Rules
+def multiply_by_two(peep, inst):
+    '''
+    x * 2 is x + x
+    '''
+    opname, typename = split(inst)
+    if opname == 'mul':
+        left, right, left_value, right_value = operands(peep, inst)
+        if right_value == 2:
+            return [('add_' + typename, left, left, inst[3])]
+        if left_value == 2:
+            return [('add_' + typename, right, right, inst[3])]
+
+
+def multiply_by_one(peep, inst):
+    '''
+    x * 1 and 1 * x are x
+    '''
+    if split(inst)[0] == 'mul':
+        left, right, left_value, right_value = operands(peep, inst)
+        if right_value == 1:
+            return left
+        if left_value == 1:
+            return right
+
+
+def add_zero(peep, inst):
+    '''
+    x + 0, 0 + x and x - 0 are x for integers.  Not for floats, where
+    -0.0 + 0.0 is 0.0.
+    '''
+    opname, typename = split(inst)
+    if typename == 'int' and opname in ('add', 'sub'):
+        left, right, left_value, right_value = operands(peep, inst)
+        if right_value == 0:
+            return left
+        if left_value == 0 and opname == 'add':
+            return right
+
+
+def divide_by_one(peep, inst):
+    '''
+    x / 1 is x
+    '''
+    if split(inst)[0] == 'div':
+        left, right, left_value, right_value = operands(peep, inst)
+        if right_value == 1:
+            return left
+
+
+def divide_by_power_of_two(peep, inst):
+    '''
+    x / 4.0 is x * 0.25 exactly, and a multiply is cheaper than a division
+    '''
+    if inst[0] == 'div_float':
+        left, right, left_value, right_value = operands(peep, inst)
+        if right_value and math.isfinite(right_value):
+            mantissa, exponent = math.frexp(right_value)
+            reciprocal = 1.0 / right_value
+            if abs(mantissa) == 0.5 and reciprocal != 0.0 and math.isfinite(reciprocal):
+                value = peep.new_temp('float')
+                return [('literal_float', reciprocal, value),
+                        ('mul_float', left, value, inst[3])]
+
+
+def unary_plus(peep, inst):
+    '''
+    +x is x
+    '''
+    if split(inst)[0] == 'uadd':
+        return inst[1]
+
+
+def double_negation(peep, inst):
+    '''
+    -(-x) and !(!x) are x
+    '''
+    opname, typename = split(inst)
+    if opname in ('usub', 'not'):
+        source = peep.definition(inst[1])
+        if source is not None and source[0] == inst[0]:
+            return source[1]
+
+
+def inverse_comparison(peep, inst):
+    '''
+    !(a < b) is a >= b.  Only for integers and booleans, for floats the
+    comparisons differ for NaNs.
+    '''
+    if inst[0] == 'not_bool':
+        source = peep.definition(inst[1])
+        if source is not None:
+            opname, typename = split(source)
+            if opname in inverse_comparisons and typename != 'float':
+                return [('{}_{}'.format(inverse_comparisons[opname], typename),
+                         source[1], source[2], inst[2])]
+
+
+def load_after_store(peep, inst):
+    '''
+    A load of a variable stored or loaded earlier in the block, with no
+    store or call in between, gives the temporary already holding it.
+    '''
+    if split(inst)[0] == 'load':
+        return peep.memory.get(inst[1])
+
+
+rules = [
+    multiply_by_two,
+    multiply_by_one,
+    add_zero,
+    divide_by_one,
+    divide_by_power_of_two,
+    unary_plus,
+    double_negation,
+    inverse_comparison,
+    load_after_store,
+]
+
+
+class PeepholeOptimizer(object):
+    '''
+    Applies a table of rules to the instructions of every function of a
+    GenerateCode object.  hits counts the instructions each rule rewrote.
+    '''
+    def __init__(self, gen, rules=rules):
+        self.gen = gen
+        self.rules = rules
+        self.hits = Counter()
+
+    def run(self):
+        for name, start_block, ret_type, arg_types in self.gen.functions:
+            self.optimize_function(start_block, name == '@main')
+        return self.gen
+
+    def new_temp(self, typename):
+        return self.gen.new_temp(types[typename])
+
+    def literal(self, name):
+        inst = self.definitions.get(name)
+        if inst is not None and inst[0].startswith('literal_'):
+            return inst[1]
+        return None
+
+    def definition(self, name):
+        return self.definitions.get(name)
+
+    def resolve(self, name):
+        while name in self.replace:
+            name = self.replace[name]
+        return name
+
+    def rename(self, inst):
+        reads = instruction_reads(inst)
+        if not any(name in self.replace for name in reads):
+            return inst
+        inst = list(inst)
+        if inst[0] == 'call_func':
+            inst[3:] = [self.resolve(name) for name in inst[3:]]
+        else:
+            for n in range(1, len(reads) + 1):
+                inst[n] = self.resolve(inst[n])
+        return tuple(inst)
+
+    def optimize_function(self, start_block, is_main):
+        self.replace = {}
+        self.definitions = {}
+        locals_ = set()
+        for block in walk_blocks(start_block):
+            for inst in block.instructions:
+                if split(inst)[0] in ('alloc', 'parm'):
+                    locals_.add(inst[1])
+                if instruction_target(inst) is not None:
+                    self.definitions[instruction_target(inst)] = inst
+
+        for block in walk_blocks(start_block):
+            # Temporaries holding the values of variables in this block
+            self.memory = {}
+            instructions = []
+            for inst in block.instructions:
+                inst = self.rename(inst)
+                result = None
+                for rule in self.rules:
+                    result = rule(self, inst)
+                    if result is not None:
+                        self.hits[rule.__name__] += 1
+                        break
+                if result is None:
+                    result = [inst]
+                elif isinstance(result, str):
+                    self.replace[inst[-1]] = result
+                    continue
+                for new in result:
+                    if instruction_target(new) is not None:
+                        self.definitions[instruction_target(new)] = new
+                    self.remember(new, is_main, locals_)
+                instructions.extend(result)
+            block.instructions = instructions
+
+        for block in walk_blocks(start_block):
+            block.instructions = [self.rename(inst) for inst in block.instructions]
+            if getattr(block, 'testvar', None) is not None:
+                block.testvar = self.resolve(block.testvar)
+
+    def remember(self, inst, is_main, locals_):
+        opname = split(inst)[0]
+        if opname == 'store':
+            self.memory[inst[2]] = inst[1]
+        elif opname == 'load':
+            self.memory[inst[1]] = inst[2]
+        elif opname == 'call':
+            # The callee may change any global
+            for name in list(self.memory):
+                if is_main or name not in locals_:
+                    del self.memory[name]
+
+
+def optimize_peephole(gen, rules=rules):
+    '''
+    Apply the peephole rules to every function of a GenerateCode object.
+    Returns the hits of every rule.
+    '''
+    optimizer = PeepholeOptimizer(gen, rules)
+    optimizer.run()
+    return optimizer.hits
+
+
+def main():
+    import gonelex
+    import goneparse
+    import gonecheck
+    import gonecode
+    import sys
+    from goneblock import EmitBlocksVisitor
+    from errors import subscribe_errors, errors_reported
+    lexer = gonelex.make_lexer()
+    parser = goneparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        gonecheck.check_program(program)
+        if not errors_reported():
+            code = gonecode.generate_code(program)
+            hits = optimize_peephole(code)
+            EmitBlocksVisitor().loop(code.functions)
+            for rule in rules:
+                print("{:24} {}".format(rule.__name__, hits[rule.__name__]))
+
+
+if __name__ == '__main__':
+    main()
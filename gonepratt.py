@@ -0,0 +1,370 @@
+# gonepratt.py
+'''
+A hand-written recursive descent parser for Gone.
+
+goneparse is an LALR parser built by PLY: for every token, the parser
+looks its action up in the tables, and every reduction calls a p_
+function through a YaccProduction object, so each statement and each
+operator of a program costs several Python calls.  This parser reads
+the same grammar with a method per statement, and parses expressions
+by precedence climbing (Pratt parsing): the binding power and
+associativity of every operator are taken from goneparse.precedence.
+
+It builds the same goneast nodes as goneparse, with the same line
+numbers.  That includes the line 0 PLY gives to nodes whose line is
+taken from a nonterminal, such as Statements, PrintStatement or
+ExpressionList.
+
+On the first syntax error, this parser gives up.  It replays the tokens
+read so far to goneparse, which parses the program again, so errors and
+the recovery from them are exactly those of goneparse.  Valid programs
+never touch PLY.  Select it with --parser pratt in the drivers, or
+compare both parsers on a file:
+
+    bash % python3 gonepratt.py --compare tests/functions/mandel.g
+'''
+
+import sys
+
+import goneparse
+from goneast import *
+
+# Binding power and associativity of the binary operators, in the order
+# of goneparse.precedence
+binary_operators = {}
+for _power, (_assoc, *_names) in enumerate(goneparse.precedence, 1):
+    for _name in _names:
+        if _name == 'UNARY':
+            unary_power = _power
+        else:
+            binary_operators[_name] = (_power, _assoc)
+
+comparison_operators = {'AND', 'OR', 'LT', 'GT', 'LTE', 'GTE', 'EQ', 'NEQ'}
+literal_types = {'INTEGER', 'FLOAT', 'STRING', 'BOOL'}
+
+
+class ParseError(Exception):
+    '''
+    Raised at the first token the grammar does not allow.
+    '''
+    pass
+
+
+class Replay(object):
+    '''
+    Lexer giving back the tokens already read from another lexer, then
+    the rest of its tokens.
+    '''
+    def __init__(self, tokens, lexer):
+        self.tokens = iter(tokens)
+        self.lexer = lexer
+
+    def token(self):
+        tok = next(self.tokens, None)
+        return tok if tok is not None else self.lexer.token()
+
+
+class Parser(object):
+    '''
+    Parser with the parse() method of a PLY parser.
+    '''
+    def __init__(self):
+        self.statements = {
+            'PRINT': self.print_statement,
+            'CONST': self.const_declaration,
+            'VAR': self.var_declaration,
+            'ID': self.assign_statement,
+            'EXTERN': self.extern_declaration,
+            'IF': self.conditional_statement,
+            'WHILE': self.while_statement,
+            'RETURN': self.return_statement,
+            'FUNC': self.function_definition,
+            'INLINE': self.function_definition,
+        }
+
+    def parse(self, input=None, lexer=None):
+        '''
+        Parse the tokens of lexer, after giving it input if not None,
+        and return the Program.  Like PLY, use the last lexer made when
+        lexer is None.
+        '''
+        if lexer is None:
+            from ply import lex
+            lexer = lex.lexer
+        if input is not None:
+            lexer.input(input)
+        self.next_token = lexer.token
+        self.read = []
+        self.advance()
+        try:
+            return Program(self.block(None), lineno=0)
+        except ParseError:
+            return goneparse.make_parser().parse(lexer=Replay(self.read, lexer))
+        finally:
+            self.next_token = self.read = self.tok = None
+
+    def advance(self):
+        tok = self.next_token()
+        self.tok = tok
+        if tok is None:
+            self.type = None
+        else:
+            self.read.append(tok)
+            self.type = tok.type
+
+    def expect(self, type):
+        tok = self.tok
+        if self.type != type:
+            raise ParseError(tok)
+        self.advance()
+        return tok
+
+    def block(self, end):
+        '''
+        Statements up to the token of type end (None at the end of the
+        input), or None if there are none.
+        '''
+        statements = None
+        while self.type != end:
+            parse = self.statements.get(self.type)
+            if parse is None:
+                raise ParseError(self.tok)
+            statement = parse()
+            if statements is None:
+                statements = Statements([statement], lineno=0)
+            else:
+                statements.statements.append(statement)
+        return statements
+
+    def braced_block(self):
+        '''
+        LBRACE block RBRACE.  Returns the block and the LBRACE token.
+        '''
+        lbrace = self.expect('LBRACE')
+        block = self.block('RBRACE')
+        self.advance()
+        return block, lbrace
+
+    # Statements
+
+    def print_statement(self):
+        self.advance()
+        expr = self.expression()
+        self.expect('SEMI')
+        return PrintStatement(expr, lineno=0)
+
+    def const_declaration(self):
+        self.advance()
+        name = self.expect('ID')
+        self.expect('ASSIGN')
+        expr = self.expression()
+        self.expect('SEMI')
+        return ConstDeclaration(name.value, expr, lineno=0)
+
+    def var_declaration(self):
+        var = self.tok
+        self.advance()
+        name = self.expect('ID')
+        typename = self.expect('ID')
+        if self.type == 'ASSIGN':
+            self.advance()
+            expr = self.expression()
+            self.expect('SEMI')
+            return VarDeclarationAssignment(name.value, typename.value, expr, lineno=var.lineno)
+        self.expect('SEMI')
+        return VarDeclaration(name.value, typename.value, lineno=name.lineno)
+
+    def assign_statement(self):
+        name = self.tok
+        self.advance()
+        if self.type == 'LPAREN':
+            # function_call : ID LPAREN exprlist RPAREN SEMI
+            call = self.call(name)
+            self.expect('SEMI')
+            return call
+        assign = self.expect('ASSIGN')
+        expr = self.expression()
+        self.expect('SEMI')
+        return AssignmentStatement(name.value, expr, lineno=assign.lineno)
+
+    def extern_declaration(self):
+        self.advance()
+        prototype = self.prototype()
+        self.expect('SEMI')
+        return ExternDeclaration(prototype, lineno=0)
+
+    def conditional_statement(self):
+        tok = self.tok
+        self.advance()
+        expr = self.expression()
+        true_block, lbrace = self.braced_block()
+        false_block = None
+        if self.type == 'ELSE':
+            self.advance()
+            false_block, lbrace = self.braced_block()
+        return ConditionalStatement(expr, true_block, false_block, lineno=tok.lineno)
+
+    def while_statement(self):
+        tok = self.tok
+        self.advance()
+        expr = self.expression()
+        block, lbrace = self.braced_block()
+        return WhileStatement(expr, block, lineno=tok.lineno)
+
+    def return_statement(self):
+        tok = self.tok
+        self.advance()
+        expr = self.expression()
+        self.expect('SEMI')
+        return ReturnStatement(expr, lineno=tok.lineno)
+
+    def function_definition(self):
+        if self.type == 'INLINE':
+            self.advance()
+            prototype = self.prototype()
+            block, lbrace = self.braced_block()
+            return FunctionDefinition(prototype, block, inline=True, lineno=lbrace.lineno)
+        prototype = self.prototype()
+        block, lbrace = self.braced_block()
+        return FunctionDefinition(prototype, block, lineno=lbrace.lineno)
+
+    def prototype(self):
+        self.expect('FUNC')
+        name = self.expect('ID')
+        self.expect('LPAREN')
+        # parameters : parameters COMMA parm_declaration | parm_declaration | empty
+        parameters = []
+        if self.type != 'RPAREN' and self.type != 'COMMA':
+            parameters.append(self.parameter())
+        while self.type == 'COMMA':
+            self.advance()
+            parameters.append(self.parameter())
+        self.expect('RPAREN')
+        typename = self.expect('ID')
+        return FunctionPrototype(name.value, Parameters(parameters, lineno=0), typename.value,
+                                 lineno=name.lineno)
+
+    def parameter(self):
+        name = self.expect('ID')
+        typename = self.expect('ID')
+        return ParameterDeclaration(name.value, typename.value, lineno=name.lineno)
+
+    # Expressions
+
+    def expression(self, power=1):
+        '''
+        An expression whose binary operators bind at least as tightly
+        as power.
+        '''
+        left = self.operand()
+        while True:
+            operator = binary_operators.get(self.type)
+            if operator is None or operator[0] < power:
+                return left
+            tok = self.tok
+            self.advance()
+            right = self.expression(operator[0] + 1 if operator[1] == 'left' else operator[0])
+            if tok.type in comparison_operators:
+                left = ComparisonBinOp(left, tok.value, right, lineno=tok.lineno)
+            else:
+                left = BinOp(left, tok.value, right, lineno=tok.lineno)
+
+    def operand(self):
+        tok = self.tok
+        type = self.type
+        if type in literal_types:
+            self.advance()
+            return Literal(tok.value, lineno=tok.lineno)
+        if type == 'ID':
+            self.advance()
+            if self.type == 'LPAREN':
+                return self.call(tok)
+            return Location(tok.value, lineno=tok.lineno)
+        if type == 'LPAREN':
+            self.advance()
+            expr = self.expression()
+            rparen = self.expect('RPAREN')
+            return ExpressionGrouping(expr, lineno=rparen.lineno)
+        if type == 'PLUS' or type == 'MINUS':
+            self.advance()
+            return UnaryOp(tok.value, self.expression(unary_power), lineno=tok.lineno)
+        if type == 'NOT':
+            self.advance()
+            return BooleanUnaryOp(tok.value, self.expression(unary_power), lineno=tok.lineno)
+        raise ParseError(tok)
+
+    def call(self, name):
+        '''
+        ID LPAREN exprlist RPAREN, the ID being read already.
+        '''
+        self.advance()
+        # exprlist : exprlist COMMA expression | expression | empty
+        expressions = []
+        if self.type != 'RPAREN' and self.type != 'COMMA':
+            expressions.append(self.expression())
+        while self.type == 'COMMA':
+            self.advance()
+            expressions.append(self.expression())
+        rparen = self.expect('RPAREN')
+        return NamedExpressionList(name.value, ExpressionList(expressions, lineno=0),
+                                   lineno=rparen.lineno)
+
+
+def make_parser():
+    return Parser()
+
+
+def parse_times(source, repeat=20):
+    '''
+    Return the best time taken by goneparse and by this parser to parse
+    source, in seconds, given the tokens of gonescan.
+    '''
+    import time
+    import gonescan
+    tokens = list(gonescan.Scanner().scan(source))
+    times = {}
+    for name, parser in (('lalr', goneparse.make_parser()), ('pratt', make_parser())):
+        best = None
+        for n in range(repeat):
+            lexer = Replay(tokens, gonescan.Scanner())
+            start = time.perf_counter()
+            parser.parse(lexer=lexer)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times[name] = best
+    return times
+
+
+def main():
+    import argparse
+    import gonescan
+    from errors import subscribe_errors
+
+    parser = argparse.ArgumentParser("Parse a Gone program with the recursive descent parser")
+    parser.add_argument('file', type=str, default='', nargs=1,
+                        help="the file containing Gone source")
+    parser.add_argument('--compare', action="store_true",
+                        help="check that goneparse builds the same tree and compare "
+                             "the time both parsers take")
+    args = parser.parse_args()
+    source = gonescan.read_file(args.file[0])
+
+    with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
+        program = make_parser().parse(source, lexer=gonescan.Scanner())
+        if args.compare:
+            expected = goneparse.make_parser().parse(source, lexer=gonescan.Scanner())
+            same = [(depth, repr(node), node.lineno) for depth, node in flatten(program)] == \
+                [(depth, repr(node), node.lineno) for depth, node in flatten(expected)]
+            print("same tree: {}".format('yes' if same else 'NO'))
+            times = parse_times(source)
+            for name in ('lalr', 'pratt'):
+                print("{:6} {:8.3f}ms".format(name, times[name] * 1000))
+            print("speedup {:.1f}x".format(times['lalr'] / times['pratt']))
+            return
+
+    for depth, node in flatten(program):
+        print("%s%s" % (" " * (4 * depth), node))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+# gonepy.py
+'''
+Translate Gone SSA instructions into Python source code.
+
+The block graph of every function produced by gonecode is turned into
+structured Python: a WhileBlock becomes a while loop, a ConditionalBlock
+an if statement and each Gone function a Python function whose locals
+are the Gone locals.  The toplevel code becomes a function _gone_main()
+that declares every Gone global as a Python global.
+
+Temporaries that are used only once are folded into the expression that
+uses them, so that
+
+    load a -> t1; load b -> t2; add t1, t2 -> t3; store t3 -> c
+
+turns into "v_c = (v_a + v_b)".  The resulting source is compiled once
+with compile() and run with exec(), leaving all the work to CPython's own
+bytecode interpreter.
+
+Gone names are prefixed to keep them apart from Python keywords and
+builtins: variables become v_name, functions f_name and externs x_name.
+'''
+
+import sys
+from collections import defaultdict
+
+from goneinterp import lookup_extern, _idiv
+from gonecode import instruction_reads
+from goneblock import phis
+
+binary_operators = {
+    'add': '+',
+    'sub': '-',
+    'mul': '*',
+    'div': '/',
+    'lt': '<',
+    'gt': '>',
+    'lte': '<=',
+    'gte': '>=',
+    'eq': '==',
+    'neq': '!=',
+    'and': 'and',
+    'or': 'or',
+}
+
+unary_operators = {
+    'uadd': '+',
+    'usub': '-',
+    'not': 'not ',
+}
+
+
+class GeneratePython(object):
+    '''
+    Generates Python source from the functions in GenerateCode.functions.
+    '''
+    def __init__(self):
+        self.lines = []
+        self.indent = 0
+        self.user_functions = set()
+        self.externs = {}
+
+    def generate(self, toplevel_blocks):
+        '''
+        Return Python source for the (name, start_block, ret_type,
+        arg_types) tuples found in GenerateCode.functions.
+        '''
+        self.user_functions = {name for name, _, _, _ in toplevel_blocks}
+        for name, start_block, ret_type, arg_types in toplevel_blocks:
+            self.generate_function(name, start_block)
+        return "\n".join(self.lines) + "\n"
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def generate_function(self, name, start_block):
+        self.is_main = name == '@main'
+        self.locals = set()
+        self.params = []
+        self.global_stores = set()
+        self.uses = defaultdict(int)
+        self.pending = {}
+        self.pending_reads = defaultdict(set)
+        self.pending_vars = {}
+        self.scan(start_block)
+
+        header = len(self.lines)
+        self.indent = 1
+        self.generate_blocks(start_block)
+        self.flush()
+        if len(self.lines) == header:
+            self.emit("pass")
+        self.indent = 0
+
+        if self.is_main:
+            declared = sorted(self.global_stores)
+            signature = "def _gone_main():"
+        else:
+            declared = sorted(self.global_stores - self.locals)
+            signature = "def {}({}):".format(self.function_name(name),
+                                             ", ".join(self.variable(p) for p in self.params))
+        lines = [signature]
+        if declared:
+            lines.append("    global " + ", ".join(self.variable(v) for v in declared))
+        self.lines[header:header] = lines
+        self.lines.append("")
+
+    def scan(self, block):
+        '''
+        Find the locals and parameters of the function and count how often
+        every temporary is used.
+        '''
+        while block is not None:
+            for inst in block.instructions:
+                opname = inst[0].split('_', 1)[0]
+                if opname == 'alloc':
+                    self.locals.add(inst[1])
+                elif opname == 'parm':
+                    self.locals.add(inst[1])
+                    self.params.extend([None] * (inst[2] + 1 - len(self.params)))
+                    self.params[inst[2]] = inst[1]
+                elif opname == 'store':
+                    self.global_stores.add(inst[2])
+                elif opname == 'extern':
+                    self.externs[inst[1]] = lookup_extern(inst[1])
+                for name in instruction_reads(inst):
+                    self.uses[name] += 1
+            if getattr(block, 'testvar', None) is not None:
+                self.uses[block.testvar] += 1
+            for branch in ('true_branch', 'false_branch', 'loop_branch'):
+                self.scan(getattr(block, branch, None))
+            block = block.next_block
+
+    # Names
+    def variable(self, name):
+        return "v_" + name
+
+    def function_name(self, name):
+        if name in self.user_functions:
+            return "f_" + name
+        return "x_" + name
+
+    def is_global(self, name):
+        return self.is_main or name not in self.locals
+
+    # Temporaries waiting to be folded into the expression using them,
+    # along with the variables they read.
+    def define(self, target, expr, reads=()):
+        if self.uses[target] == 1:
+            self.pending[target] = expr
+            self.pending_vars[target] = set(reads)
+            for var in reads:
+                self.pending_reads[var].add(target)
+        elif self.uses[target]:
+            self.emit("{} = {}".format(target, expr))
+
+    def use(self, name):
+        if name in self.pending:
+            return self.pending.pop(name)
+        return name
+
+    def reads(self, *names):
+        '''
+        Return the variables read by the pending expressions of names.
+        An expression folding them in reads the same variables.
+        '''
+        return set().union(*[self.pending_vars.get(name, ()) for name in names])
+
+    def kill(self, var):
+        '''
+        The variable var is about to change.  Evaluate any pending
+        expression that still has to see its old value.
+        '''
+        for temp in sorted(self.pending_reads.pop(var, ())):
+            if temp in self.pending:
+                self.emit("{} = {}".format(temp, self.pending.pop(temp)))
+
+    def kill_globals(self):
+        for var in [v for v in self.pending_reads if self.is_global(v)]:
+            self.kill(var)
+
+    def flush(self):
+        for temp in sorted(self.pending):
+            self.emit("{} = {}".format(temp, self.pending[temp]))
+        self.pending.clear()
+        self.pending_reads.clear()
+        self.pending_vars.clear()
+
+    # Block graph
+    def generate_blocks(self, block):
+        while block is not None:
+            getattr(self, 'generate_' + type(block).__name__)(block)
+            block = block.next_block
+
+    def generate_BasicBlock(self, block):
+        self.generate_instructions(block.instructions)
+
+    def generate_body(self, block, phis=(), edge=0):
+        start = len(self.lines)
+        self.indent += 1
+        self.generate_blocks(block)
+        self.move_phis(phis, edge)
+        self.flush()
+        if len(self.lines) == start:
+            self.emit("pass")
+        self.indent -= 1
+
+    def move_phis(self, phis, edge):
+        '''
+        Assign the phi targets for control arriving along the given edge
+        (0 or 1, see gonessa).  A tuple assignment sets them all at once.
+        '''
+        if phis:
+            sources = [self.use(inst[1 + edge]) for inst in phis]
+            # A phi target may be read by a pending expression
+            self.flush()
+            self.emit("{} = {}".format(", ".join(inst[3] for inst in phis), ", ".join(sources)))
+
+    def generate_ConditionalBlock(self, block):
+        merge = phis(block.next_block) if block.next_block is not None else []
+        self.generate_instructions(block.instructions)
+        test = self.use(block.testvar)
+        self.flush()
+        self.emit("if {}:".format(test))
+        self.generate_body(block.true_branch, merge, 0)
+        if block.false_branch is not None or merge:
+            self.emit("else:")
+            self.generate_body(block.false_branch, merge, 1)
+
+    def generate_WhileBlock(self, block):
+        loop_phis = phis(block)
+        self.flush()
+        self.move_phis(loop_phis, 0)
+        outer = self.lines
+        self.lines = []
+        self.indent += 1
+        self.generate_instructions(block.instructions)
+        test = self.use(block.testvar)
+        self.flush()
+        self.indent -= 1
+        header, self.lines = self.lines, outer
+        if header:
+            # The test needs statements of its own
+            self.emit("while True:")
+            self.lines.extend(header)
+            self.indent += 1
+            self.emit("if not {}:".format(test))
+            self.indent += 1
+            self.emit("break")
+            self.indent -= 2
+        else:
+            self.emit("while {}:".format(test))
+        self.generate_body(block.loop_branch, loop_phis, 1)
+
+    # Instructions
+    def generate_instructions(self, instructions):
+        for inst in instructions:
+            opname, typename = inst[0].split('_', 1)
+            if opname in binary_operators:
+                self.generate_binop(opname, typename, *inst[1:])
+            elif opname in unary_operators:
+                self.generate_unop(opname, typename, *inst[1:])
+            else:
+                getattr(self, 'generate_' + opname)(typename, *inst[1:])
+
+    def generate_global(self, typename, name):
+        pass
+
+    def generate_const(self, typename, name, value=None):
+        # Constants folded by gonefold carry their value
+        if value is not None:
+            self.global_stores.add(name)
+            self.emit("{} = {!r}".format(self.variable(name), value))
+
+    def generate_alloc(self, typename, name):
+        pass
+
+    def generate_parm(self, typename, name, argn):
+        pass
+
+    def generate_extern(self, typename, name, ret_type, *arg_types):
+        pass
+
+    def generate_phi(self, typename, src_a, src_b, target):
+        # Assigned at the end of the predecessors, see move_phis()
+        pass
+
+    def generate_literal(self, typename, value, target):
+        if typename == 'bool' and isinstance(value, str):
+            value = value == 'true'
+        self.define(target, repr(value))
+
+    def generate_load(self, typename, name, target):
+        self.define(target, self.variable(name), [name])
+
+    def generate_store(self, typename, source, name):
+        expr = self.use(source)
+        self.kill(name)
+        self.emit("{} = {}".format(self.variable(name), expr))
+
+    def generate_binop(self, opname, typename, left, right, target):
+        reads = self.reads(left, right)
+        left, right = self.use(left), self.use(right)
+        if (opname, typename) == ('div', 'int'):
+            expr = "_idiv({}, {})".format(left, right)
+        else:
+            expr = "({} {} {})".format(left, binary_operators[opname], right)
+        self.define(target, expr, reads)
+
+    def generate_unop(self, opname, typename, source, target):
+        reads = self.reads(source)
+        self.define(target, "({}{})".format(unary_operators[opname], self.use(source)), reads)
+
+    def generate_print(self, typename, source):
+        expr = self.use(source)
+        if typename == 'bool':
+            self.emit("print('true' if {} else 'false')".format(expr))
+        else:
+            self.emit("print({})".format(expr))
+
+    def generate_return(self, typename, source):
+        self.emit("return {}".format(self.use(source)))
+
+    def generate_call(self, typename, name, target, *func_args):
+        call = "{}({})".format(self.function_name(name),
+                               ", ".join(self.use(arg) for arg in func_args))
+        # Anything still waiting to read a global must do so before the call
+        self.kill_globals()
+        if self.uses[target]:
+            self.emit("{} = {}".format(target, call))
+        else:
+            self.emit(call)
+
+
+def compile_program(toplevel_blocks, filename="<gone>"):
+    '''
+    Translate the functions in GenerateCode.functions to Python and compile
+    them.  Returns the source and a function running the program.
+    '''
+    gen = GeneratePython()
+    source = gen.generate(toplevel_blocks)
+    namespace = {'_idiv': _idiv}
+    for name, func in gen.externs.items():
+        namespace['x_' + name] = func
+    exec(compile(source, filename, 'exec'), namespace)
+    return source, namespace['_gone_main']
+
+
+def main():
+    import gonebin
+    import gonepass
+    import time
+    import argparse
+    from errors import subscribe_errors
+
+    parser = argparse.ArgumentParser("Translate a Gone program to Python and run it")
+    parser.add_argument('file', type=str, default='', nargs=1,
+                        help="the file containing Gone source or code written by gonebin")
+    parser.add_argument('--verbose', '-v', action="store_true",
+                        help="print the generated Python source before running")
+    parser.add_argument('--ssa', action="store_true",
+                        help="promote variables to SSA temporaries with gonessa first")
+    gonebin.add_arguments(parser)
+    gonepass.add_arguments(parser)
+    args = parser.parse_args()
+
+    with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
+        code = gonebin.compile_file(args.file[0], args.parser, args.jobs)
+        if code is not None:
+            gonepass.run_passes(code, args)
+            start = time.perf_counter()
+            source, run = compile_program(code.functions)
+            if args.verbose:
+                print(source)
+            run()
+            print(":::: FINISHED ::::")
+            print("execution time: {0:.15f}s".format(time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -15,3 +15,14 @@ void _print_bool(int x) {
     printf("false\n");
   }
 }
+
+#ifdef GONE_STANDALONE
+/* Entry point of standalone executables (see gonenative.py).  The Gone
+   toplevel code is compiled under the name __gone_start. */
+void __gone_start(void);
+
+int main(void) {
+  __gone_start();
+  return 0;
+}
+#endif
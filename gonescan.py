@@ -0,0 +1,321 @@
+# gonescan.py
+'''
+A hand-written scanner for Gone, producing the same tokens as gonelex.
+
+gonelex builds on PLY: every token is found by trying the alternatives
+of one big regular expression in turn, then handled by a Python
+function, and t_ID builds its table of reserved words for every
+identifier.  This scanner looks at the class of the first character of
+a token instead (letter, digit, quote, operator, ...), which decides
+what the token can be, and consumes the rest of it in a single pass
+with precompiled patterns and string searches.  Keywords are found in a
+table built once.
+
+The tokens, their values, line numbers and positions, and the errors
+reported are those of gonelex, including its quirks: the rules are
+tried in the order PLY tries them, so "trueish" is BOOL followed by ID,
+exponents of floats are only ever 1, and a // comment needs a newline
+to end it.  Use make_lexer() in place of gonelex.make_lexer():
+
+    bash % python3 gonescan.py tests/functions/mandel.g
+
+input_file() scans a file through a memory map, without reading it into
+a Python string first.  spans() gives the type and extent of every
+token without making its value, which gonetokens stores in arrays.
+'''
+
+import re
+import sys
+import mmap
+
+from errors import error
+
+# Classes of the first character of a token
+SPACE, NEWLINE, LETTER, DIGIT, DOT, QUOTE, SLASH, OPERATOR, ILLEGAL = range(9)
+
+char_classes = {}
+for _c in ' \t\r':
+    char_classes[_c] = SPACE
+char_classes['\n'] = NEWLINE
+for _c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_':
+    char_classes[_c] = LETTER
+for _c in '0123456789':
+    char_classes[_c] = DIGIT
+char_classes['.'] = DOT
+char_classes['"'] = QUOTE
+char_classes['/'] = SLASH
+for _c in '+-*=;(),<>!&|{}':
+    char_classes[_c] = OPERATOR
+
+keywords = {
+    'const': 'CONST',
+    'var': 'VAR',
+    'print': 'PRINT',
+    'func': 'FUNC',
+    'return': 'RETURN',
+    'extern': 'EXTERN',
+    'inline': 'INLINE',
+    'if': 'IF',
+    'else': 'ELSE',
+    'while': 'WHILE',
+}
+
+# Two character operators are tried first, as PLY tries longer patterns first
+operators = {
+    '<=': 'LTE', '>=': 'GTE', '==': 'EQ', '!=': 'NEQ', '&&': 'AND', '||': 'OR',
+    '+': 'PLUS', '-': 'MINUS', '*': 'TIMES', '/': 'DIVIDE', '=': 'ASSIGN',
+    ';': 'SEMI', '(': 'LPAREN', ')': 'RPAREN', ',': 'COMMA', '<': 'LT', '>': 'GT',
+    '!': 'NOT', '{': 'LBRACE', '}': 'RBRACE',
+}
+
+identifier_end = re.compile(r'[A-Za-z0-9_]*').match
+digits_end = re.compile(r'[0-9]*').match
+newlines_end = re.compile(r'\n*').match
+spaces_end = re.compile(r'[ \t\r]*').match
+
+
+class Token(object):
+    '''
+    A token, with the attributes of a PLY LexToken.
+    '''
+    __slots__ = ('type', 'value', 'lineno', 'lexpos', 'lexer')
+
+    def __init__(self, type, value, lineno, lexpos):
+        self.type = type
+        self.value = value
+        self.lineno = lineno
+        self.lexpos = lexpos
+
+    def __str__(self):
+        return "LexToken(%s,%r,%d,%d)" % (self.type, self.value, self.lineno, self.lexpos)
+
+    __repr__ = __str__
+
+
+def exponent_end(text, pos):
+    '''
+    Return where the exponent of a float starting at pos ends, or -1 if
+    there is none.  gonelex only accepts [eE][+-]?1.
+    '''
+    if text[pos:pos + 1] not in ('e', 'E'):
+        return -1
+    pos += 1
+    if text[pos:pos + 1] in ('+', '-') and text[pos + 1:pos + 2] == '1':
+        return pos + 2
+    if text[pos:pos + 1] == '1':
+        return pos + 1
+    return -1
+
+
+def float_end(text, pos):
+    '''
+    Return where a float starting at pos ends, or -1 if there is none.
+    '''
+    end = digits_end(text, pos).end()
+    if text[end:end + 1] == '.':
+        end = digits_end(text, end + 1).end()
+        exponent = exponent_end(text, end)
+        return exponent if exponent != -1 else end
+    return exponent_end(text, end)
+
+
+def string_value(value):
+    # As t_STRING does
+    value = value.replace("\\\\", "\\")
+    return value.replace("\\n", "\n")
+
+
+def read_file(path):
+    '''
+    Return the text of a file, decoded straight out of a memory map.
+    '''
+    with open(path, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return str(mapped, 'utf-8')
+        except ValueError:
+            # Empty files cannot be mapped
+            return ''
+
+
+# Conversions of the text of tokens into their values, as gonelex does
+converters = {
+    'INTEGER': int,
+    'FLOAT': float,
+    'BOOL': lambda text: text == 'true',
+    'STRING': lambda text: string_value(text[1:-1]),
+}
+
+
+class Scanner(object):
+    '''
+    Lexer with the interface of a PLY lexer: input() sets the text to
+    scan and token() returns the next token, or None at the end.
+    '''
+    def __init__(self):
+        self.lexdata = ''
+        self.lexpos = 0
+        self.lineno = 1
+        self.tokens = iter(())
+
+    def input(self, text):
+        self.lexdata = text
+        self.lexpos = 0
+        self.tokens = self.scan(text)
+
+    def input_file(self, path):
+        '''
+        Scan the text of a file, decoded straight out of a memory map.
+        '''
+        self.input(read_file(path))
+
+    def token(self):
+        return next(self.tokens, None)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        tok = self.token()
+        if tok is None:
+            raise StopIteration
+        return tok
+
+    def scan(self, text):
+        convert = converters.get
+        for type, start, end, lineno in self.spans(text):
+            value = text[start:end]
+            decode = convert(type)
+            yield Token(type, value if decode is None else decode(value), lineno, start)
+
+    def spans(self, text):
+        '''
+        Scan text, yielding the type, start, end and line of every token,
+        without making its value.
+        '''
+        classes = char_classes
+        lineno = self.lineno
+        pos = 0
+        length = len(text)
+        while pos < length:
+            c = text[pos]
+            kind = classes.get(c, ILLEGAL)
+            start = pos
+
+            if kind == SPACE:
+                pos = spaces_end(text, pos).end()
+                continue
+
+            if kind == NEWLINE:
+                pos = newlines_end(text, pos).end()
+                lineno += pos - start
+                continue
+
+            if kind == LETTER:
+                if c in 'eE':
+                    end = exponent_end(text, pos)
+                    if end != -1:
+                        pos = end
+                        type = 'FLOAT'
+                    else:
+                        pos = identifier_end(text, pos).end()
+                        type = keywords.get(text[start:pos], 'ID')
+                elif c == 't' and text.startswith('true', pos):
+                    pos += 4
+                    type = 'BOOL'
+                elif c == 'f' and text.startswith('false', pos):
+                    pos += 5
+                    type = 'BOOL'
+                else:
+                    pos = identifier_end(text, pos).end()
+                    type = keywords.get(text[start:pos], 'ID')
+
+            elif kind == DIGIT or kind == DOT:
+                end = float_end(text, pos)
+                if end != -1:
+                    pos = end
+                    type = 'FLOAT'
+                else:
+                    pos = digits_end(text, pos).end()
+                    type = 'INTEGER'
+
+            elif kind == QUOTE:
+                end = text.find('"', pos + 1)
+                newline = text.find('\n', pos + 1)
+                if end != -1 and (newline == -1 or end < newline):
+                    pos = end + 1
+                    type = 'STRING'
+                else:
+                    pos = newline if newline != -1 else length
+                    self.lexpos, self.lineno = pos, lineno
+                    error(lineno, "Unterminated string literal")
+                    lineno += 1
+                    continue
+
+            elif kind == SLASH and text.startswith('/*', pos):
+                end = text.find('*/', pos + 2)
+                if end != -1:
+                    pos = end + 2
+                    lineno += text.count('\n', start, pos)
+                else:
+                    pos = length
+                    self.lexpos, self.lineno = pos, lineno
+                    error(lineno, "Unterminated comment")
+                continue
+
+            elif kind == SLASH and text.startswith('//', pos) and \
+                    text.find('\n', pos + 2) != -1:
+                pos = text.find('\n', pos + 2) + 1
+                lineno += 1
+                continue
+
+            elif kind == OPERATOR or kind == SLASH:
+                if text[pos:pos + 2] in operators:
+                    pos += 2
+                elif c in operators:
+                    pos += 1
+                else:
+                    self.lexpos, self.lineno = pos + 1, lineno
+                    error(lineno, "Illegal character %r" % c)
+                    pos += 1
+                    continue
+                type = operators[text[start:pos]]
+
+            else:
+                self.lexpos, self.lineno = pos + 1, lineno
+                error(lineno, "Illegal character %r" % c)
+                pos += 1
+                continue
+
+            self.lexpos, self.lineno = pos, lineno
+            yield type, start, pos, lineno
+        self.lexpos, self.lineno = pos, lineno
+
+
+def make_lexer():
+    '''
+    Make a Scanner, as a drop-in for gonelex.make_lexer().  Like PLY's
+    lex(), it becomes the lexer parsers use when given none.
+    '''
+    from ply import lex
+    scanner = Scanner()
+    lex.lexer = scanner
+    return scanner
+
+
+def main():
+    from errors import subscribe_errors
+
+    if len(sys.argv) != 2:
+        sys.stderr.write("Usage: %s filename\n" % sys.argv[0])
+        raise SystemExit(1)
+
+    lexer = make_lexer()
+    with subscribe_errors(lambda msg: sys.stderr.write(msg + "\n")):
+        lexer.input_file(sys.argv[1])
+        for tok in iter(lexer.token, None):
+            sys.stdout.write("%s\n" % tok)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+# gonessa.py
+'''
+SSA construction for the code produced by gonecode.
+
+GenerateCode keeps every Gone variable in memory: each read is a load_*
+and each write a store_* on a named slot.  This pass promotes variables
+to temporaries, so that every temporary is assigned exactly once and
+the backends can keep values in registers.
+
+Where control flow merges, a phi instruction picks the value of a
+variable depending on the edge control arrived from:
+
+    ('phi_int', src_a, src_b, target)
+
+Phis only appear at the start of two kinds of blocks, which are the
+only ones with two predecessors:
+
+    * the header of a WhileBlock.  src_a is the value on entry to the
+      loop and src_b the value at the end of the loop body.
+
+    * the block following a ConditionalBlock (its next_block).  src_a is
+      the value at the end of the true branch and src_b the value at the
+      end of the false branch, or before the test if there is no else.
+
+GenerateCode already emits phis of temporaries for && and ||, which
+evaluate their right operand in a branch of their own.
+
+The construction is the classic one of Cytron et al.: build the flow
+graph, compute dominators and dominance frontiers, place phis on the
+iterated dominance frontier of the blocks storing a variable and rename
+with a walk over the dominator tree.
+
+Locals and parameters of every function are promoted, as are globals
+of the toplevel code that no function refers to.  Parameters are read
+from their slot once on entry.  Variables read before any store see the
+default value of their type.
+'''
+
+from collections import defaultdict
+
+from goneblock import phis
+from gonecode import instruction_reads
+from goneflow import FlowGraph
+from gonetype import int_type, float_type, string_type, bool_type
+
+types = {t.name: t for t in (int_type, float_type, string_type, bool_type)}
+
+defaults = {
+    'int': 0,
+    'float': 0.0,
+    'string': "",
+    'bool': False
+}
+
+
+class SSABuilder(object):
+    '''
+    Rewrites one function into SSA form.
+    '''
+    def __init__(self, gen, start_block, promoted):
+        self.gen = gen
+        self.start_block = start_block
+        self.promoted = promoted        # variable name -> type name
+        self.graph = FlowGraph(start_block)
+        self.stacks = defaultdict(list)
+        self.replace = {}
+        self.undefined = {}
+        self.pushed = {}
+        self.entry = []
+
+    def new_temp(self, typename):
+        return self.gen.new_temp(types[typename])
+
+    def build(self):
+        self.insert_phis()
+        self.rename(self.start_block)
+        self.resolve_phis()
+        self.place_phis()
+        for block in self.graph.blocks:
+            if not self.graph.reachable(block):
+                self.rename_unreachable(block)
+        self.start_block.instructions[0:0] = self.entry
+
+    def insert_phis(self):
+        '''
+        Place a phi for every promoted variable on the iterated dominance
+        frontier of the blocks storing it.
+        '''
+        stores = defaultdict(set)
+        for block in self.graph.order:
+            for inst in block.instructions:
+                if inst[0].startswith('store_') and inst[2] in self.promoted:
+                    stores[inst[2]].add(block)
+
+        self.phi_vars = defaultdict(list)
+        for var in sorted(stores):
+            work = list(stores[var])
+            placed = set()
+            while work:
+                block = work.pop()
+                for merge in self.graph.frontier[block]:
+                    if merge not in placed:
+                        placed.add(merge)
+                        self.phi_vars[merge].append(var)
+                        if merge not in stores[var]:
+                            work.append(merge)
+
+        self.phi_targets = {}
+        for block, variables in self.phi_vars.items():
+            self.phi_targets[block] = [self.new_temp(self.promoted[var]) for var in variables]
+        self.phi_sources = {block: [[None, None] for var in variables]
+                            for block, variables in self.phi_vars.items()}
+
+    def current(self, var):
+        if self.stacks[var]:
+            return self.stacks[var][-1]
+        return self.default(var)
+
+    def default(self, var):
+        # Value seen by reads not preceded by any store
+        if var not in self.undefined:
+            typename = self.promoted[var]
+            target = self.new_temp(typename)
+            self.entry.append(('literal_' + typename, defaults[typename], target))
+            self.undefined[var] = target
+        return self.undefined[var]
+
+    def resolve(self, name):
+        return self.replace.get(name, name)
+
+    def rewrite(self, inst):
+        '''
+        Rewrite a single instruction.  Returns the instructions replacing it.
+        '''
+        opname, typename = inst[0].split('_', 1)
+        if opname == 'load' and inst[1] in self.promoted:
+            self.replace[inst[2]] = self.current(inst[1])
+            return []
+        if opname == 'store' and inst[2] in self.promoted:
+            self.stacks[inst[2]].append(self.resolve(inst[1]))
+            return []
+        if opname in ('alloc', 'global', 'const') and inst[1] in self.promoted:
+            return []
+        if opname == 'parm' and inst[1] in self.promoted:
+            # Parameters arrive in their slot and are read from it once
+            target = self.new_temp(typename)
+            self.stacks[inst[1]].append(target)
+            return [inst, ('load_' + typename, inst[1], target)]
+        reads = instruction_reads(inst)
+        if any(name in self.replace for name in reads):
+            inst = list(inst)
+            if opname == 'call':
+                inst[3:] = [self.resolve(name) for name in inst[3:]]
+            else:
+                for n in range(1, len(reads) + 1):
+                    inst[n] = self.resolve(inst[n])
+            inst = tuple(inst)
+        return [inst]
+
+    def rewrite_block(self, block):
+        instructions = []
+        for inst in block.instructions:
+            instructions.extend(self.rewrite(inst))
+        block.instructions = instructions
+        if getattr(block, 'testvar', None) is not None:
+            block.testvar = self.resolve(block.testvar)
+
+    def rename(self, start_block):
+        '''
+        Rename variables walking the dominator tree.  The walk uses an
+        explicit stack, as long programs give deep dominator trees.
+        '''
+        work = [(start_block, True)]
+        while work:
+            block, entering = work.pop()
+            if entering:
+                work.append((block, False))
+                self.enter(block)
+                work.extend((child, True) for child in reversed(self.graph.children[block]))
+            else:
+                self.leave(block)
+
+    def enter(self, block):
+        pushed = [inst[2] for inst in block.instructions
+                  if inst[0].startswith('store_') and inst[2] in self.promoted]
+        pushed += [inst[1] for inst in block.instructions
+                   if inst[0].startswith('parm_') and inst[1] in self.promoted]
+        for var, target in zip(self.phi_vars.get(block, ()), self.phi_targets.get(block, ())):
+            self.stacks[var].append(target)
+            pushed.append(var)
+        self.pushed[block] = pushed
+
+        self.rewrite_block(block)
+
+        for succ in self.graph.succs[block]:
+            if succ in self.phi_vars:
+                edge = self.graph.preds[succ].index(block)
+                for var, sources in zip(self.phi_vars[succ], self.phi_sources[succ]):
+                    sources[edge] = self.current(var)
+
+    def leave(self, block):
+        for var in self.pushed.pop(block):
+            self.stacks[var].pop()
+
+    def resolve_phis(self):
+        # Phis already in the code (see GenerateCode for && and ||) may read
+        # loads the walk only replaced after rewriting them
+        for block in self.graph.blocks:
+            count = len(phis(block))
+            block.instructions[:count] = [
+                (inst[0], self.resolve(inst[1]), self.resolve(inst[2]), inst[3])
+                for inst in block.instructions[:count]]
+
+    def place_phis(self):
+        for block, variables in self.phi_vars.items():
+            block.instructions[0:0] = [
+                ('phi_' + self.promoted[var], sources[0], sources[1], target)
+                for var, sources, target in zip(variables, self.phi_sources[block],
+                                                self.phi_targets[block])]
+
+    def rename_unreachable(self, block):
+        # Code that never runs only has to stay well formed
+        saved, self.stacks = self.stacks, defaultdict(list)
+        self.rewrite_block(block)
+        self.stacks = saved
+
+
+def promotable_globals(toplevel_blocks):
+    '''
+    Return the globals of the toplevel code that no function refers to.
+    '''
+    declared, used = {}, set()
+    for name, start_block, ret_type, arg_types in toplevel_blocks:
+        for inst in walk_instructions(start_block):
+            opname, typename = inst[0].split('_', 1)
+            if name == '@main' and opname in ('global', 'const'):
+                declared[inst[1]] = typename
+            elif name != '@main' and opname == 'load':
+                used.add(inst[1])
+            elif name != '@main' and opname == 'store':
+                used.add(inst[2])
+    return {var: typename for var, typename in declared.items() if var not in used}
+
+
+def local_variables(start_block):
+    variables = {}
+    for inst in walk_instructions(start_block):
+        opname, typename = inst[0].split('_', 1)
+        if opname in ('alloc', 'parm'):
+            variables[inst[1]] = typename
+    return variables
+
+
+def walk_instructions(block):
+    while block is not None:
+        yield from block.instructions
+        for branch in ('true_branch', 'false_branch', 'loop_branch'):
+            yield from walk_instructions(getattr(block, branch, None))
+        block = block.next_block
+
+
+def construct_ssa(gen):
+    '''
+    Rewrite every function of a GenerateCode object into SSA form.
+    '''
+    toplevel_globals = promotable_globals(gen.functions)
+    for name, start_block, ret_type, arg_types in gen.functions:
+        promoted = toplevel_globals if name == '@main' else local_variables(start_block)
+        SSABuilder(gen, start_block, promoted).build()
+    return gen
+
+
+def main():
+    import gonelex
+    import goneparse
+    import gonecheck
+    import gonecode
+    import sys
+    from goneblock import EmitBlocksVisitor
+    from errors import subscribe_errors, errors_reported
+    lexer = gonelex.make_lexer()
+    parser = goneparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        gonecheck.check_program(program)
+        if not errors_reported():
+            code = construct_ssa(gonecode.generate_code(program))
+            EmitBlocksVisitor().loop(code.functions)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+# gonetables.py
+'''
+Prebuilt tables of the PLY lexer and parser.
+
+Building the lexer compiles and validates every token rule, and
+building the parser computes the LALR tables of the grammar, on every
+run of every tool.  Instead, the first run saves both next to the
+sources, the lexer in the table module gonelextab.py and the parser
+tables in goneparsetab.pickle, and later runs load them.  The parser
+tables are pickled as a pickle loads quickly even where Python does
+not cache the bytecode of modules.
+
+Tables are only loaded if they were built from the rules and grammar in
+the sources.  yacc stores the signature of the grammar with its tables
+and checks it itself.  The lexer table is loaded in PLY's optimized
+mode, which trusts it blindly, so it is stamped with a signature of the
+token rules, compared before loading.  When a signature does not
+match, the tables are built again and rewritten.
+
+    bash % python3 gonetables.py           # rebuild the tables
+    bash % python3 gonetables.py --time    # time the startup of the front end
+'''
+
+import os
+import sys
+import importlib.util
+
+directory = os.path.dirname(os.path.abspath(__file__))
+lexer_table = 'gonelextab'
+parser_table = 'goneparsetab.pickle'
+
+
+def lexer_signature(module):
+    '''
+    Return a signature of the token rules of a lexer module.
+    '''
+    from ply import lex
+    info = lex.LexerReflect(vars(module))
+    info.get_all()
+    parts = [lex.__tabversion__, sorted(info.tokens), sorted(info.literals),
+             sorted(info.stateinfo.items())]
+    for state in sorted(info.stateinfo):
+        # Function rules are tried in order of definition, string rules
+        # by decreasing length of their regex
+        parts.append([(name, getattr(f, 'regex', f.__doc__)) for name, f in info.funcsym[state]])
+        parts.append(sorted(info.strsym[state]))
+        parts.append(info.ignore.get(state))
+        parts.append([getattr(info.errorf.get(state), '__name__', None),
+                      getattr(info.eoff.get(state), '__name__', None)])
+    return repr(parts)
+
+
+def load_table(name):
+    '''
+    Load a table module from the directory of the sources, or return
+    None if there is none or it is broken.
+    '''
+    path = os.path.join(directory, name + '.py')
+    if not os.path.exists(path):
+        return None
+    spec = importlib.util.spec_from_file_location(name, path)
+    table = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(table)
+    except Exception:
+        return None
+    return table
+
+
+def make_lexer(module):
+    '''
+    Return the lexer of a module defining PLY token rules.
+    '''
+    from ply import lex
+    signature = lexer_signature(module)
+    table = load_table(lexer_table)
+    if table is not None and getattr(table, '_signature', None) == signature:
+        return lex.lex(module=module, optimize=True, lextab=table)
+
+    lexer = lex.lex(module=module)
+    try:
+        lexer.writetab(lexer_table, directory)
+        with open(os.path.join(directory, lexer_table + '.py'), 'a') as f:
+            f.write('_signature    = %r\n' % signature)
+    except OSError:
+        pass
+    return lexer
+
+
+def make_parser(module):
+    '''
+    Return the parser of a module defining PLY grammar rules.
+    '''
+    from ply import yacc
+    # yacc reads the pickled tables when the signature stored in them is
+    # that of the grammar, and rebuilds and pickles them otherwise
+    return yacc.yacc(module=module, picklefile=os.path.join(directory, parser_table),
+                     debug=False)
+
+
+def startup_times():
+    '''
+    Time the import of the front end and of PLY and the creation of the
+    lexer and parser, in seconds.  Only meaningful in a fresh interpreter.
+    '''
+    import time
+    times = {}
+    start = time.perf_counter()
+    import gonelex
+    import goneparse
+    import gonecheck
+    import gonecode
+    times['import'] = time.perf_counter() - start
+    start = time.perf_counter()
+    from ply import lex, yacc
+    times['ply'] = time.perf_counter() - start
+    start = time.perf_counter()
+    gonelex.make_lexer()
+    times['lexer'] = time.perf_counter() - start
+    start = time.perf_counter()
+    goneparse.make_parser()
+    times['parser'] = time.perf_counter() - start
+    return times
+
+
+def main():
+    import json
+    import argparse
+    import subprocess
+
+    parser = argparse.ArgumentParser("Build the tables of the Gone lexer and parser")
+    parser.add_argument('--time', action="store_true",
+                        help="time the startup of the front end in a new interpreter, "
+                             "with the tables built and without them")
+    args = parser.parse_args()
+
+    tables = [os.path.join(directory, lexer_table + '.py'), os.path.join(directory, parser_table)]
+    if args.time:
+        script = "import json, gonetables; print(json.dumps(gonetables.startup_times()))"
+        for label in ('without tables', 'with tables'):
+            if label == 'without tables':
+                for path in tables:
+                    if os.path.exists(path):
+                        os.remove(path)
+            output = subprocess.check_output([sys.executable, '-c', script], cwd=directory,
+                                             stderr=subprocess.DEVNULL)
+            times = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+            print("{:15} import {:6.2f}ms  ply {:6.2f}ms  lexer {:6.2f}ms  parser {:6.2f}ms".format(
+                label, times['import'] * 1000, times['ply'] * 1000, times['lexer'] * 1000,
+                times['parser'] * 1000))
+        return
+
+    for path in tables:
+        if os.path.exists(path):
+            os.remove(path)
+    import gonelex
+    import goneparse
+    gonelex.make_lexer()
+    goneparse.make_parser()
+    for path in tables:
+        print("wrote {}".format(path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+# gonetail.py
+'''
+Tail call elimination for the code produced by gonecode.
+
+A function returning the result of a call to itself
+
+    func gcd(a int, b int) int {
+        if b == 0 {
+            return a;
+        }
+        return gcd(b, a - a / b * b);
+    }
+
+needs a new frame for every call, on the native stack in gonellvm and
+gonec and on the Python stack in the interpreters.  This pass turns
+such self tail calls (a call_func followed by a return of its result)
+into a loop running in constant stack space.
+
+The body of the function becomes the body of a while loop.  A tail
+call stores its arguments into the parameters and clears a flag set at
+the start of the body, and the loop runs again while the flag is clear.
+The block graph has no jumps, so the code following a tail call runs
+under an if testing the flag, as for the returns of inlined functions
+(see goneinline).  Parameters and locals are declared once, before the
+loop, and locals are set to their default value again by their
+declaration in the body.
+
+Tail calls to other functions are left alone.  gonellvm marks them as
+tail calls for llvm.  Functions in SSA form (see gonessa) are left alone
+when a phi follows an if holding a tail call, as the test of the flag
+would separate the phi from its if.
+'''
+
+from goneblock import BasicBlock, ConditionalBlock, WhileBlock, walk_blocks, phis
+from goneinline import guard
+from gonessa import types
+
+
+def is_tail_call(inst, following):
+    '''
+    True if inst is a call whose result is returned by the instruction
+    following it.
+    '''
+    return inst[0] == 'call_func' and following is not None and \
+        following[0].startswith('return_') and following[1] == inst[2]
+
+
+def tail_calls(block):
+    '''
+    Return the calls of a block directly followed by a return of their result.
+    '''
+    return [inst for inst, following in zip(block.instructions, block.instructions[1:])
+            if is_tail_call(inst, following)]
+
+
+class TailCallEliminator(object):
+    '''
+    Turns the self tail calls of a single function into a loop.
+    '''
+    def __init__(self, gen, name, start_block):
+        self.gen = gen
+        self.name = name
+        self.start_block = start_block
+        self.flag = name + '__running__tail'
+        self.eliminated = 0
+
+    def new_temp(self, typename):
+        return self.gen.new_temp(types[typename])
+
+    def self_calls(self, block):
+        return [inst for inst in tail_calls(block) if inst[1] == self.name]
+
+    def eliminable(self):
+        '''
+        True if the function has self tail calls and testing the flag after
+        them keeps the phis of the function in place.
+        '''
+        found = False
+        for block in walk_blocks(self.start_block):
+            found = found or bool(self.self_calls(block))
+            if isinstance(block, ConditionalBlock) and block.next_block is not None \
+                    and phis(block.next_block):
+                for branch in (block.true_branch, block.false_branch):
+                    if any(self.self_calls(b) for b in walk_blocks(branch)):
+                        return False
+        return found
+
+    def run(self):
+        '''
+        Rewrite the function.  Returns its new start block.
+        '''
+        if not self.eliminable():
+            return self.start_block
+
+        # Declarations are made once, before the loop
+        parameters, declarations = {}, []
+        for block in walk_blocks(self.start_block):
+            instructions = []
+            for inst in block.instructions:
+                opname = inst[0].split('_', 1)[0]
+                if opname == 'parm':
+                    parameters[inst[2]] = inst
+                if opname in ('parm', 'alloc'):
+                    declarations.append(inst)
+                else:
+                    instructions.append(inst)
+            block.instructions = instructions
+        self.parameters = [parameters[n] for n in sorted(parameters)]
+
+        for block in walk_blocks(self.start_block):
+            if isinstance(block, BasicBlock):
+                self.rewrite_block(block)
+
+        entry = BasicBlock()
+        entry.instructions = declarations + [('alloc_bool', self.flag)]
+        entry.instructions += self.set_flag(False)
+
+        # The loop runs again while a tail call left the flag clear
+        loop = WhileBlock()
+        running, again = self.new_temp('bool'), self.new_temp('bool')
+        loop.instructions = [('load_bool', self.flag, running),
+                             ('not_bool', running, again)]
+        loop.testvar = again
+
+        body = BasicBlock()
+        body.instructions = self.set_flag(True)
+        body.next_block = guard(self.gen, self.start_block, self.flag)[0]
+        loop.loop_branch = body
+        entry.next_block = loop
+        return entry
+
+    def set_flag(self, value):
+        value_temp = self.new_temp('bool')
+        return [('literal_bool', value, value_temp), ('store_bool', value_temp, self.flag)]
+
+    def rewrite_block(self, block):
+        instructions = []
+        for inst, following in zip(block.instructions, block.instructions[1:] + [None]):
+            if is_tail_call(inst, following) and inst[1] == self.name:
+                # All arguments are computed before any parameter is stored
+                for parm, arg in zip(self.parameters, inst[3:]):
+                    instructions.append(('store_' + parm[0].split('_', 1)[1], arg, parm[1]))
+                instructions.extend(self.set_flag(False))
+                self.eliminated += 1
+                # The return and anything after it are left out
+                break
+            instructions.append(inst)
+        block.instructions = instructions
+
+
+def eliminate_tail_calls(gen):
+    '''
+    Turn the self tail calls of every function of a GenerateCode object
+    into loops.  Returns the number of calls eliminated.
+    '''
+    eliminated = 0
+    for n, (name, start_block, ret_type, arg_types) in enumerate(gen.functions):
+        if name == '@main':
+            continue
+        eliminator = TailCallEliminator(gen, name, start_block)
+        start_block = eliminator.run()
+        gen.functions[n] = (name, start_block, ret_type, arg_types)
+        eliminated += eliminator.eliminated
+    return eliminated
+
+
+def main():
+    import gonelex
+    import goneparse
+    import gonecheck
+    import gonecode
+    import sys
+    from goneblock import EmitBlocksVisitor
+    from errors import subscribe_errors, errors_reported
+    lexer = gonelex.make_lexer()
+    parser = goneparse.make_parser()
+    with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
+        program = parser.parse(open(sys.argv[1]).read())
+        gonecheck.check_program(program)
+        if not errors_reported():
+            code = gonecode.generate_code(program)
+            eliminate_tail_calls(code)
+            EmitBlocksVisitor().loop(code.functions)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+# gonetokens.py
+'''
+A compact stream of the tokens of a Gone program.
+
+Every token PLY or gonescan makes is an object holding its type, its
+value (a new string, int or float) and its position, and holding all of
+the tokens of a file takes a list of them.  A TokenStream keeps the
+tokens of a file in four array columns instead:
+
+    types       the type of every token, numbered in the order of
+                gonelex.tokens
+    starts      where the text of every token starts in the source
+    lengths     the length of the text of every token
+    lines       the line of every token
+
+and nothing else but the source text.  Values are decoded from the text
+only when asked for, with the same conversions as gonescan.
+
+tokenize() scans a text into a stream with gonescan, reporting the
+lexical errors of the whole text as it goes, so before the parser
+reports any syntax error.  StreamLexer gives a stream the interface of a
+PLY lexer, so that the parser reads it one token at a time:
+
+    lexer = StreamLexer(tokenize_file('tests/functions/mandel.g'))
+    program = parser.parse(lexer=lexer)
+
+gonetokens.py prints the tokens of a file, or with --memory the memory
+taken per token by PLY's LexTokens, gonescan's Tokens and a stream:
+
+    bash % python3 gonetokens.py --memory tests/functions/mandel.g
+'''
+
+import sys
+from array import array
+
+from gonelex import tokens
+from gonescan import Scanner, Token, converters, read_file
+
+type_names = list(tokens)
+type_codes = {name: code for code, name in enumerate(type_names)}
+
+
+class TokenStream(object):
+    '''
+    The tokens of a text, in array columns.
+    '''
+    def __init__(self, text):
+        self.text = text
+        self.types = array('B')
+        self.starts = array('I')
+        self.lengths = array('I')
+        self.lines = array('I')
+        # The line the scanner ended on
+        self.lineno = 1
+
+    def __len__(self):
+        return len(self.types)
+
+    def append(self, type, start, end, lineno):
+        self.types.append(type_codes[type])
+        self.starts.append(start)
+        self.lengths.append(end - start)
+        self.lines.append(lineno)
+
+    def type(self, n):
+        return type_names[self.types[n]]
+
+    def source(self, n):
+        '''
+        Return the text of token n.
+        '''
+        start = self.starts[n]
+        return self.text[start:start + self.lengths[n]]
+
+    def value(self, n):
+        '''
+        Decode the value of token n from the text.
+        '''
+        decode = converters.get(type_names[self.types[n]])
+        text = self.source(n)
+        return text if decode is None else decode(text)
+
+    def token(self, n):
+        '''
+        Return token n as a gonescan Token.
+        '''
+        return Token(self.type(n), self.value(n), self.lines[n], self.starts[n])
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self.token(n)
+
+    def nbytes(self):
+        return sum(column.itemsize * len(column)
+                   for column in (self.types, self.starts, self.lengths, self.lines))
+
+
+def tokenize(text, lineno=1):
+    '''
+    Scan text into a TokenStream, starting at line lineno.
+    '''
+    stream = TokenStream(text)
+    scanner = Scanner()
+    scanner.lineno = lineno
+    append = stream.append
+    for type, start, end, line in scanner.spans(text):
+        append(type, start, end, line)
+    stream.lineno = scanner.lineno
+    return stream
+
+
+def tokenize_file(path):
+    '''
+    Scan the text of a file, read through a memory map, into a TokenStream.
+    '''
+    return tokenize(read_file(path))
+
+
+class StreamLexer(object):
+    '''
+    Lexer with the interface of a PLY lexer reading a TokenStream.
+    token() makes the Token of the next entry of the stream, which lives
+    only as long as the parser needs it.
+    '''
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else TokenStream('')
+        self.index = 0
+        self.lexpos = 0
+        self.lineno = self.stream.lineno
+
+    def input(self, text):
+        # Like PLY, line numbers go on from the previous input
+        self.stream = tokenize(text, self.lineno)
+        self.index = 0
+        self.lexpos = 0
+        self.lineno = self.stream.lineno
+
+    def input_file(self, path):
+        self.stream = tokenize(read_file(path), self.lineno)
+        self.index = 0
+        self.lexpos = 0
+        self.lineno = self.stream.lineno
+
+    def token(self):
+        n = self.index
+        if n >= len(self.stream):
+            return None
+        self.index = n + 1
+        tok = self.stream.token(n)
+        tok.lexer = self
+        self.lexpos = tok.lexpos + self.stream.lengths[n]
+        return tok
+
+    def __iter__(self):
+        return iter(self.token, None)
+
+
+def token_memory(text):
+    '''
+    Return the number of tokens of text and the bytes per token taken by
+    all of its tokens as PLY LexTokens, as gonescan Tokens and as a
+    TokenStream, measured with tracemalloc.  The source text is not
+    counted.
+    '''
+    import tracemalloc
+    import gonelex
+    from errors import subscribe_errors
+
+    def measure(make):
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            result = make()
+            return result, tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+
+    lexer = gonelex.make_lexer()
+    scanner = Scanner()
+    results = {}
+    with subscribe_errors(lambda msg: None):
+        lexer.input(text)
+        lextokens, results['LexToken'] = measure(lambda: list(lexer))
+        scanner.input(text)
+        scantokens, results['Token'] = measure(lambda: list(scanner))
+        stream, results['TokenStream'] = measure(lambda: tokenize(text))
+    count = len(stream)
+    return count, {name: size / max(count, 1) for name, size in results.items()}
+
+
+def main():
+    import argparse
+    from errors import subscribe_errors
+
+    parser = argparse.ArgumentParser("Scan a Gone program into a token stream")
+    parser.add_argument('file', type=str, default='', nargs=1,
+                        help="the file containing Gone source")
+    parser.add_argument('--memory', action="store_true",
+                        help="print the memory taken per token instead of the tokens")
+    args = parser.parse_args()
+
+    if args.memory:
+        count, sizes = token_memory(read_file(args.file[0]))
+        print("{} tokens".format(count))
+        for name, size in sizes.items():
+            print("{:12} {:8.1f} bytes per token".format(name, size))
+        return
+
+    with subscribe_errors(lambda msg: sys.stderr.write(msg + "\n")):
+        for tok in StreamLexer(tokenize_file(args.file[0])):
+            sys.stdout.write("%s\n" % tok)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,503 @@
+# gonevm.py
+'''
+A register based virtual machine for Gone.
+
+Every function in GenerateCode.functions is lowered to a flat list of
+instructions operating on an array of registers.  Each variable, temporary
+and literal of a function gets a fixed register index.  Literals are stored
+in the function's register template once, so they cost nothing at run time.
+
+While lowering, common instruction sequences are fused into
+superinstructions:
+
+    load a -> t1; load b -> t2; add t1, t2 -> t3; store t3 -> x
+
+becomes the single instruction ADD x, a, b, and a comparison feeding the
+test of a conditional or while loop becomes a compare-and-branch.
+
+Calls push the caller onto an explicit frame stack instead of recursing in
+Python.  Register files of returning functions are kept in a per-function
+pool and handed out again on the next call.
+'''
+
+import sys
+import operator
+from collections import defaultdict
+
+from goneinterp import lookup_extern, _idiv
+from gonecode import instruction_reads
+from goneblock import phis
+
+# Opcodes, numbered roughly by how often they execute
+ADD, SUB, MUL, BRANCH_IF_NOT, JUMP, MOVE, BINOP, LOADG, STOREG, CALL, \
+    RET, CALLX, UNOP, JUMP_IF_FALSE, PRINT, PRINT_BOOL = range(16)
+
+opnames = ['ADD', 'SUB', 'MUL', 'BRANCH_IF_NOT', 'JUMP', 'MOVE', 'BINOP', 'LOADG',
+           'STOREG', 'CALL', 'RET', 'CALLX', 'UNOP', 'JUMP_IF_FALSE', 'PRINT',
+           'PRINT_BOOL']
+
+# Gone operators implemented by a Python function
+binary_functions = {
+    'add': operator.add,
+    'sub': operator.sub,
+    'mul': operator.mul,
+    'div': operator.truediv,
+    'lt': operator.lt,
+    'gt': operator.gt,
+    'lte': operator.le,
+    'gte': operator.ge,
+    'eq': operator.eq,
+    'neq': operator.ne,
+    'and': operator.and_,
+    'or': operator.or_,
+}
+
+comparisons = {'lt', 'gt', 'lte', 'gte', 'eq', 'neq'}
+
+unary_functions = {
+    'uadd': operator.pos,
+    'usub': operator.neg,
+    'not': operator.not_,
+}
+
+# Binary operators with a dedicated opcode
+fast_binary_ops = {'add': ADD, 'sub': SUB, 'mul': MUL}
+
+
+class VMFunction(object):
+    '''
+    A lowered function: its code, the initial contents of its register
+    file and a pool of register files released by earlier calls.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.code = []
+        self.template = []
+        self.params = []
+        self.pool = []
+
+    def new_frame(self):
+        return self.pool.pop() if self.pool else self.template[:]
+
+
+class FunctionLowering(object):
+    '''
+    Lowers the block graph of a single function to VM instructions.
+    '''
+    def __init__(self, vm, func, start_block, is_main):
+        self.vm = vm
+        self.func = func
+        self.start_block = start_block
+        self.is_main = is_main
+        # In @main every variable is a global and globals are registers of
+        # the main frame.  Elsewhere, globals are reached with LOADG/STOREG.
+        self.registers = vm.global_registers if is_main else {}
+        self.constants = {}
+        self.const_values = {}
+        self.uses = defaultdict(int)
+        # Temporaries produced by a load that can read the loaded variable's
+        # register directly, and the reverse mapping.
+        self.alias = {}
+        self.aliased_by = defaultdict(set)
+        # Index of the most recent jump target.  Instructions before it may
+        # not be moved past it.
+        self.label = 0
+
+    def lower(self):
+        self.count_uses(self.start_block)
+        self.lower_blocks(self.start_block)
+        self.flush()
+        self.emit(RET, None)
+        template = self.vm.globals if self.is_main else self.func.template
+        template.extend([None] * (len(self.registers) - len(template)))
+        for reg, value in self.constants.values():
+            template[reg] = value
+        for reg, value in self.const_values.items():
+            template[reg] = value
+
+    def count_uses(self, block):
+        while block is not None:
+            for inst in block.instructions:
+                for name in instruction_reads(inst):
+                    self.uses[name] += 1
+            if getattr(block, 'testvar', None) is not None:
+                self.uses[block.testvar] += 1
+            for branch in ('true_branch', 'false_branch', 'loop_branch'):
+                self.count_uses(getattr(block, branch, None))
+            block = block.next_block
+
+    # Registers
+    def register(self, name):
+        if name not in self.registers:
+            self.registers[name] = len(self.registers)
+        return self.registers[name]
+
+    def is_global(self, name):
+        return not self.is_main and name not in self.registers
+
+    def constant(self, value):
+        key = (type(value), value)
+        if key not in self.constants:
+            self.constants[key] = (self.register(key), value)
+        return self.constants[key][0]
+
+    def read(self, name):
+        '''
+        Return the register holding the current value of a temporary.
+        '''
+        self.uses[name] -= 1
+        if name in self.alias:
+            var = self.alias[name]
+            if not self.uses[name]:
+                del self.alias[name]
+                self.aliased_by[var].discard(name)
+            return self.registers[var]
+        return self.registers[name]
+
+    def kill(self, var):
+        '''
+        The variable var is about to be written.  Copy its value into any
+        temporary still reading it through an alias.
+        '''
+        for temp in self.aliased_by.pop(var, ()):
+            del self.alias[temp]
+            self.emit(MOVE, self.register(temp), self.registers[var])
+
+    def flush(self):
+        '''
+        Materialize all aliases.  Done before control flow joins or splits.
+        '''
+        for var in list(self.aliased_by):
+            self.kill(var)
+
+    def emit(self, *inst):
+        inst = inst + (None,) * (5 - len(inst))
+        self.func.code.append(inst)
+        return len(self.func.code) - 1
+
+    def patch(self, index, target=None):
+        inst = self.func.code[index]
+        target = len(self.func.code) if target is None else target
+        self.func.code[index] = inst[:-1] + (target,)
+        self.label = max(self.label, target)
+
+    # Block graph
+    def lower_blocks(self, block):
+        while block is not None:
+            getattr(self, 'lower_' + type(block).__name__)(block)
+            block = block.next_block
+
+    def lower_BasicBlock(self, block):
+        self.lower_instructions(block.instructions)
+
+    def lower_ConditionalBlock(self, block):
+        merge = phis(block.next_block) if block.next_block is not None else []
+        self.lower_instructions(block.instructions)
+        to_else = self.branch_if_false(block.testvar)
+        self.lower_blocks(block.true_branch)
+        self.flush()
+        self.move_phis(merge, 0)
+        if block.false_branch is not None or merge:
+            to_end = self.emit(JUMP)
+            self.patch(to_else)
+            self.lower_blocks(block.false_branch)
+            self.flush()
+            self.move_phis(merge, 1)
+            self.patch(to_end)
+        else:
+            self.patch(to_else)
+
+    def lower_WhileBlock(self, block):
+        header = phis(block)
+        self.flush()
+        self.move_phis(header, 0)
+        top = self.label = len(self.func.code)
+        self.lower_instructions(block.instructions)
+        to_exit = self.branch_if_false(block.testvar)
+        self.lower_blocks(block.loop_branch)
+        self.flush()
+        self.move_phis(header, 1)
+        self.emit(JUMP, None, None, None, top)
+        self.patch(to_exit)
+
+    def move_phis(self, phis, edge):
+        '''
+        Emit the copies made by phis when control arrives along the given
+        edge (0 or 1, see gonessa).  All phis of a block take their values
+        at once, so copies that would overwrite another source go through
+        scratch registers.
+        '''
+        moves = [(self.register(inst[3]), self.read(inst[1 + edge])) for inst in phis]
+        moves = [(dest, source) for dest, source in moves if dest != source]
+        targets = {dest for dest, source in moves}
+        if any(source in targets for dest, source in moves):
+            scratch = [self.register(('scratch', n)) for n in range(len(moves))]
+            for reg, (dest, source) in zip(scratch, moves):
+                self.emit(MOVE, reg, source)
+            moves = [(dest, reg) for reg, (dest, source) in zip(scratch, moves)]
+        for dest, source in moves:
+            self.emit(MOVE, dest, source)
+
+    def branch_if_false(self, testvar):
+        '''
+        Emit a branch taken when testvar is false, fusing it with the
+        comparison computing testvar when possible.  The branch target
+        is patched in later.
+        '''
+        last = self.func.code[-1] if len(self.func.code) > self.label else None
+        test = self.read(testvar)
+        if last is not None and last[0] == BINOP and last[1] == test and \
+                last[4] in self.compare_functions and not self.uses[testvar]:
+            self.func.code.pop()
+            self.flush()
+            return self.emit(BRANCH_IF_NOT, last[4], last[2], last[3])
+        self.flush()
+        return self.emit(JUMP_IF_FALSE, test)
+
+    compare_functions = {binary_functions[op] for op in comparisons}
+
+    # Instructions
+    def lower_instructions(self, instructions):
+        self.pending = iter(instructions)
+        self.next_inst = next(self.pending, None)
+        while self.next_inst is not None:
+            inst, self.next_inst = self.next_inst, next(self.pending, None)
+            opname, typename = inst[0].split('_', 1)
+            if opname in binary_functions:
+                self.lower_binop(opname, typename, *inst[1:])
+            elif opname in unary_functions:
+                self.lower_unop(opname, typename, *inst[1:])
+            else:
+                getattr(self, 'lower_' + opname)(typename, *inst[1:])
+
+    def destination(self, target):
+        '''
+        Return the register an instruction producing target should write.
+        When target is immediately stored into a variable and not used
+        elsewhere, the store is fused away and the variable written directly.
+        '''
+        store = self.next_inst
+        if store is not None and store[0].startswith('store_') and store[1] == target \
+                and self.uses[target] == 1 and not self.is_global(store[2]):
+            self.next_inst = next(self.pending, None)
+            self.uses[target] -= 1
+            self.kill(store[2])
+            return self.register(store[2])
+        return self.register(target)
+
+    def lower_global(self, typename, name):
+        self.register(name)
+
+    def lower_const(self, typename, name, value=None):
+        # Constants folded by gonefold carry their value
+        reg = self.register(name)
+        if value is not None:
+            self.const_values[reg] = value
+
+    def lower_alloc(self, typename, name):
+        self.register(name)
+
+    def lower_parm(self, typename, name, argn):
+        params = self.func.params
+        params.extend([None] * (argn + 1 - len(params)))
+        params[argn] = self.register(name)
+
+    def lower_phi(self, typename, src_a, src_b, target):
+        # The copies are made at the end of the predecessors, see move_phis()
+        self.register(target)
+
+    def lower_literal(self, typename, value, target):
+        if typename == 'bool' and isinstance(value, str):
+            value = value == 'true'
+        self.registers[target] = self.constant(value)
+
+    def lower_extern(self, typename, name, ret_type, *arg_types):
+        pass
+
+    def lower_load(self, typename, name, target):
+        if self.is_global(name):
+            self.emit(LOADG, self.destination(target), self.vm.global_register(name))
+        elif self.uses[target]:
+            self.alias[target] = name
+            self.aliased_by[name].add(target)
+            self.register(target)
+
+    def lower_store(self, typename, source, name):
+        source = self.read(source)
+        if self.is_global(name):
+            self.emit(STOREG, self.vm.global_register(name), source)
+        else:
+            self.kill(name)
+            self.emit(MOVE, self.register(name), source)
+
+    def lower_binop(self, opname, typename, left, right, target):
+        left, right = self.read(left), self.read(right)
+        dest = self.destination(target)
+        if opname in fast_binary_ops:
+            self.emit(fast_binary_ops[opname], dest, left, right)
+        else:
+            func = _idiv if (opname, typename) == ('div', 'int') else binary_functions[opname]
+            self.emit(BINOP, dest, left, right, func)
+
+    def lower_unop(self, opname, typename, source, target):
+        source = self.read(source)
+        self.emit(UNOP, self.destination(target), source, None, unary_functions[opname])
+
+    def lower_print(self, typename, source):
+        self.emit(PRINT_BOOL if typename == 'bool' else PRINT, self.read(source))
+
+    def lower_return(self, typename, source):
+        self.emit(RET, self.read(source))
+
+    def lower_call(self, typename, name, target, *func_args):
+        func_args = tuple(self.read(arg) for arg in func_args)
+        if self.is_main:
+            # The callee may change any global, and in @main all are registers
+            self.flush()
+        dest = self.destination(target)
+        if name in self.vm.functions:
+            self.emit(CALL, dest, self.vm.functions[name], func_args)
+        else:
+            self.emit(CALLX, dest, self.vm.externs[name], func_args)
+
+
+class VirtualMachine(object):
+    '''
+    Register machine running the functions produced by gonecode.  The
+    register file of @main doubles as storage for the globals.
+    '''
+    def __init__(self):
+        self.functions = {}
+        self.externs = {}
+        self.globals = []
+        self.global_registers = {}
+
+    def global_register(self, name):
+        if name not in self.global_registers:
+            self.global_registers[name] = len(self.global_registers)
+        return self.global_registers[name]
+
+    def load(self, toplevel_blocks):
+        '''
+        Lower the (name, start_block, ret_type, arg_types) tuples found in
+        GenerateCode.functions.
+        '''
+        for name, start_block, ret_type, arg_types in toplevel_blocks:
+            self.functions[name] = VMFunction(name)
+            self._find_externs(start_block)
+        # Lower @main last so that globals first referenced by functions get
+        # registers in the main frame as well.
+        for name, start_block, ret_type, arg_types in reversed(toplevel_blocks):
+            FunctionLowering(self, self.functions[name], start_block, name == '@main').lower()
+        self.globals.extend([None] * (len(self.global_registers) - len(self.globals)))
+
+    def _find_externs(self, block):
+        while block is not None:
+            for inst in block.instructions:
+                if inst[0] == 'extern_func':
+                    self.externs[inst[1]] = lookup_extern(inst[1])
+            for branch in ('true_branch', 'false_branch', 'loop_branch'):
+                self._find_externs(getattr(block, branch, None))
+            block = block.next_block
+
+    def disassemble(self, out=sys.stdout):
+        for func in self.functions.values():
+            out.write("FUNCTION: {} ({} registers)\n".format(func.name, len(func.template)))
+            for pc, inst in enumerate(func.code):
+                operands = [getattr(a, '__name__', getattr(a, 'name', a)) for a in inst[1:]]
+                while operands and operands[-1] is None:
+                    operands.pop()
+                out.write("    {:4d} {} {}\n".format(pc, opnames[inst[0]], operands))
+
+    def run(self):
+        '''
+        Run the toplevel code.  Returns the value returned by @main.
+        '''
+        func = self.functions['@main']
+        code = func.code
+        regs = G = self.globals
+        pc = 0
+        stack = []
+        while True:
+            op, a, b, c, d = code[pc]
+            pc += 1
+            if op == ADD:
+                regs[a] = regs[b] + regs[c]
+            elif op == SUB:
+                regs[a] = regs[b] - regs[c]
+            elif op == MUL:
+                regs[a] = regs[b] * regs[c]
+            elif op == BRANCH_IF_NOT:
+                if not a(regs[b], regs[c]):
+                    pc = d
+            elif op == JUMP:
+                pc = d
+            elif op == MOVE:
+                regs[a] = regs[b]
+            elif op == BINOP:
+                regs[a] = d(regs[b], regs[c])
+            elif op == LOADG:
+                regs[a] = G[b]
+            elif op == STOREG:
+                G[a] = regs[b]
+            elif op == CALL:
+                frame = b.new_frame()
+                for param, arg in zip(b.params, c):
+                    frame[param] = regs[arg]
+                stack.append((func, pc, regs, a))
+                func, code, regs, pc = b, b.code, frame, 0
+            elif op == RET:
+                value = None if a is None else regs[a]
+                if not stack:
+                    return value
+                func.pool.append(regs)
+                func, pc, regs, dest = stack.pop()
+                code = func.code
+                regs[dest] = value
+            elif op == CALLX:
+                regs[a] = b(*[regs[arg] for arg in c])
+            elif op == UNOP:
+                regs[a] = d(regs[b])
+            elif op == JUMP_IF_FALSE:
+                if not regs[a]:
+                    pc = d
+            elif op == PRINT:
+                print(regs[a])
+            elif op == PRINT_BOOL:
+                print(str(regs[a]).lower())
+
+
+def main():
+    import gonebin
+    import gonepass
+    import time
+    import argparse
+    from errors import subscribe_errors
+
+    parser = argparse.ArgumentParser("Run a Gone program from a .g or .gir file on the register VM")
+    parser.add_argument('file', type=str, default='', nargs=1,
+                        help="the file containing Gone source or code written by gonebin")
+    parser.add_argument('--verbose', '-v', action="store_true",
+                        help="print the lowered VM code before running")
+    parser.add_argument('--ssa', action="store_true",
+                        help="promote variables to SSA temporaries with gonessa first")
+    gonebin.add_arguments(parser)
+    gonepass.add_arguments(parser)
+    args = parser.parse_args()
+
+    with subscribe_errors(lambda msg: sys.stdout.write(msg + "\n")):
+        code = gonebin.compile_file(args.file[0], args.parser, args.jobs)
+        if code is not None:
+            gonepass.run_passes(code, args)
+            start = time.perf_counter()
+            vm = VirtualMachine()
+            vm.load(code.functions)
+            if args.verbose:
+                vm.disassemble()
+            vm.run()
+            print(":::: FINISHED ::::")
+            print("execution time: {0:.15f}s".format(time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
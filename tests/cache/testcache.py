@@ -0,0 +1,85 @@
+# testcache.py
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+import gonecache
+
+
+def build_library(value):
+    '''
+    Return a build function compiling a library whose answer() returns value.
+    '''
+    def build(path):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = os.path.join(tmpdir, 'lib.c')
+            with open(source, 'w') as f:
+                f.write("int answer(void) { return %d; }\n" % value)
+            subprocess.check_call(['gcc', '-shared', '-fPIC', source, '-o', path])
+    return build
+
+
+@unittest.skipUnless(shutil.which('gcc'), "gcc is not available")
+class TestNativeCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = gonecache.NativeCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_key(self):
+        key = self.cache.key("print 1;", ['-O0'])
+        self.assertEqual(key, self.cache.key("print 1;", ['-O0']))
+        self.assertNotEqual(key, self.cache.key("print 1;", ['-O2']))
+        self.assertNotEqual(key, self.cache.key("print 2;", ['-O0']))
+
+    def test_miss_then_hit(self):
+        key = self.cache.key("print 1;")
+        self.assertIsNone(self.cache.load(key))
+        self.cache.store(key, build_library(42))
+        self.assertEqual(self.cache.load(key).answer(), 42)
+        self.assertEqual(os.listdir(self.directory).count(key + '.so'), 1)
+
+    def test_store_returns_new_entry(self):
+        self.cache.store('a', build_library(1))
+        self.cache.max_size = os.path.getsize(self.cache.path('a'))
+        build = build_library(2)
+
+        def build_while_used(path):
+            build(path)
+            # Another run uses 'a' after this build finished
+            self.cache.load('a')
+        self.assertEqual(self.cache.store('b', build_while_used).answer(), 2)
+        self.assertTrue(os.path.exists(self.cache.path('b')))
+        self.assertFalse(os.path.exists(self.cache.path('a')))
+
+    def test_failed_build_leaves_nothing(self):
+        def build(path):
+            raise subprocess.CalledProcessError(1, 'gcc')
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.cache.store('broken', build)
+        self.assertEqual([f for f in os.listdir(self.directory) if f != 'lock'], [])
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.store('a', build_library(1))
+        self.cache.store('b', build_library(2))
+        size = os.path.getsize(self.cache.path('a'))
+        # Make 'a' the most recently used entry
+        past = time.time() - 100
+        os.utime(self.cache.path('b'), (past, past))
+        self.cache.load('a')
+
+        self.cache.max_size = 2 * size
+        self.cache.store('c', build_library(3))
+        self.assertTrue(os.path.exists(self.cache.path('a')))
+        self.assertFalse(os.path.exists(self.cache.path('b')))
+        self.assertTrue(os.path.exists(self.cache.path('c')))
+
+
+if __name__ == '__main__':
+    unittest.main()
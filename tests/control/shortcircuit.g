@@ -0,0 +1,39 @@
+var n int = 0;
+
+func touch(x int) bool {
+    n = n + 1;
+    print x;
+    return true;
+}
+
+func search(limit int) int {
+    var i int = 0;
+    while i < limit && touch(i) {
+        if i > 2 || touch(100 + i) {
+            i = i + 2;
+        } else {
+            i = i + 1;
+        }
+    }
+    return i;
+}
+
+var t bool = true;
+var f bool = false;
+print f && touch(1);
+print t || touch(2);
+print t && touch(3);
+print f || touch(4);
+print (f && touch(5)) || (t && !f);
+if f && touch(6) {
+    print 6;
+} else {
+    print 7;
+}
+print search(5);
+print n;
+var k int = 0;
+while k < 3 && (t || touch(9)) {
+    k = k + 1;
+}
+print k;
@@ -0,0 +1,43 @@
+/* Recursive functions whose last act is to call themselves */
+
+func gcd(a int, b int) int {
+    if b == 0 {
+        return a;
+    }
+    return gcd(b, a - a / b * b);
+}
+
+func sum(n int, total int) int {
+    if n == 0 {
+        return total;
+    } else {
+        return sum(n - 1, total + n);
+    }
+}
+
+func count(n int, step int) int {
+    var i int = 0;
+    while i < 3 {
+        if n > 100000 {
+            return n;
+        }
+        if i == 2 {
+            return count(n + step, step);
+        }
+        i = i + 1;
+    }
+    print -1;
+    return n;
+}
+
+func even(n int) bool {
+    if n == 0 {
+        return true;
+    }
+    return !even(n - 1);
+}
+
+print gcd(1071, 462);
+print sum(60000, 0);
+print count(0, 7);
+print even(10);
@@ -0,0 +1,329 @@
+# testinterp.py
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+from contextlib import redirect_stdout
+
+import gonelex
+import goneparse
+import gonecheck
+import gonecode
+import goneinterp
+import gonevm
+import gonepy
+import gonec
+import gonessa
+from errors import subscribe_errors, errors_reported, clear_errors
+
+lexer = gonelex.make_lexer()
+parser = goneparse.make_parser()
+
+
+def generate(source, ssa=False):
+    clear_errors()
+    errors = []
+    with subscribe_errors(errors.append):
+        program = parser.parse(source, lexer=lexer)
+        gonecheck.check_program(program)
+    assert not errors_reported(), errors
+    code = gonecode.generate_code(program)
+    if ssa:
+        gonessa.construct_ssa(code)
+    return code
+
+
+def run_closure(source, ssa=False):
+    code = generate(source, ssa)
+    out = io.StringIO()
+    with redirect_stdout(out):
+        interpreter = goneinterp.CompiledInterpreter()
+        interpreter.compile(code.functions)
+        interpreter.run()
+    return out.getvalue().split()
+
+
+def run_vm(source, ssa=False):
+    code = generate(source, ssa)
+    out = io.StringIO()
+    with redirect_stdout(out):
+        vm = gonevm.VirtualMachine()
+        vm.load(code.functions)
+        vm.run()
+    return out.getvalue().split()
+
+
+def run_python(source, ssa=False):
+    code = generate(source, ssa)
+    out = io.StringIO()
+    with redirect_stdout(out):
+        source, run = gonepy.compile_program(code.functions)
+        run()
+    return out.getvalue().split()
+
+
+def run_c(source, ssa=False):
+    code = generate(source, ssa)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        exe = os.path.join(tmpdir, 'program')
+        gonec.build_executable(gonec.GenerateC().generate(code.functions), exe)
+        return subprocess.check_output([exe]).decode('utf-8').split()
+
+
+class TestCompiledInterpreter(unittest.TestCase):
+    execute = staticmethod(run_closure)
+
+    def test_arithmetic(self):
+        self.assertEqual(
+            self.execute(open('tests/codegen/test_int.g').read()),
+            ['6', '3', '-1', '12', '3', '1', '-1', '13'])
+
+    def test_integer_division_truncates(self):
+        self.assertEqual(
+            self.execute('print 7 / 2; print -7 / 2; print 7.0 / 2.0;'),
+            ['3', '-3', '3.5'])
+
+    def test_relations(self):
+        self.assertEqual(
+            self.execute('var a int = 2; print a < 3; print !(a < 3) || a == 2;'),
+            ['true', 'true'])
+
+    def test_loops(self):
+        self.assertEqual(
+            self.execute(open('tests/control/fact.g').read()),
+            ['1', '2', '6', '24', '120', '720', '5040', '40320', '362880'])
+
+    def test_conditionals(self):
+        self.assertEqual(
+            self.execute(open('tests/control/cond.g').read()),
+            ['3', '2', '3'])
+
+    def test_functions(self):
+        out = self.execute(open('tests/functions/func.g').read())
+        self.assertEqual(out[:6], ['5', '1', '1', '2', '3', '5'])
+        self.assertEqual(out[-3:], ['3', '2', '1'])
+
+    def test_return_from_loop(self):
+        source = '''
+        func first(n int) int {
+            var i int = 0;
+            while i < n {
+                if i * i > 20 {
+                    return i;
+                }
+                i = i + 1;
+            }
+            return -1;
+        }
+        print first(100);
+        print first(3);
+        '''
+        self.assertEqual(self.execute(source), ['5', '-1'])
+
+    def test_globals_from_functions(self):
+        source = '''
+        var total int = 0;
+        func bump(n int) int {
+            total = total + n;
+            return total;
+        }
+        print bump(2);
+        print bump(3);
+        print total;
+        '''
+        self.assertEqual(self.execute(source), ['2', '5', '5'])
+
+    def test_loop_carried_swap(self):
+        source = '''
+        func fib(n int) int {
+            var a int = 0;
+            var b int = 1;
+            var t int;
+            while n > 0 {
+                t = a;
+                a = b;
+                b = t + b;
+                n = n - 1;
+            }
+            return a;
+        }
+        print fib(10);
+        '''
+        self.assertEqual(self.execute(source), ['55'])
+
+    def test_merge_without_else(self):
+        source = '''
+        var x int = 1;
+        var y int = 2;
+        if x < y {
+            x = y;
+            y = 1;
+        }
+        print x;
+        print y;
+        if x < y {
+            x = 7;
+        }
+        print x;
+        '''
+        self.assertEqual(self.execute(source), ['2', '1', '2'])
+
+    def test_short_circuit(self):
+        self.assertEqual(
+            self.execute(open('tests/control/shortcircuit.g').read()),
+            ['false', 'true', '3', 'true', '4', 'true', 'true', '7',
+             '0', '100', '2', '102', '4', '6', '7', '3'])
+
+
+class TestVirtualMachine(TestCompiledInterpreter):
+    execute = staticmethod(run_vm)
+
+    def test_recursion(self):
+        source = '''
+        func fact(n int) int {
+            if n < 2 {
+                return 1;
+            }
+            return n * fact(n - 1);
+        }
+        print fact(10);
+        print fact(5);
+        '''
+        self.assertEqual(self.execute(source), ['3628800', '120'])
+
+    def test_loaded_value_survives_store(self):
+        source = '''
+        var a int = 1;
+        var b int = 2;
+        a = b + a * 0 + (a - a);
+        print a;
+        var c int = a;
+        a = 10;
+        print c + a;
+        '''
+        self.assertEqual(self.execute(source), ['2', '12'])
+
+
+class TestPythonBackend(TestVirtualMachine):
+    execute = staticmethod(run_python)
+
+    def test_python_keywords_as_names(self):
+        source = '''
+        var pass int = 1;
+        func def(None int) int {
+            return None + pass;
+        }
+        print def(2);
+        '''
+        self.assertEqual(self.execute(source), ['3'])
+
+    def test_loop_with_multiple_uses(self):
+        source = '''
+        var i int = 0;
+        var s int = 0;
+        while i * i < 50 && i * i != 36 {
+            s = s + i * i;
+            i = i + 1;
+        }
+        print s;
+        '''
+        self.assertEqual(self.execute(source), ['55'])
+
+    def test_folded_global_read_before_call(self):
+        source = '''
+        var a int = 1;
+        func f() int {
+            a = 100;
+            return 0;
+        }
+        var b int = (a + 1) + f();
+        print b;
+        print (a + 1) + f() + -a;
+        '''
+        self.assertEqual(self.execute(source), ['2', '1'])
+
+
+class TestCompiledInterpreterSSA(TestCompiledInterpreter):
+    execute = staticmethod(lambda source: run_closure(source, ssa=True))
+
+
+class TestVirtualMachineSSA(TestVirtualMachine):
+    execute = staticmethod(lambda source: run_vm(source, ssa=True))
+
+
+class TestPythonBackendSSA(TestPythonBackend):
+    execute = staticmethod(lambda source: run_python(source, ssa=True))
+
+    def test_loop_carried_variables(self):
+        source = '''
+        func countdown(n int) int {
+            var steps int = 0;
+            while n > 0 {
+                n = n - 1;
+                steps = steps + 2;
+            }
+            return steps;
+        }
+        var i int = 0;
+        while i * i < 50 && i * i != 36 {
+            i = i + 1;
+        }
+        print countdown(5);
+        print i;
+        '''
+        self.assertEqual(self.execute(source), ['10', '6'])
+
+
+@unittest.skipUnless(shutil.which('gcc'), "gcc is not available")
+class TestCBackend(unittest.TestCase):
+    def test_programs(self):
+        self.assertEqual(
+            run_c(open('tests/codegen/test_int.g').read()),
+            ['6', '3', '-1', '12', '3', '1', '-1', '13'])
+        self.assertEqual(
+            run_c(open('tests/control/cond.g').read()),
+            ['3', '2', '3'])
+
+    def test_floats_and_bools(self):
+        self.assertEqual(
+            run_c('var x float = 7.0; print x / 2.0; print x > 1.0 && !(x == 7.0);'),
+            ['3.500000', 'false'])
+
+    def test_functions_and_externs(self):
+        source = '''
+        extern func hypot(x float, y float) float;
+        func fib(n int) int {
+            if n < 2 {
+                return n;
+            }
+            return fib(n - 1) + fib(n - 2);
+        }
+        print fib(20);
+        print hypot(3.0, 4.0);
+        '''
+        self.assertEqual(run_c(source), ['6765', '5.000000'])
+
+    def test_strings_are_reported(self):
+        code = generate('var s string = "hi"; print s;')
+        errors = []
+        with subscribe_errors(errors.append):
+            gonec.GenerateC().generate(code.functions)
+        self.assertEqual(errors, ['@main: the C backend does not support string values'])
+
+    def test_ssa(self):
+        self.assertEqual(
+            run_c(open('tests/control/fib.g').read(), ssa=True)[-3:],
+            ['433494437', '701408733', '1134903170'])
+        self.assertEqual(
+            run_c(open('tests/control/cond.g').read(), ssa=True),
+            ['3', '2', '3'])
+        self.assertEqual(
+            run_c(open('tests/control/shortcircuit.g').read(), ssa=True)[-2:],
+            ['7', '3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
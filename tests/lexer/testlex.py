@@ -1,7 +1,18 @@
 # testlex.py
 
+import os
+import glob
+import random
+import shutil
+import tempfile
 import unittest
 import gonelex
+import gonescan
+import goneparse
+import gonetables
+import gonetokens
+from goneast import flatten
+from errors import subscribe_errors
 
 # Make the lexer object
 lexer = gonelex.make_lexer()
@@ -17,11 +28,11 @@ class TestLexer(unittest.TestCase):
              'ASSIGN', 'COMMA', 'SEMI'])
 
     def test_keywords(self):
-        lexer.input('const var print func extern')
+        lexer.input('const var print func extern inline')
         toks = list(iter(lexer.token, None))
         self.assertEqual(
             [t.type for t in toks],
-            ['CONST', 'VAR', 'PRINT', 'FUNC', 'EXTERN'])
+            ['CONST', 'VAR', 'PRINT', 'FUNC', 'EXTERN', 'INLINE'])
 
     def test_identifiers(self):
         lexer.input('a z  A Z _a _z _A _Z a123 A123 a123z A123Z')
@@ -57,5 +68,175 @@ class TestLexer(unittest.TestCase):
             ['hello world'])
 
 
+def dump(program):
+    return [(depth, repr(node), node.lineno) for depth, node in flatten(program)]
+
+
+def token_types(lexer, source):
+    lexer.input(source)
+    return [(t.type, t.value) for t in iter(lexer.token, None)]
+
+
+class TestTables(unittest.TestCase):
+    source = 'func f(x int) int { return x * 2.5 + "a"; } // comment\nprint f(3) <= 4;'
+
+    def setUp(self):
+        self.saved = gonetables.directory
+        gonetables.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(gonetables.directory)
+        gonetables.directory = self.saved
+
+    def table(self, name):
+        return os.path.join(gonetables.directory, name)
+
+    def test_lexer(self):
+        lexer = gonetables.make_lexer(gonelex)
+        self.assertFalse(lexer.lexoptimize)
+        self.assertTrue(os.path.exists(self.table('gonelextab.py')))
+        expected = token_types(lexer, self.source)
+
+        # Built once, then loaded from the table
+        lexer = gonetables.make_lexer(gonelex)
+        self.assertTrue(lexer.lexoptimize)
+        self.assertEqual(token_types(lexer, self.source), expected)
+
+    def test_stale_lexer(self):
+        gonetables.make_lexer(gonelex)
+        with open(self.table('gonelextab.py'), 'a') as f:
+            f.write("_signature = 'changed rules'\n")
+        lexer = gonetables.make_lexer(gonelex)
+        self.assertFalse(lexer.lexoptimize)
+        # The table was rebuilt
+        self.assertTrue(gonetables.make_lexer(gonelex).lexoptimize)
+
+    def test_lexer_signature(self):
+        signature = gonetables.lexer_signature(gonelex)
+        self.assertEqual(gonetables.lexer_signature(gonelex), signature)
+        saved = gonelex.t_ASSIGN
+        try:
+            gonelex.t_ASSIGN = r':='
+            self.assertNotEqual(gonetables.lexer_signature(gonelex), signature)
+        finally:
+            gonelex.t_ASSIGN = saved
+
+    def test_parser(self):
+        program = 'var x int = 2;\nprint x * 3 + 1;\n'
+        parser = gonetables.make_parser(goneparse)
+        self.assertTrue(os.path.exists(self.table('goneparsetab.pickle')))
+        self.assertFalse(os.path.exists(self.table('parser.out')))
+        expected = dump(parser.parse(program, lexer=gonetables.make_lexer(gonelex)))
+        modified = os.path.getmtime(self.table('goneparsetab.pickle'))
+        parser = gonetables.make_parser(goneparse)
+        self.assertEqual(os.path.getmtime(self.table('goneparsetab.pickle')), modified)
+        self.assertEqual(dump(parser.parse(program, lexer=gonetables.make_lexer(gonelex))),
+                         expected)
+
+
+def scan(lexer, source):
+    # Tokens and errors, in the order they are produced
+    result = []
+    with subscribe_errors(lambda msg: result.append(('error', msg))):
+        lexer.lineno = 1
+        lexer.input(source)
+        for tok in iter(lexer.token, None):
+            result.append((tok.type, repr(tok.value), tok.lineno, tok.lexpos))
+    return result
+
+
+class TestScanner(unittest.TestCase):
+    def setUp(self):
+        self.lexer = gonelex.make_lexer()
+        self.scanner = gonescan.Scanner()
+
+    def assertSameTokens(self, source):
+        self.assertEqual(scan(self.scanner, source), scan(self.lexer, source), repr(source))
+
+    def test_programs(self):
+        for path in glob.glob('tests/*/*.g'):
+            self.assertSameTokens(open(path).read())
+
+    def test_quirks(self):
+        for source in ['trueish falsey true_ iftrue', '1.5e1 1.5e2 2e+1 3E-1 1e 1.e .5 12.',
+                       'x // no newline', '// a\n/* b\n*/ c /* unterminated\n',
+                       '"a\\\\b\\nc" "open\n"', 'a & b | c && d || e', '<= >= == != < > ! =',
+                       'x$y @ \u00e9', '"two" "strings"', '\r\n\t  \n\n x']:
+            self.assertSameTokens(source)
+
+    def test_random(self):
+        pieces = ['a', 'e', 'E', '1', '0', '.', '+', '-', '*', '/', '"', '\n', ' ', '=', '<',
+                  '!', '&', '|', '{', '(', ';', 'true', 'false', 'if', 'while', '_', '\\n',
+                  '/*', '*/', '//', '#', 'e+1', '1.5']
+        rng = random.Random(2014)
+        for n in range(2000):
+            source = ''.join(rng.choice(pieces) for i in range(rng.randint(0, 40)))
+            try:
+                expected = scan(self.lexer, source)
+            except ValueError:
+                # gonelex fails to convert floats such as '.' or 'e1', and so does gonescan
+                self.assertRaises(ValueError, scan, self.scanner, source)
+                continue
+            self.assertEqual(scan(self.scanner, source), expected, repr(source))
+
+    def test_input_file(self):
+        path = 'tests/functions/mandel.g'
+        self.scanner.input_file(path)
+        tokens = [(t.type, t.value, t.lineno, t.lexpos) for t in self.scanner]
+        self.lexer.lineno = 1
+        self.lexer.input(open(path).read())
+        self.assertEqual(tokens, [(t.type, t.value, t.lineno, t.lexpos) for t in self.lexer])
+
+    def test_parse(self):
+        source = open('tests/functions/mandel.g').read()
+        parser = goneparse.make_parser()
+        expected = dump(parser.parse(source, lexer=gonelex.make_lexer()))
+        lexer = gonescan.make_lexer()
+        self.assertEqual(dump(parser.parse(source, lexer=lexer)), expected)
+        # Like lex(), make_lexer() sets the lexer used by default
+        lexer.lineno = 1
+        self.assertEqual(dump(parser.parse(source)), expected)
+
+
+class TestTokenStream(unittest.TestCase):
+    def assertSameTokens(self, source):
+        # The stream reports the errors of the whole source before any token
+        expected = scan(gonescan.Scanner(), source)
+        result = scan(gonetokens.StreamLexer(), source)
+        errors = [t for t in expected if t[0] == 'error']
+        self.assertEqual(result, errors + [t for t in expected if t[0] != 'error'], repr(source))
+
+    def test_tokens(self):
+        for path in glob.glob('tests/*/*.g'):
+            self.assertSameTokens(open(path).read())
+        for source in ['trueish 1.5e1 12. x // no newline', '"a\\\\b\\nc" "open\n" x$y',
+                       '/* unterminated\n', 'a && b || !c <= >= == != < >']:
+            self.assertSameTokens(source)
+
+    def test_columns(self):
+        stream = gonetokens.tokenize('var x int = 42;\nprint "hi";')
+        self.assertEqual([stream.type(n) for n in range(len(stream))],
+                         ['VAR', 'ID', 'ID', 'ASSIGN', 'INTEGER', 'SEMI', 'PRINT', 'STRING', 'SEMI'])
+        self.assertEqual(list(stream.lines), [1, 1, 1, 1, 1, 1, 2, 2, 2])
+        self.assertEqual(stream.source(4), '42')
+        self.assertEqual(stream.value(4), 42)
+        self.assertEqual(stream.value(7), 'hi')
+        self.assertEqual(stream.lineno, 2)
+        self.assertEqual(stream.nbytes(), 9 * 13)
+
+    def test_parse(self):
+        path = 'tests/functions/mandel.g'
+        parser = goneparse.make_parser()
+        expected = dump(parser.parse(open(path).read(), lexer=gonelex.make_lexer()))
+        lexer = gonetokens.StreamLexer(gonetokens.tokenize_file(path))
+        self.assertEqual(dump(parser.parse(lexer=lexer)), expected)
+
+    def test_memory(self):
+        count, sizes = gonetokens.token_memory(open('tests/functions/mandel.g').read())
+        self.assertGreater(count, 0)
+        self.assertLess(sizes['TokenStream'], sizes['Token'] / 4)
+        self.assertLess(sizes['TokenStream'], sizes['LexToken'] / 4)
+
+
 if __name__ == '__main__':
     unittest.main()
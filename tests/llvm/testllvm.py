@@ -0,0 +1,71 @@
+# testllvm.py
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+try:
+    import llvm.core
+except ImportError:
+    llvm = None
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(os.path.dirname(here))
+
+programs = [
+    os.path.join(root, 'tests', 'control', 'fact.g'),
+    os.path.join(root, 'tests', 'functions', 'func.g'),
+    os.path.join(root, 'tests', 'llvm', 'test_float.g'),
+    os.path.join(root, 'tests', 'control', 'shortcircuit.g'),
+]
+
+
+@unittest.skipUnless(llvm and shutil.which('gcc'), "llvmpy or gcc is not available")
+class TestLLVM(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # goner.py loads the runtime from ./gonert.so
+        cls.directory = tempfile.mkdtemp()
+        subprocess.check_call(['gcc', '-shared', '-fPIC', os.path.join(root, 'gonert.c'),
+                               '-o', os.path.join(cls.directory, 'gonert.so')])
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def goner(self, *args):
+        return subprocess.check_output(
+            [sys.executable, os.path.join(root, 'goner.py')] + list(args),
+            cwd=self.directory).decode('utf-8').split()
+
+    def test_levels_agree(self):
+        for program in programs:
+            outputs = [self.goner('-O{}'.format(level), program) for level in range(4)]
+            self.assertTrue(outputs[0], program)
+            for level, output in enumerate(outputs):
+                self.assertEqual(output, outputs[0], "{} at -O{}".format(program, level))
+
+    def test_fact(self):
+        self.assertEqual(
+            self.goner('-O2', programs[0]),
+            ['1', '2', '6', '24', '120', '720', '5040', '40320', '362880'])
+
+    def test_emit_exe(self):
+        exe = os.path.join(self.directory, 'fact')
+        self.goner('-O2', '--emit-exe', exe, programs[0])
+        self.assertEqual(
+            subprocess.check_output([exe]).decode('utf-8').split(),
+            ['1', '2', '6', '24', '120', '720', '5040', '40320', '362880'])
+
+    def test_emit_asm(self):
+        asm = os.path.join(self.directory, 'func.s')
+        self.goner('--emit-asm', asm, programs[1])
+        with open(asm) as f:
+            self.assertIn('__gone_start', f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,750 @@
+# testopt.py
+
+import io
+import os
+import sys
+import json
+import tempfile
+import unittest
+import subprocess
+from array import array
+from contextlib import redirect_stdout
+
+import gonelex
+import goneparse
+import gonecheck
+import gonecode
+import goneinterp
+import gonessa
+import gonefold
+import gonegvn
+import gonedce
+import goneloop
+import goneinline
+import gonepeep
+import gonetail
+import goneflow
+import gonepass
+import goneir
+import gonebin
+from goneblock import ConditionalBlock, WhileBlock, walk_blocks
+from errors import subscribe_errors, errors_reported, clear_errors
+
+lexer = gonelex.make_lexer()
+parser = goneparse.make_parser()
+
+# Programs of the test suite run before and after every pass
+programs = [
+    'tests/codegen/test_int.g', 'tests/codegen/test_float.g', 'tests/codegen/test_func.g',
+    'tests/control/cond.g', 'tests/control/fact.g', 'tests/control/fib.g',
+    'tests/control/mytest.g', 'tests/control/nested.g', 'tests/control/nestedcond.g',
+    'tests/control/shortcircuit.g',
+    'tests/functions/basic.g', 'tests/functions/func.g',
+    'tests/functions/mine.g', 'tests/functions/simple.g',
+    'tests/relations/testrel.g', 'tests/relations/testrel_float.g',
+]
+
+def generate(source):
+    clear_errors()
+    errors = []
+    with subscribe_errors(errors.append):
+        program = parser.parse(source, lexer=lexer)
+        gonecheck.check_program(program)
+    assert not errors_reported(), errors
+    return gonecode.generate_code(program)
+
+
+def run(code):
+    out = io.StringIO()
+    with redirect_stdout(out):
+        interpreter = goneinterp.CompiledInterpreter()
+        interpreter.compile(code.functions)
+        interpreter.run()
+    return out.getvalue().split()
+
+
+def instructions(code):
+    return [inst for name, start_block, ret_type, arg_types in code.functions
+            for inst in instructions_of(start_block)]
+
+
+def instructions_of(block):
+    return [inst for block in walk_blocks(block) for inst in block.instructions]
+
+
+class PassTests(object):
+    '''
+    Runs the programs of the test suite with and without the pass, both
+    on memory form and on SSA form.
+    '''
+    def optimize(self, code):
+        raise NotImplementedError
+
+    def test_programs(self):
+        for path in programs:
+            source = open(path).read()
+            expected = run(generate(source))
+            self.assertEqual(run(self.optimize(generate(source))), expected, path)
+            code = gonessa.construct_ssa(generate(source))
+            self.assertEqual(run(self.optimize(code)), expected, path)
+
+
+class TestFold(PassTests, unittest.TestCase):
+    def optimize(self, code):
+        return gonefold.fold_constants(code)
+
+    def test_constants_are_propagated(self):
+        code = self.optimize(generate('''
+        const a = 6;
+        const b = a * 7;
+        func f() int {
+            return b + 1;
+        }
+        print f();
+        '''))
+        insts = instructions(code)
+        self.assertIn(('const_int', 'b', 42), insts)
+        self.assertFalse([inst for inst in insts if inst[0] in ('load_int', 'store_int', 'mul_int')])
+        self.assertEqual(run(code), ['43'])
+
+    def test_run_time_errors_are_not_folded(self):
+        code = self.optimize(generate('var x int = 1 / 0; print 2147483647 + 1;'))
+        ops = [inst[0] for inst in instructions(code)]
+        self.assertIn('div_int', ops)
+        self.assertIn('add_int', ops)
+
+    def test_comparisons(self):
+        code = self.optimize(generate('print 7 / -2; print 2.5 < 3.0; print !(1 == 1);'))
+        self.assertEqual([inst[0] for inst in instructions(code)].count('literal_bool'), 3)
+        self.assertEqual(run(code), ['-3', 'true', 'false'])
+
+
+class TestGVN(PassTests, unittest.TestCase):
+    def optimize(self, code):
+        gonegvn.number_values(code)
+        return code
+
+    def test_common_subexpressions(self):
+        code = self.optimize(generate('''
+        func f(x float, y float) float {
+            var a float = x * y + y * x;
+            a = a - (x * y + y * x);
+            return a + x;
+        }
+        print f(2.0, 3.0);
+        '''))
+        ops = [inst[0] for inst in instructions(code)]
+        self.assertEqual(ops.count('mul_float'), 1)
+        self.assertEqual(ops.count('add_float'), 2)
+        self.assertEqual(ops.count('load_float'), 2)
+        self.assertEqual(run(code), ['2.0'])
+
+    def test_loads_are_killed(self):
+        code = self.optimize(generate('''
+        var x int = 1;
+        func g() int {
+            x = x + 1;
+            return 0;
+        }
+        print x + g() + x;
+        '''))
+        self.assertEqual([inst[0] for inst in instructions(code)].count('load_int'), 2)
+        self.assertEqual(run(code), ['3'])
+
+    def test_ssa_branches(self):
+        code = gonessa.construct_ssa(generate('''
+        var x int = 3;
+        var y int = 4;
+        var z int = x * y;
+        if x < y {
+            z = y * x;
+        } else {
+            z = x * y - 1;
+        }
+        print z;
+        '''))
+        code = self.optimize(code)
+        self.assertEqual([inst[0] for inst in instructions(code)].count('mul_int'), 1)
+        self.assertEqual(run(code), ['12'])
+
+
+class TestDCE(PassTests, unittest.TestCase):
+    def optimize(self, code):
+        gonedce.eliminate_dead_code(code)
+        return code
+
+    def blocks(self, code):
+        return [block for name, start_block, ret_type, arg_types in code.functions
+                for block in walk_blocks(start_block)]
+
+    def test_code_after_return(self):
+        code = self.optimize(generate('''
+        func f(x int) int {
+            return x + 1;
+            print x;
+            while x > 0 {
+                x = x - 1;
+            }
+        }
+        print f(1);
+        '''))
+        ops = [inst[0] for inst in instructions(code)]
+        self.assertEqual(ops.count('print_int'), 1)
+        self.assertNotIn('sub_int', ops)
+        self.assertEqual(run(code), ['2'])
+
+    def test_constant_conditions(self):
+        code = gonessa.construct_ssa(generate('''
+        const debug = false;
+        var x int = 1;
+        if debug {
+            x = 2;
+        } else {
+            x = 3;
+        }
+        while debug {
+            print 0;
+        }
+        print x;
+        '''))
+        gonefold.fold_constants(code)
+        code = self.optimize(code)
+        self.assertEqual(len(self.blocks(code)), 1)
+        self.assertEqual(run(code), ['3'])
+
+    def test_empty_blocks(self):
+        code = self.optimize(generate('''
+        var x int = 0;
+        if x < 1 {
+            x = 1;
+        }
+        if x < 2 {
+            x = 2;
+        }
+        print x;
+        '''))
+        # The declaration, two tests, their true branches and the print
+        self.assertEqual(len(self.blocks(code)), 6)
+        self.assertEqual(run(code), ['2'])
+
+    def test_unused_temporaries(self):
+        code = self.optimize(gonessa.construct_ssa(generate('''
+        var x int = 2;
+        var y int = x * 3;
+        print x;
+        ''')))
+        self.assertNotIn('mul_int', [inst[0] for inst in instructions(code)])
+
+    def test_dead_stores(self):
+        code = self.optimize(generate('''
+        func f(n int) int {
+            var x int = 1;
+            var s int = 0;
+            x = n * 2;
+            while n > 0 {
+                s = s + x;
+                n = n - 1;
+            }
+            n = 7;
+            return s;
+        }
+        print f(3);
+        '''))
+        stores = [inst[2] for inst in instructions(code) if inst[0] == 'store_int']
+        # x = 1 and n = 7 are never read, the stores in the loop are
+        self.assertEqual(stores, ['s', 'x', 's', 'n'])
+        self.assertEqual(run(code), ['18'])
+
+
+class TestFlow(unittest.TestCase):
+    source = '''
+    func f(n int) int {
+        var s int = 0;
+        var i int = 0;
+        while i < n {
+            if i > 2 {
+                s = s + i;
+            }
+            i = i + 1;
+        }
+        return s;
+    }
+    '''
+
+    def graph(self):
+        code = generate(self.source)
+        return goneflow.FlowGraph(code.functions[1][1])
+
+    def test_graph(self):
+        graph = self.graph()
+        entry, loop = graph.order[:2]
+        self.assertIsInstance(loop, WhileBlock)
+        self.assertEqual(graph.preds[loop][0], entry)
+        self.assertEqual(len(graph.preds[loop]), 2)
+        cond = [block for block in graph.order if isinstance(block, ConditionalBlock)][0]
+        self.assertIs(graph.idom[cond], loop.loop_branch)
+        self.assertTrue(graph.dominates(loop, cond))
+        self.assertFalse(graph.dominates(cond, loop))
+        self.assertEqual(graph.frontier[cond.true_branch], {cond.next_block})
+
+    def test_live_variables(self):
+        graph = self.graph()
+        liveness = goneflow.LiveVariables(graph)
+        loop = graph.order[1]
+        self.assertEqual(liveness.live_at_start(loop), {'i', 'n', 's'})
+        self.assertEqual(liveness.live_at_end(graph.order[0]), {'i', 'n', 's'})
+        self.assertEqual(liveness.live_at_start(loop.next_block), {'s'})
+
+    def test_liveness_of_temporaries(self):
+        code = gonessa.construct_ssa(generate(self.source))
+        graph = goneflow.FlowGraph(code.functions[1][1])
+        liveness = goneflow.Liveness(graph)
+        loop = graph.order[1]
+        # The phis of the loop read the values at the end of the body
+        latch = graph.preds[loop][1]
+        for phi in gonessa.phis(loop):
+            self.assertIn(phi[2], liveness.live_at_end(latch))
+            self.assertNotIn(phi[3], liveness.live_at_start(loop))
+            self.assertIn(phi[1], liveness.live_at_end(graph.order[0]))
+
+    def test_reaching_definitions(self):
+        graph = self.graph()
+        reaching = goneflow.ReachingDefinitions(graph)
+        loop = graph.order[1]
+        definitions = reaching.reaching(loop, 's')
+        # s = 0 before the loop and s = s + i in the body
+        cond = [block for block in graph.order if isinstance(block, ConditionalBlock)][0]
+        self.assertEqual({block for block, n in definitions}, {graph.order[0], cond.true_branch})
+        # The parameter n, s and i before the loop, s and i in the body
+        self.assertEqual(len(reaching.reaching(loop, 'n')), 1)
+        self.assertEqual(len(reaching.reaching(loop)), 5)
+        self.assertEqual(len(reaching.reaching(cond.true_branch, 's')), 2)
+
+
+class TestLoop(PassTests, unittest.TestCase):
+    def optimize(self, code):
+        goneloop.optimize_loops(code, unroll=True)
+        return code
+
+    def loop_instructions(self, code):
+        return [inst for name, start_block, ret_type, arg_types in code.functions
+                for block in walk_blocks(start_block) if isinstance(block, WhileBlock)
+                for inst in instructions_of(block)]
+
+    def test_invariants_are_hoisted(self):
+        code = self.optimize(generate('''
+        func f(n int) int {
+            var i int = 0;
+            var s int = 0;
+            while i < n * 2 {
+                s = s + n * n + i / 3;
+                i = i + 1;
+            }
+            return s;
+        }
+        print f(5);
+        '''))
+        ops = [inst[0] for inst in self.loop_instructions(code)]
+        self.assertEqual(ops.count('mul_int'), 0)
+        self.assertIn('div_int', ops)
+        self.assertEqual(run(code), ['262'])
+
+    def test_division_by_variable_stays(self):
+        code = self.optimize(generate('''
+        var n int = 0;
+        var i int = 0;
+        while i > 0 {
+            print 1 / n;
+        }
+        print i;
+        '''))
+        self.assertIn('div_int', [inst[0] for inst in self.loop_instructions(code)])
+        self.assertEqual(run(code), ['0'])
+
+    def test_strength_reduction(self):
+        code = self.optimize(gonessa.construct_ssa(generate('''
+        var n int = 20;
+        var i int = 0;
+        while i < n {
+            print i * 7;
+            i = i + 2;
+        }
+        ''')))
+        ops = [inst[0] for inst in self.loop_instructions(code)]
+        self.assertNotIn('mul_int', ops)
+        self.assertEqual(run(code), [str(i * 7) for i in range(0, 20, 2)])
+
+    def test_unrolling(self):
+        code = self.optimize(gonessa.construct_ssa(generate('''
+        var i int = 0;
+        var s int = 0;
+        while i < 4 {
+            s = s + i;
+            i = i + 1;
+        }
+        print s;
+        print i;
+        ''')))
+        self.assertEqual(self.loop_instructions(code), [])
+        self.assertEqual(run(code), ['6', '4'])
+
+
+class TestInline(PassTests, unittest.TestCase):
+    def optimize(self, code):
+        goneinline.inline_functions(code)
+        return code
+
+    def calls(self, code):
+        return [inst[1] for inst in instructions(code) if inst[0] == 'call_func']
+
+    def test_small_functions(self):
+        code = self.optimize(generate('''
+        func square(x int) int {
+            var y int;
+            y = y + x * x;
+            return y;
+        }
+        func f(n int) int {
+            var s int = 0;
+            while n > 0 {
+                s = s + square(n);
+                n = n - 1;
+            }
+            return s;
+        }
+        print f(3);
+        if square(2) > 3 {
+            print square(3);
+        }
+        '''))
+        # square is inlined everywhere, f has a loop and stays a function
+        self.assertEqual(self.calls(code), ['f'])
+        self.assertEqual(run(code), ['14', '9'])
+
+    def test_early_returns(self):
+        code = self.optimize(generate('''
+        inline func find(n int, limit int) int {
+            var i int = 0;
+            while i < n {
+                if i * i > limit {
+                    return i;
+                }
+                i = i + 1;
+            }
+            if n > 100 {
+                return -1;
+            }
+            print n;
+            return 0;
+        }
+        func main() int {
+            print find(10, 20);
+            print find(3, 20);
+            print find(200, 100000);
+            return 0;
+        }
+        '''))
+        self.assertEqual(self.calls(code), ['main'])
+        self.assertEqual(run(code), ['5', '3', '0', '-1'])
+
+    def test_returns_in_loops_need_hint(self):
+        code = self.optimize(generate('''
+        func first(n int) int {
+            while n > 0 {
+                return n;
+            }
+            return 0;
+        }
+        func main() int {
+            return first(4);
+        }
+        print main();
+        '''))
+        self.assertIn('first', self.calls(code))
+        self.assertEqual(run(code), ['4'])
+
+    def test_recursion(self):
+        code = self.optimize(generate('''
+        func fact(n int) int {
+            if n < 2 {
+                return 1;
+            }
+            return n * fact(n - 1);
+        }
+        print fact(5);
+        '''))
+        self.assertEqual(self.calls(code), ['fact', 'fact'])
+        self.assertEqual(run(code), ['120'])
+
+
+class TestPeephole(PassTests, unittest.TestCase):
+    def optimize(self, code):
+        self.hits = gonepeep.optimize_peephole(code)
+        return code
+
+    def ops(self, code):
+        return [inst[0] for inst in instructions(code)]
+
+    def test_strength_reduction(self):
+        code = self.optimize(generate('''
+        var x float = 3.0;
+        var n int = 5;
+        print x * 2.0;
+        print 2 * n;
+        print x / 4.0;
+        print x / 3.0;
+        print n * 1 + 0;
+        '''))
+        ops = self.ops(code)
+        self.assertEqual(ops.count('mul_float'), 1)
+        self.assertEqual(ops.count('div_float'), 1)
+        self.assertNotIn('mul_int', ops)
+        self.assertEqual(self.hits['multiply_by_two'], 2)
+        self.assertEqual(self.hits['divide_by_power_of_two'], 1)
+        self.assertEqual(run(code), ['6.0', '10', '0.75', '1.0', '5'])
+
+    def test_negations(self):
+        code = self.optimize(generate('''
+        var a int = 2;
+        var b float = 1.5;
+        print !(a < 3);
+        print !!(a == 2);
+        print -(-a);
+        print +b;
+        print !(b < 1.0);
+        '''))
+        # The negations made useless are left for gonedce
+        gonedce.eliminate_dead_code(code)
+        ops = self.ops(code)
+        self.assertIn('gte_int', ops)
+        self.assertEqual(ops.count('not_bool'), 1)
+        self.assertNotIn('usub_int', ops)
+        self.assertNotIn('uadd_float', ops)
+        self.assertEqual(run(code), ['false', 'true', '2', '1.5', 'true'])
+
+    def test_load_after_store(self):
+        code = self.optimize(generate('''
+        var x int = 1;
+        func f() int {
+            x = x + 1;
+            return x;
+        }
+        x = 5;
+        print x;
+        print f() + x;
+        '''))
+        self.assertEqual(self.hits['load_after_store'], 2)
+        self.assertEqual(run(code), ['5', '12'])
+
+    def test_rule_table(self):
+        def no_prints(peep, inst):
+            if inst[0].startswith('print_'):
+                return []
+        code = generate('print 1; var x int = 2 * 3;')
+        hits = gonepeep.optimize_peephole(code, gonepeep.rules + [no_prints])
+        self.assertEqual(hits['no_prints'], 1)
+        self.assertEqual(run(code), [])
+
+
+class TestTail(PassTests, unittest.TestCase):
+    def optimize(self, code):
+        self.eliminated = gonetail.eliminate_tail_calls(code)
+        return code
+
+    def calls(self, code):
+        return [inst[1] for inst in instructions(code) if inst[0] == 'call_func']
+
+    def test_self_tail_calls(self):
+        # Far deeper than the Python stack of the interpreter allows
+        code = self.optimize(generate(open('tests/functions/tailcall.g').read()))
+        self.assertEqual(self.eliminated, 3)
+        self.assertEqual(self.calls(code), ['gcd', 'sum', 'count', 'even', 'even'])
+        self.assertEqual(run(code), ['21', '1800030000', '100002', 'true'])
+
+    def test_ssa(self):
+        code = gonessa.construct_ssa(generate(open('tests/functions/tailcall.g').read()))
+        self.assertEqual(run(self.optimize(code)), ['21', '1800030000', '100002', 'true'])
+
+    def test_other_calls_stay(self):
+        code = self.optimize(generate('''
+        func twice(n int) int {
+            return 2 * n;
+        }
+        func double(n int) int {
+            return twice(n);
+        }
+        func fact(n int) int {
+            if n < 2 {
+                return 1;
+            }
+            return n * fact(n - 1);
+        }
+        print double(10);
+        print fact(5);
+        '''))
+        self.assertEqual(self.eliminated, 0)
+        self.assertEqual(run(code), ['20', '120'])
+
+
+class TestPassManager(unittest.TestCase):
+    def test_pipeline(self):
+        self.assertEqual(gonepass.pipeline(0), [])
+        self.assertEqual(gonepass.pipeline(0, ssa=True, tail=True), ['tail', 'ssa'])
+        names = gonepass.pipeline(2, ssa=True)
+        self.assertEqual(names[:3], ['tail', 'inline', 'ssa'])
+        self.assertEqual(names.count('tail'), 1)
+        for level in range(len(gonepass.levels)):
+            self.assertTrue(all(name in gonepass.passes for name in gonepass.pipeline(level)))
+
+    def test_levels(self):
+        for path in programs:
+            source = open(path).read()
+            expected = run(generate(source))
+            for level in range(len(gonepass.levels)):
+                for ssa in (False, True):
+                    code = generate(source)
+                    gonepass.optimize(code, level, ssa)
+                    self.assertEqual(run(code), expected, "{} at -O{}".format(path, level))
+
+    def test_report(self):
+        code = generate(open('tests/functions/func.g').read())
+        manager = gonepass.optimize(code, 2, ssa=True)
+        report = manager.report
+        self.assertEqual([record['pass'] for record in report], gonepass.pipeline(2, ssa=True))
+        for record, following in zip(report, report[1:]):
+            self.assertEqual(record['after'], following['before'])
+        self.assertEqual(report[-1]['after'], gonepass.statistics(code))
+        self.assertLess(report[-1]['after']['instructions'], report[0]['before']['instructions'])
+        self.assertEqual(json.loads(manager.format_json()), report)
+        lines = manager.format_text().splitlines()
+        self.assertEqual(len(lines), len(report) + 2)
+        self.assertTrue(lines[1].startswith('tail'))
+
+    def test_unknown_pass(self):
+        with self.assertRaises(ValueError):
+            gonepass.PassManager(['fold', 'nothing'])
+
+
+def shape(code):
+    result = []
+    for name, start_block, ret_type, arg_types in code.functions:
+        blocks = list(walk_blocks(start_block))
+        index = {block: n for n, block in enumerate(blocks)}
+        for block in blocks:
+            links = [index.get(getattr(block, link, None))
+                     for link in ('next_block', 'true_branch', 'false_branch', 'loop_branch')]
+            result.append((name, type(block).__name__, getattr(block, 'testvar', None),
+                           links, [tuple(map(repr, inst)) for inst in block.instructions]))
+    return result
+
+
+class TestIR(unittest.TestCase):
+    def test_round_trip(self):
+        for path in programs + ['tests/functions/mandel.g']:
+            source = open(path).read()
+            for level, ssa in ((0, False), (3, True)):
+                code = generate(source)
+                gonepass.optimize(code, level, ssa)
+                decoded = goneir.decode(goneir.encode(code))
+                self.assertEqual(shape(decoded), shape(code), path)
+                self.assertEqual(decoded.versions, code.versions)
+                if path != 'tests/functions/mandel.g':
+                    self.assertEqual(run(decoded), run(code), path)
+
+    def test_encoding(self):
+        code = generate("var x int = 3;\nprint x + 1;\nprint true;\nprint 1;\n")
+        program = goneir.encode(code)
+        function, = program.functions
+        self.assertEqual(function.registers, ['__int_0', '__int_1', '__int_2', '__int_3',
+                                              '__bool_0', '__int_4'])
+        self.assertEqual(program.constants, ['x', 3, 1, True, None])
+        block = function.blocks[0]
+        opcode, operands = block.instruction(3)
+        self.assertEqual(goneir.opcode_names[opcode], 'load_int')
+        self.assertEqual(goneir.bases[opcode], 'load')
+        self.assertEqual(goneir.typenames[opcode], 'int')
+        self.assertEqual(list(operands), [-1, 1])
+        self.assertEqual(opcode, goneir.intern_opcode('load_int'))
+        self.assertEqual(list(function.kinds), [goneir.BASIC])
+        self.assertEqual(function.successor(0, goneir.NEXT), goneir.NO_BLOCK)
+
+    def test_smaller(self):
+        code = generate(open('tests/functions/mandel.g').read())
+        self.assertLess(goneir.encode(code).nbytes() * 4, goneir.tuple_nbytes(code))
+
+
+class TestBinary(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def test_round_trip(self):
+        path = os.path.join(self.directory, 'code.gir')
+        for source_path in programs:
+            code = generate(open(source_path).read())
+            gonepass.optimize(code, 2, ssa=True)
+            gonebin.save_code(code, path)
+            self.assertTrue(gonebin.is_code_file(path))
+            loaded = gonebin.load_code(path)
+            self.assertEqual(shape(loaded), shape(code), source_path)
+            self.assertEqual(loaded.inline_hints, code.inline_hints)
+            self.assertEqual(run(loaded), run(code), source_path)
+
+    def test_constants(self):
+        program = goneir.Program()
+        values = ['x', '', 'caf\u00e9', 0, -1, 2 ** 40, 0.0, -0.0, 1.5, True, False, None]
+        for value in values:
+            program.constant(value)
+        loaded = gonebin.loads(gonebin.dumps(program))
+        self.assertEqual([(type(v), repr(v)) for v in loaded.constants],
+                         [(type(v), repr(v)) for v in values])
+
+    def test_bad_files(self):
+        data = gonebin.dumps(goneir.encode(generate("print 1;\n")))
+        with self.assertRaises(gonebin.FormatError):
+            gonebin.loads(b'NOTGON' + data[6:])
+        with self.assertRaises(gonebin.FormatError):
+            gonebin.loads(data[:6] + b'\xff\x00' + data[8:])
+        with self.assertRaises(gonebin.FormatError):
+            gonebin.loads(data[:-3])
+        path = os.path.join(self.directory, 'empty.gir')
+        open(path, 'wb').close()
+        self.assertFalse(gonebin.is_code_file(path))
+        with self.assertRaises(gonebin.FormatError):
+            gonebin.load(path)
+
+    def test_renumbered_opcodes(self):
+        # A file from a build numbering opcodes differently still loads
+        code = generate(open('tests/control/fact.g').read())
+        program = goneir.encode(code)
+        saved = list(goneir.opcode_names)
+        try:
+            goneir.opcode_names.reverse()
+            for function in program.functions:
+                for block in function.blocks:
+                    block.opcodes = array('H', [len(saved) - 1 - opcode
+                                                for opcode in block.opcodes])
+            data = gonebin.dumps(program)
+        finally:
+            goneir.opcode_names[:] = saved
+        self.assertEqual(shape(goneir.decode(gonebin.loads(data))), shape(code))
+
+    def test_run_without_front_end(self):
+        path = os.path.join(self.directory, 'fact.gir')
+        subprocess.check_call([sys.executable, 'gonebin.py', '-O2', 'tests/control/fact.g',
+                               '-o', path])
+        script = ("import sys, runpy; sys.argv = ['goneinterp.py', {!r}]; "
+                  "runpy.run_path('goneinterp.py', run_name='__main__'); "
+                  "print('ply' in sys.modules)").format(path)
+        output = subprocess.check_output([sys.executable, '-c', script]).decode().split()
+        expected = run(generate(open('tests/control/fact.g').read()))
+        self.assertEqual(output[:len(expected)], expected)
+        self.assertEqual(output[-1], 'False')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# testparse.py
+
+import sys
+import glob
+import unittest
+import subprocess
+
+import gonescan
+import goneparse
+import gonepratt
+import goneparallel
+from goneast import flatten
+from errors import subscribe_errors
+
+lalr = goneparse.make_parser()
+pratt = gonepratt.make_parser()
+
+
+def parse(parser, source):
+    # The tree, with the line of every node, and the errors reported
+    errors = []
+    with subscribe_errors(errors.append):
+        program = parser.parse(source, lexer=gonescan.Scanner())
+    if program is None:
+        return None, errors
+    return [(depth, repr(node), node.lineno) for depth, node in flatten(program)], errors
+
+
+class TestPrattParser(unittest.TestCase):
+    def assertSameParse(self, source):
+        self.assertEqual(parse(pratt, source), parse(lalr, source), repr(source))
+
+    def test_corpus(self):
+        paths = glob.glob('tests/*/*.g')
+        self.assertIn('tests/parser/parsetest6.g', paths)
+        for path in paths:
+            self.assertSameParse(open(path).read())
+
+    def test_precedence(self):
+        for expr in ['a + b * c - d / e', 'a - b - c', 'a / b / c', '-a * b', '- - a + b',
+                     '!a && b || c && !d', 'a < b == c != d', 'a + b < c * d && e >= f',
+                     '(a + b) * c', '-(a) * f(b, -c)', 'a * -b + c', '+a - +b']:
+            self.assertSameParse('print %s;' % expr)
+            tree, errors = parse(pratt, 'print %s;' % expr)
+            self.assertEqual(errors, [])
+
+    def test_statements(self):
+        self.assertSameParse('')
+        self.assertSameParse('/* nothing */')
+        self.assertSameParse('''
+            extern func putchar(c int) int;
+            const n = 10;
+            var x int;
+            var y float = 2.5;
+            inline func f(, a int, b int) int { return a + b; }
+            func g() bool { }
+            func main() int {
+                putchar(65);
+                h(, x);
+                while x < n {
+                    if x == 3 { print "three"; } else { x = x + 1; }
+                    if true { }
+                }
+                return 0;
+            }
+        ''')
+
+    def test_errors(self):
+        # Errors and the recovery from them are those of goneparse
+        for source in ['print 1 +;', 'var x int = 3\nprint x;', 'func f( { }', 'print (1;',
+                       'x = 1;\nprint x +;\nvar y int = 2;\n}\nprint y;', 'if x { print 1;',
+                       'print 1; )', 'var 1 int;', 'print $ 2 +;\n', 'f(1, 2', 'else { }']:
+            tree, errors = parse(pratt, source)
+            self.assertTrue(errors, source)
+            self.assertSameParse(source)
+
+    def test_without_ply(self):
+        script = ("import sys, gonebin; gonebin.compile_file('tests/functions/mandel.g', 'pratt'); "
+                  "print(any(name.startswith('ply') for name in sys.modules))")
+        output = subprocess.check_output([sys.executable, '-c', script]).decode().split()
+        self.assertEqual(output[-1], 'False')
+
+
+class TestParallel(unittest.TestCase):
+    def test_boundaries(self):
+        # Braces in strings and comments do not count, nor does a } before else
+        source = ('var x int;\nif x { print "}"; }\n/* } */ else { }\n'
+                  'func f() int { // {\n}\nprint 1;')
+        ends = goneparallel.boundaries(source)
+        self.assertEqual(ends, [source.index(';') + 1, source.index('else { }') + 8,
+                                source.index('// {\n}') + 6, len(source)])
+        chunks = goneparallel.split_source(source, 3)
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(''.join(chunk for offset, chunk in chunks), source)
+        self.assertTrue(all(offset in [0] + ends for offset, chunk in chunks))
+
+    def test_parse(self):
+        sources = [open(path).read() for path in sorted(glob.glob('tests/*/*.g'))]
+        source = '\n'.join(sources)
+        errors = []
+        with subscribe_errors(errors.append):
+            program = goneparallel.parse_source(source, 'pratt', jobs=3)
+        self.assertEqual(errors, [])
+        self.assertEqual(([(depth, repr(node), node.lineno) for depth, node in flatten(program)],
+                          []), parse(lalr, source))
+
+    def test_errors(self):
+        # Errors are those of a serial parse, reported once
+        source = 'var x int;\nprint x +;\n' * 20 + 'var y int = $ 2;\n' + 'print y;\n' * 20
+        errors = []
+        with subscribe_errors(errors.append):
+            program = goneparallel.parse_source(source, 'lalr', jobs=2)
+        self.assertEqual(errors, parse(lalr, source)[1])
+
+
+if __name__ == '__main__':
+    unittest.main()